@@ -0,0 +1,482 @@
+#!/usr/bin/env python
+
+import asyncio
+import json
+import threading
+import time
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+try:
+    from aiohttp import web, ClientSession, ClientTimeout, TCPConnector, ClientConnectionError
+except ImportError:
+    web = None
+
+import metrics
+import server
+import tracing
+import wire
+from node import *
+from pool import POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT
+
+# asyncio mode of the chordify server. The routing and replication
+# endpoints run natively on the event loop with non-blocking outbound
+# calls, so a forwarded request does not pin a thread on every node of
+# its path. Every other route (join, depart, transferKeys, ...) is served
+# by the Flask application of server.py in a worker thread.
+# State (node, ip, port, ...) is shared with the server module.
+
+session = None
+# Route of the requests handed over to the Flask application
+FALLBACK = '/{tail:.*}'
+# Headers of a connection, not of the response: aiohttp sets its own
+HOP_BY_HOP = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailers",
+              "transfer-encoding", "upgrade", "content-length"}
+
+async def call(method, ip, port, path, params = None, data = None):
+    # Returns (data, status) like server.from_response
+    params = tracing.carry(path, params)
+    if params != None:
+        params = {k:str(v) for (k,v) in params.items()}
+    url = "http://{}:{}{}".format(ip, port, path)
+    peer = "{}:{}".format(ip, port)
+    start = time.perf_counter()
+    status = None
+    try:
+        async with session.request(method, url, params=params, json=data) as r:
+            status = r.status
+            if r.status == 200 and r.content_type == 'application/json':
+                return await r.json(), 200
+            return await r.text(), r.status
+    finally:
+        metrics.peer_call(peer, path, "http", start, status != None and status < 500)
+        tracing.called(peer, path, start, status)
+
+async def forward(node, method, successor, path, params = None, data = None):
+    # Same as server.forward: drop fingers of departed nodes and use next node
+    if successor.key == node.next_node.key:
+        return await call(method, successor.ip, successor.port, path, params, data)
+
+    try:
+        data_status = await call(method, successor.ip, successor.port, path, params, data)
+        if not data_status[1] == 403:
+            return data_status
+    except ClientConnectionError:
+        pass
+
+    node.remove_finger(successor.key)
+    return await call(method, node.next_node.ip, node.next_node.port, path, params, data)
+
+async def replicate(target, key_value, method, path, params):
+    # Queue on the replication pipeline without blocking the event loop
+    if not server.replication.submit(key_value, method, target.ip, target.port, path, params, block=False):
+        await asyncio.to_thread(server.replication.submit, key_value, method, target.ip, target.port, path, params)
+
+def respond(data, status):
+    if isinstance(data, str):
+        return web.Response(text=data, status=status, content_type='text/html')
+    return web.Response(text=json.dumps(data), status=status, content_type='application/json')
+
+async def update(node, function, *args):
+    # With durable storage an update waits for the disk, so it runs in a thread
+    if node.storage == None:
+        return function(*args)
+    return await asyncio.to_thread(function, *args)
+
+def joined(handler):
+    async def wrapper(request):
+        if server.node is None:
+            return web.Response(text="You have to join first.", status=403, content_type='text/html')
+        return await handler(request)
+    return wrapper
+
+async def insert_key(node, key_value, value):
+    successor = node.successor(key_value)
+
+    if successor.key == node.key:
+
+        key = await update(node, node.add_key, key_value, value)
+        data = {
+            "hash": key,
+            "key": key_value,
+            "value": value,
+            "node_ip": node.ip,
+            "node_port": node.port,
+        }
+
+        # Node with the first replica, if any
+        target = node.replica_next(key, 0)
+
+        if target != None:
+
+            params = {"key":key_value,"value":value,"replica_number":1}
+
+            if node.consistency_type == "chain-replication":
+                await call("POST", target.ip, target.port, "/insertReplicasBatch", data=json.dumps({"replicas":[params]}))
+
+            elif node.consistency_type == "eventual-consistency":
+                await replicate(target, key_value, "POST", "/insertReplicas", params)
+
+        return data, 200
+
+    else:
+        return await forward(node, "POST", successor, "/insert", {"key":key_value,"value":value})
+
+async def query_key(node, key_value):
+    key = hash_key(key_value)
+    successor = node.successor(key_value)
+
+    if successor.key == node.key:
+
+        if key in node.data:
+
+            data = {
+                    "hash": key,
+                    "key": node.data[key][0],
+                    "value": node.data[key][1],
+                    "replica_number": "original",
+                    "node_ip": node.ip,
+                    "node_port": node.port,
+                }
+
+            target = node.replica_next(key, 0)
+            if target != None and node.consistency_type == "chain-replication":
+                next_data, status = await call("GET", target.ip, target.port, "/queryReplicas", {"key":key_value})
+                if not status == 204:
+                    return next_data, status
+
+            return data, 200
+        else:
+            return "Key not found.", 404
+    else:
+
+        if node.kappa > 1 and key in node.replicas:
+
+            data = {
+                "hash": key,
+                "key": node.replicas[key][0],
+                "value": node.replicas[key][1],
+                "replica_number": node.replicas[key][2],
+                "node_ip": node.ip,
+                "node_port": node.port,
+            }
+
+            if node.consistency_type == "eventual-consistency":
+                return data, 200
+
+            elif node.consistency_type == "chain-replication":
+
+                target = node.replica_next(key, node.replicas[key][2])
+
+                # Last replica, or next node is the primary, so this is the tail of the chain
+                if target == None or in_range(key, node.key, node.next_node.key):
+                    return data, 200
+                else:
+                    return await call("GET", target.ip, target.port, "/query", {"key":key_value})
+
+        return await forward(node, "GET", successor, "/query", {"key":key_value})
+
+async def delete_key(node, key_value):
+    key = hash_key(key_value)
+    successor = node.successor(key_value)
+
+    if successor.key == node.key:
+        if key in node.data:
+
+            data = {
+                "hash": key,
+                "key": node.data[key][0],
+                "value": node.data[key][1],
+                "node_ip": node.ip,
+                "node_port": node.port,
+            }
+
+            await update(node, node.data.__delitem__, key)
+
+            target = node.replica_next(key, 0)
+
+            if target != None:
+
+                params = {"key":key_value,"replica_number":1}
+
+                if node.consistency_type == "chain-replication":
+                    text, status = await call("DELETE", target.ip, target.port, "/deleteReplicas", params)
+                    if not status == 200:
+                        return text, status
+
+                elif node.consistency_type == "eventual-consistency":
+                    await replicate(target, key_value, "DELETE", "/deleteReplicas", params)
+
+            return data, 200
+        else:
+            return "Key not found.", 404
+    else:
+        return await forward(node, "DELETE", successor, "/delete", {"key":key_value})
+
+@joined
+async def insert(request):
+    return respond(*(await insert_key(server.node, request.query.get("key"), request.query.get("value"))))
+
+@joined
+async def query(request):
+    if request.query.get("key") == "*":
+        return await wsgi_fallback(request)
+    return respond(*(await query_key(server.node, request.query.get("key"))))
+
+@joined
+async def delete(request):
+    return respond(*(await delete_key(server.node, request.query.get("key"))))
+
+async def batch(request, path, operation):
+    # Same grouping as server.batch_apply, with coroutines instead of threads
+    node = server.node
+    items = json.loads(await request.json())["items"]
+
+    groups = {}
+    for index, item in enumerate(items):
+        successor = node.successor(item["key"])
+        if not successor.key in groups:
+            groups[successor.key] = (successor, [])
+        groups[successor.key][1].append(index)
+
+    async def local(index):
+        data, status = await operation(node, items[index])
+        return [(index, {"key":items[index]["key"], "status":status, "data":data})]
+
+    async def remote(successor, indexes):
+        try:
+            data, status = await forward(node, "POST", successor, path, data=json.dumps({"items":[items[i] for i in indexes]}))
+            if status == 200:
+                return list(zip(indexes, data["results"]))
+        except ClientConnectionError as e:
+            data, status = str(e), 500
+        return [(i, {"key":items[i]["key"], "status":status, "data":data}) for i in indexes]
+
+    tasks = []
+    for (successor, indexes) in groups.values():
+        if successor.key == node.key:
+            tasks.extend(local(i) for i in indexes)
+        else:
+            tasks.append(remote(successor, indexes))
+
+    results = [None] * len(items)
+    for group in await asyncio.gather(*tasks):
+        for (index, result) in group:
+            results[index] = result
+    return respond({"results":results}, 200)
+
+@joined
+async def batch_insert(request):
+    return await batch(request, "/batchInsert", lambda node, d: insert_key(node, d["key"], d["value"]))
+
+@joined
+async def batch_query(request):
+    return await batch(request, "/batchQuery", lambda node, d: query_key(node, d["key"]))
+
+@joined
+async def batch_delete(request):
+    return await batch(request, "/batchDelete", lambda node, d: delete_key(node, d["key"]))
+
+@joined
+async def find_successor(request):
+    node = server.node
+
+    if request.query.get("key") != None:
+        key = hash_key(request.query.get("key"))
+    else:
+        key = int(request.query.get("id"))
+
+    successor = node.successor_of(key)
+    owner = successor.key == node.key or in_range(key, node.key, node.next_node.key)
+
+    if not owner and request.query.get("iterative") == None:
+        # Recursive lookup
+        return respond(*(await forward(node, "GET", successor, "/findSuccessor", {"id":key})))
+
+    return respond({"hash":successor.key, "ip":successor.ip, "port":successor.port, "owner":owner}, 200)
+
+async def insert_replicas(request):
+    node = server.node
+    if wire.is_binary(request):
+        _, key_value, value, replica_number = wire.decode_entries(await request.read())[0][0]
+    else:
+        key_value = request.query.get("key")
+        value = request.query.get("value")
+        replica_number = int(request.query.get("replica_number"))
+
+    if not node.key == node.successor(key_value).key:
+
+        await update(node, node.add_replica, key_value, value, replica_number)
+
+        target = node.replica_next(hash_key(key_value), replica_number)
+        if target != None:
+            return respond(*(await call("POST", target.ip, target.port, "/insertReplicas", {"key":key_value,"value":value,"replica_number":replica_number + 1})))
+
+    return respond("Key {} & its replicas added successfully".format(key_value), 200)
+
+async def insert_replicas_batch(request):
+    node = server.node
+    if wire.is_binary(request):
+        replicas = [{"key":key,"value":value,"replica_number":replica_number} for (_,key,value,replica_number) in wire.decode_entries(await request.read())[0]]
+    else:
+        replicas = json.loads(await request.json())["replicas"]
+    # Replicas for the next nodes of their chains, by (ip, port)
+    next_replicas = {}
+
+    for d in replicas:
+        if not node.key == node.successor(d["key"]).key:
+            await update(node, node.add_replica, d["key"], d["value"], d["replica_number"])
+            target = node.replica_next(hash_key(d["key"]), d["replica_number"])
+            if target != None:
+                next_replicas.setdefault((target.ip, target.port), []).append(
+                    {"key":d["key"],"value":d["value"],"replica_number":d["replica_number"] + 1})
+
+    for (target_ip, target_port), items in next_replicas.items():
+        text, status = await call("POST", target_ip, target_port, "/insertReplicasBatch", data=json.dumps({"replicas":items}))
+        if not status == 200:
+            return respond(text, status)
+
+    return respond("{} replicas added successfully".format(len(replicas)), 200)
+
+async def query_replicas(request):
+    node = server.node
+    key_value = request.query.get("key")
+    key = hash_key(key_value)
+    if not key in node.replicas:
+        # Chains are being repaired, the caller answers with its own copy
+        return respond("No replica of {} here.".format(key_value), 204)
+    k, v, replica_number = node.replicas[key]
+
+    if node.key == node.successor(key_value).key:
+        return respond("Replica manager only have original data.", 204)
+
+    data = {
+        "hash": key,
+        "key": key_value,
+        "value": v,
+        "replica_number": replica_number,
+        "node_ip": node.ip,
+        "node_port": node.port,
+    }
+
+    target = node.replica_next(key, replica_number)
+    if target != None:
+        next_data, status = await call("GET", target.ip, target.port, "/queryReplicas", {"key":key_value})
+        if status == 200:
+            data = next_data
+
+    if wire.accepts(request):
+        return web.Response(body=wire.encode_result(data), status=200, content_type=wire.MIME)
+    return respond(data, 200)
+
+async def delete_replicas(request):
+    node = server.node
+    key_value = request.query.get("key")
+    replica_number = int(request.query.get("replica_number"))
+
+    if not node.key == node.successor(key_value).key:
+
+        key = hash_key(key_value)
+        if key in node.replicas:
+            await update(node, node.replicas.__delitem__, key)
+
+        target = node.replica_next(key, replica_number)
+        if target != None:
+            return respond(*(await call("DELETE", target.ip, target.port, "/deleteReplicas", {"key":key_value,"replica_number":replica_number + 1})))
+
+    return respond("Key '{}' & its replicas deleted.".format(key_value), 200)
+
+def start_wsgi(method, path, query_string, headers, body):
+    # Run the Flask application up to its response: (status, headers, body
+    # iterator). The body is not read, so streamed responses stay streamed.
+    builder = EnvironBuilder(path=path, method=method, query_string=query_string, headers=headers, data=body)
+    environ = builder.get_environ()
+    environ["SERVER_NAME"] = server.ip
+    environ["SERVER_PORT"] = str(server.port)
+    app_iter, status, response_headers = run_wsgi_app(server.app, environ)
+    return int(status.split()[0]), response_headers, app_iter
+
+async def wsgi_fallback(request):
+    body = await request.read()
+    headers = [(k, v) for (k, v) in request.headers.items() if not k.lower() in ("content-length", "host")]
+    status, headers, app_iter = await asyncio.to_thread(start_wsgi, request.method, request.path, request.query_string, headers, body)
+    try:
+        # Every header of the Flask response (ETag, X-Trace-Id, ...) but the hop-by-hop ones
+        response = web.StreamResponse(status=status, headers=[(k, v) for (k, v) in headers.items() if not k.lower() in HOP_BY_HOP])
+        if "Content-Length" in headers:
+            response.content_length = int(headers["Content-Length"])
+        await response.prepare(request)
+        # Chunks may take a while to make (e.g. the dumps of other nodes),
+        # so each one is pulled in a thread, off the event loop
+        chunks = iter(app_iter)
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk == None:
+                break
+            if chunk:
+                await response.write(chunk)
+        await response.write_eof()
+        return response
+    finally:
+        if hasattr(app_iter, "close"):
+            await asyncio.to_thread(app_iter.close)
+
+async def start_session(app):
+    global session
+    timeout = ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    session = ClientSession(connector=TCPConnector(limit_per_host=POOL_SIZE), timeout=timeout)
+
+async def close_session(app):
+    await session.close()
+
+async def measure(request, handler):
+    # Metrics & spans of the native routes, the Flask application measures the rest
+    route = request.match_info.route.resource.canonical if request.match_info.route.resource != None else "unmatched"
+    if route == FALLBACK:
+        return await handler(request)
+    start = server.request_started(route)
+    token = server.tracer.begin("{}:{}".format(server.ip, server.port), request.path, request.query)
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        if token != None:
+            response.headers["X-Trace-Id"] = token[0].trace
+        return response
+    finally:
+        server.tracer.end(token, status)
+        server.request_finished(route, request.method, status, start)
+
+def create_app():
+    app = web.Application(middlewares=[web.middleware(measure)])
+    app.on_startup.append(start_session)
+    app.on_cleanup.append(close_session)
+    app.router.add_get('/query', query)
+    app.router.add_post('/insert', insert)
+    app.router.add_delete('/delete', delete)
+    app.router.add_post('/batchInsert', batch_insert)
+    app.router.add_post('/batchQuery', batch_query)
+    app.router.add_post('/batchDelete', batch_delete)
+    app.router.add_get('/findSuccessor', find_successor)
+    app.router.add_post('/insertReplicas', insert_replicas)
+    app.router.add_post('/insertReplicasBatch', insert_replicas_batch)
+    app.router.add_get('/queryReplicas', query_replicas)
+    app.router.add_delete('/deleteReplicas', delete_replicas)
+    # Everything else is served by the Flask application
+    app.router.add_route('*', FALLBACK, wsgi_fallback)
+    return app
+
+def run(ip, port, kappa, consistency):
+    if web == None:
+        print("asyncio mode requires aiohttp (pip install aiohttp)")
+        exit()
+
+    server.ip = ip
+    server.port = port
+    server.kappa = kappa
+    server.consistency = consistency
+    server.node = None
+
+    threading.Thread(target=server.fix_fingers_loop, daemon=True).start()
+    server.start_rpc()
+
+    web.run_app(create_app(), host=ip, port=port, print=None, access_log=None)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import random
+import time
+
+import node
+from node import Node, RefNode, hash_key, modulo, finger_start, M, RING_SIZE
+
+# CPU time of key hashing & ring lookups per operation: the hexdigest
+# parsing hash_key used to do, the raw digest, and the cached hash_key.
+
+def hexdigest_hash(s):
+    return modulo(int(hashlib.sha1(str.encode(s)).hexdigest(),16), RING_SIZE)
+
+def digest_hash(s):
+    return modulo(int.from_bytes(hashlib.sha1(str.encode(s)).digest(), "big"), RING_SIZE)
+
+def timed(function, keys):
+    start = time.process_time()
+    for k in keys:
+        function(k)
+    return (time.process_time() - start) / len(keys)
+
+def ring(nodes):
+    # A node with a full finger table of a ring of the given size
+    n = Node("127.0.0.1", 5000, ("127.0.0.1", 5000))
+    others = sorted((RefNode("127.0.0.1", 5001 + i) for i in range(nodes - 1)), key=lambda r: r.key)
+    after = [r for r in others if r.key > n.key] + [r for r in others if r.key < n.key]
+    n.next_node, n.previous_node = after[0], after[-1]
+    for i in range(M):
+        start = finger_start(n.key, i)
+        n.finger[i] = next((r for r in after if modulo(r.key - n.key, RING_SIZE) >= modulo(start - n.key, RING_SIZE)), after[0])
+    return n
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=10000, help="Distinct keys")
+    parser.add_argument("--lookups", type=int, default=200000, help="Lookups, keys are drawn at random")
+    parser.add_argument("--nodes", type=int, default=64, help="Ring size for the successor() lookups")
+    args = parser.parse_args()
+
+    keys = ["key-{}".format(i) for i in range(args.keys)]
+    lookups = [random.choice(keys) for _ in range(args.lookups)]
+    hash_key.cache_clear()
+    for k in keys:
+        hash_key(k)
+    n = ring(args.nodes)
+
+    print("{:<36} {:>10}".format("operation", "ns/op"))
+    for name, function in [
+        ("sha1 + hexdigest parse", hexdigest_hash),
+        ("sha1 + raw digest", digest_hash),
+        ("hash_key (cached)", hash_key),
+        ("successor(key) ({} nodes)".format(args.nodes), n.successor),
+        ("successor_of(hash) ({} nodes)".format(args.nodes), lambda k: n.successor_of(hash_key(k))),
+    ]:
+        print("{:<36} {:>10.0f}".format(name, timed(function, lookups) * 1e9))
+    info = hash_key.cache_info()
+    print("hash_key cache: {} hits, {} misses, {}/{} entries".format(info.hits, info.misses, info.currsize, node.HASH_CACHE_SIZE))
+
+if __name__ == "__main__":
+    main()
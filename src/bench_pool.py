@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+import multiprocessing
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from flask import Flask
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from pool import ConnectionPool
+
+# Microbenchmark of a single inter-node hop: a fresh Session per call
+# (the old behaviour of server.py) against the shared connection pool.
+
+app = Flask(__name__)
+logging.getLogger('werkzeug').disabled = True
+
+@app.route('/nextNode')
+def next_node():
+    return {"ip":"127.0.0.1","port":0}
+
+def fresh_session_hop(ip, port):
+    s = requests.Session()
+    s.mount('http://', HTTPAdapter(max_retries=0))
+    s.get("http://{}:{}/nextNode".format(ip, port))
+
+def run(hop, threads, hops):
+    def worker():
+        for _ in range(hops):
+            hop()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.time()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return threads * hops / (time.time() - start)
+
+def serve(ip, port):
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    make_server(ip, port, app, threaded=True).serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ip", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5999)
+    parser.add_argument("--remote", action="store_true", help="Target a running chordify node instead of a local server")
+    parser.add_argument("--hops", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    server = None
+    if not args.remote:
+        # Run the server in its own process, so it does not share the GIL
+        server = multiprocessing.Process(target=serve, args=(args.ip, args.port), daemon=True)
+        server.start()
+        while True:
+            try:
+                requests.get("http://{}:{}/nextNode".format(args.ip, args.port))
+                break
+            except requests.exceptions.ConnectionError:
+                time.sleep(0.05)
+
+    pooled = ConnectionPool()
+    before = run(lambda: fresh_session_hop(args.ip, args.port), args.threads, args.hops)
+    after = run(lambda: pooled.get(args.ip, args.port, "/nextNode"), args.threads, args.hops)
+
+    print(f"New session per hop: {before:.1f} hops/sec")
+    print(f"Pooled keep-alive:   {after:.1f} hops/sec")
+    print(f"Speedup:             {after / before:.2f}x")
+
+    if server != None:
+        server.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import threading
+import time
+import requests
+
+from bench_ring import PHASES, summary, workload
+from bench_server_modes import start_ring, stop_ring
+
+# Read benchmark of a local ring, per consistency mode: loads the
+# insert/ files, then runs the queries/ files at once, client i asking
+# node i % N. Every query asks the ring for its timings (stats=1), so the
+# latency of a read is broken down into:
+#   routing    forwarding /query towards the node responsible for the key
+#   chain      walking the replica chain down to its tail (/queryReplicas)
+#   local      the lookup at the node that answered
+#   serialize  encoding the answer at the node we asked
+#   http       the rest: HTTP to & from the node we asked (server side too), decoding
+
+def load(ip, port, files):
+    items = [{"key":key, "value":key} for keys in files for key in keys]
+    for i in range(0, len(items), 1000):
+        r = requests.post("http://{}:{}/batchInsert".format(ip, port), json=json.dumps({"items":items[i:i + 1000]}))
+        if not r.status_code == 200:
+            raise RuntimeError("Could not load the keys: {}".format(r.text))
+
+def run_queries(ip, base_port, nodes, files, with_stats):
+    # Returns the samples of every query (latency in seconds, answer stats,
+    # decode ms) and the seconds it took
+    samples = [[] for _ in files]
+
+    def client(c):
+        s = requests.Session()
+        url = "http://{}:{}/query".format(ip, base_port + c % nodes)
+        for key in files[c]:
+            params = {"key":key, "stats":1} if with_stats else {"key":key}
+            start = time.perf_counter()
+            r = s.get(url, params=params)
+            received = time.perf_counter()
+            stats = r.json().get("stats") if r.status_code == 200 else None
+            decoded = time.perf_counter()
+            samples[c].append((decoded - start, stats, (decoded - received) * 1000))
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(len(files))]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return [sample for client_samples in samples for sample in client_samples], time.perf_counter() - start
+
+def breakdown(samples):
+    # Mean hops & milliseconds per part of the reads that reported timings
+    timed = [(latency, stats, decode) for (latency, stats, decode) in samples if stats != None]
+    if not timed:
+        return {}
+    n = len(timed)
+    result = {
+        "routing_hops": sum(s["routing_hops"] for (_, s, _) in timed) / n,
+        "chain_hops": sum(s["chain_hops"] for (_, s, _) in timed) / n,
+    }
+    for part in ["routing_ms", "chain_ms", "local_ms", "serialize_ms"]:
+        result[part] = sum(s.get(part, 0.0) for (_, s, _) in timed) / n
+    result["http_ms"] = sum(latency * 1000 - s["total_ms"] - s.get("serialize_ms", 0.0) for (latency, s, _) in timed) / n
+    result["decode_ms"] = sum(decode for (_, _, decode) in timed) / n
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Read latency breakdown of a local ring per consistency mode")
+    parser.add_argument("--nodes", type=int, default=10)
+    parser.add_argument("--kappa", type=int, default=3)
+    parser.add_argument("--consistency", nargs="+", default=["chain-replication", "eventual-consistency"])
+    parser.add_argument("--mode", type=str, default="flask", choices=["flask", "asyncio"])
+    parser.add_argument("--port", type=int, default=5400)
+    parser.add_argument("--repeat", type=int, default=5, help="Times every query file is run")
+    parser.add_argument("--no-stats", dest="stats", action="store_false", help="Plain queries, to measure throughput without the timings")
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    ip = "127.0.0.1"
+    inserts = workload(PHASES["insert"])
+    queries = [keys * args.repeat for keys in workload(PHASES["query"])]
+
+    results = []
+    for consistency in args.consistency:
+        procs = start_ring(ip, args.port, args.nodes, args.kappa, consistency, args.mode)
+        try:
+            load(ip, args.port, inserts)
+            samples, seconds = run_queries(ip, args.port, args.nodes, queries, args.stats)
+        finally:
+            stop_ring(procs)
+
+        result = {"consistency":consistency, "nodes":args.nodes, "kappa":args.kappa, "queries":len(samples),
+                  "seconds":seconds, "throughput":len(samples) / seconds}
+        result.update(summary([latency for (latency, _, _) in samples]))
+        result["breakdown"] = breakdown(samples)
+        results.append(result)
+
+    print("{} nodes, k={}".format(args.nodes, args.kappa))
+    print("{:<22} {:>9} {:>8} {:>8} {:>8}".format("consistency", "reads/s", "p50 ms", "p95 ms", "p99 ms"))
+    for r in results:
+        print("{:<22} {:>9.1f} {:>8.2f} {:>8.2f} {:>8.2f}".format(r["consistency"], r["throughput"], r["p50_ms"], r["p95_ms"], r["p99_ms"]))
+    if args.stats:
+        print()
+        print("Mean per read:")
+        print("{:<22} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+            "consistency", "r hops", "c hops", "routing", "chain", "local", "encode", "http", "decode"))
+        for r in results:
+            b = r["breakdown"]
+            if not b:
+                # No read reported timings (the native asyncio handlers do not)
+                print("{:<22} {:>8}".format(r["consistency"], "n/a"))
+                continue
+            print("{:<22} {:>8.2f} {:>8.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+                r["consistency"], b["routing_hops"], b["chain_hops"], b["routing_ms"], b["chain_ms"],
+                b["local_ms"], b["serialize_ms"], b["http_ms"], b["decode_ms"]))
+        print("(milliseconds, http includes decode)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import glob
+import json
+import os
+import subprocess
+import threading
+import time
+import requests
+
+from bench_server_modes import start_ring, stop_ring
+
+# Insert & query benchmark of a local ring, over the replication matrix
+# k = {1, 3, 5} x {chain-replication, eventual-consistency}.
+# For every configuration it starts N server.py nodes on localhost,
+# forms the ring over HTTP and replays the insert/ & queries/ files,
+# one client per file, all of them at once. Client i talks to node i % N.
+# Latencies are measured per request, from send to full response.
+#
+# Results are written as JSON and/or CSV, labelled with the commit,
+# so runs of different commits can be compared.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASES = {
+    "insert": os.path.join(ROOT, "insert", "insert_*_part.txt"),
+    "query": os.path.join(ROOT, "queries", "query_*.txt"),
+}
+FIELDS = ["label", "mode", "nodes", "kappa", "consistency", "phase", "clients", "operations", "errors",
+          "seconds", "throughput", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+
+def percentile(ordered, p):
+    # Nearest rank percentile of an ordered list
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+def summary(latencies):
+    ordered = sorted(latencies)
+    return {
+        "mean_ms": sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+        "p50_ms": percentile(ordered, 50) * 1000,
+        "p95_ms": percentile(ordered, 95) * 1000,
+        "p99_ms": percentile(ordered, 99) * 1000,
+        "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+    }
+
+def workload(pattern, limit = None):
+    # The keys of every file of the phase, one list per client
+    files = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path) as f:
+            keys = [line.strip() for line in f if line.strip()]
+        files.append(keys[:limit] if limit else keys)
+    return files
+
+def run_phase(ip, base_port, nodes, phase, files):
+    # Returns (latencies, errors, seconds) of the clients replaying files
+    latencies = [[] for _ in files]
+    errors = [0] * len(files)
+
+    def client(c):
+        s = requests.Session()
+        port = base_port + c % nodes
+        for key in files[c]:
+            start = time.perf_counter()
+            try:
+                if phase == "insert":
+                    r = s.post("http://{}:{}/insert".format(ip, port), params={"key":key, "value":key})
+                else:
+                    r = s.get("http://{}:{}/query".format(ip, port), params={"key":key})
+                ok = r.status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            latencies[c].append(time.perf_counter() - start)
+            if not ok:
+                errors[c] += 1
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(len(files))]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = time.perf_counter() - start
+    return [l for client_latencies in latencies for l in client_latencies], sum(errors), seconds
+
+def commit_label():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def write_results(results, json_path, csv_path):
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    if csv_path:
+        new = not os.path.exists(csv_path)
+        # Appended, so one file collects the runs of many commits
+        with open(csv_path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            if new:
+                writer.writeheader()
+            writer.writerows(results)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a local chord ring over the replication matrix")
+    parser.add_argument("--nodes", type=int, default=10)
+    parser.add_argument("--kappa", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--consistency", nargs="+", default=["chain-replication", "eventual-consistency"])
+    parser.add_argument("--phases", nargs="+", default=list(PHASES), choices=list(PHASES))
+    parser.add_argument("--mode", type=str, default="flask", choices=["flask", "asyncio"])
+    parser.add_argument("--port", type=int, default=5300, help="Port of the first node, the rest use the next ones")
+    parser.add_argument("--limit", type=int, default=None, help="Keys per file")
+    parser.add_argument("--label", type=str, default=None, help="Name of the run, the commit by default")
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this JSON file")
+    parser.add_argument("--csv", type=str, default=None, help="Append the results to this CSV file")
+    args = parser.parse_args()
+
+    ip = "127.0.0.1"
+    label = args.label or commit_label()
+    files = {phase: workload(PHASES[phase], args.limit) for phase in args.phases}
+
+    results = []
+    print("{:>3} {:<22} {:<7} {:>6} {:>7} {:>10} {:>8} {:>8} {:>8}".format(
+        "k", "consistency", "phase", "ops", "errors", "ops/sec", "p50 ms", "p95 ms", "p99 ms"))
+    for kappa in args.kappa:
+        for consistency in args.consistency:
+            procs = start_ring(ip, args.port, args.nodes, kappa, consistency, args.mode)
+            try:
+                for phase in args.phases:
+                    latencies, errors, seconds = run_phase(ip, args.port, args.nodes, phase, files[phase])
+                    result = {
+                        "label": label,
+                        "mode": args.mode,
+                        "nodes": args.nodes,
+                        "kappa": kappa,
+                        "consistency": consistency,
+                        "phase": phase,
+                        "clients": len(files[phase]),
+                        "operations": len(latencies),
+                        "errors": errors,
+                        "seconds": seconds,
+                        "throughput": len(latencies) / seconds if seconds > 0 else 0.0,
+                    }
+                    result.update(summary(latencies))
+                    results.append(result)
+                    print("{:>3} {:<22} {:<7} {:>6} {:>7} {:>10.1f} {:>8.2f} {:>8.2f} {:>8.2f}".format(
+                        kappa, consistency, phase, result["operations"], errors, result["throughput"],
+                        result["p50_ms"], result["p95_ms"], result["p99_ms"]))
+            finally:
+                stop_ring(procs)
+
+    write_results(results, args.json, args.csv)
+
+if __name__ == "__main__":
+    main()
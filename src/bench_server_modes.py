@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+import requests
+
+# Throughput comparison of the two server modes (flask, asyncio):
+# starts a local ring for each mode and runs concurrent inserts & queries.
+
+def start_ring(ip, base_port, nodes, kappa, consistency, mode, timeout = 30):
+    # Start nodes bound to ip and join them into a ring. Raises RuntimeError
+    # if a node does not come up within timeout seconds or cannot join.
+    env = dict(os.environ, CHORDIFY_HOST=ip)
+    procs = []
+    for i in range(nodes):
+        procs.append(subprocess.Popen(
+            [sys.executable, "server.py", str(base_port + i), str(kappa), consistency, mode],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env=env
+        ))
+
+    joined = False
+    try:
+        deadline = time.time() + timeout
+        for i in range(nodes):
+            while True:
+                try:
+                    requests.get("http://{}:{}/".format(ip, base_port + i), timeout=1)
+                    break
+                except requests.exceptions.RequestException:
+                    if time.time() > deadline or procs[i].poll() != None:
+                        raise RuntimeError("Node {}:{} did not start".format(ip, base_port + i))
+                    time.sleep(0.1)
+
+        for i in range(nodes):
+            r = requests.put("http://{}:{}/join".format(ip, base_port + i), params={"ip":ip, "port":base_port})
+            if not r.status_code == 200:
+                raise RuntimeError("Node {}:{} could not join: {}".format(ip, base_port + i, r.text))
+        joined = True
+    finally:
+        if not joined:
+            stop_ring(procs)
+
+    # Give the fix-fingers loop time to fill the finger tables
+    time.sleep(3)
+    return procs
+
+def stop_ring(procs):
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        p.wait()
+
+def run_clients(ip, base_port, nodes, clients, operations, method, path, params_of):
+    def client(c):
+        s = requests.Session()
+        for i in range(operations):
+            port = base_port + (c + i) % nodes
+            s.request(method, "http://{}:{}{}".format(ip, port, path), params=params_of(c, i))
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return clients * operations / (time.time() - start)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--operations", type=int, default=100, help="Operations per client")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--consistency", type=str, default="chain-replication")
+    parser.add_argument("--port", type=int, default=5200)
+    args = parser.parse_args()
+
+    ip = "127.0.0.1"
+    results = {}
+    for mode in ["flask", "asyncio"]:
+        procs = start_ring(ip, args.port, args.nodes, args.k, args.consistency, mode)
+        try:
+            inserts = run_clients(ip, args.port, args.nodes, args.clients, args.operations, "POST", "/insert",
+                                  lambda c, i: {"key":"key-{}-{}".format(c, i), "value":str(i)})
+            queries = run_clients(ip, args.port, args.nodes, args.clients, args.operations, "GET", "/query",
+                                  lambda c, i: {"key":"key-{}-{}".format(c, i)})
+            results[mode] = (inserts, queries)
+        finally:
+            stop_ring(procs)
+
+    print(f"{args.nodes} nodes, k={args.k}, {args.consistency}, {args.clients} clients")
+    for mode, (inserts, queries) in results.items():
+        print(f"{mode:>8}: {inserts:.1f} inserts/sec, {queries:.1f} queries/sec")
+
+if __name__ == "__main__":
+    main()
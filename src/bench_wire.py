@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import time
+
+import wire
+from node import hash_key
+
+# Bytes on the wire & CPU time (encode + decode) per operation of the
+# internal endpoints, JSON (as sent by server.py) vs the binary encoding.
+
+def timed(function, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        function()
+    return (time.process_time() - start) / repeat
+
+def cases(keys, value_size):
+    entries = [(hash_key("key-{}".format(i)), "key-{}".format(i), "v" * value_size) for i in range(keys)]
+    replicas = [{"key":key,"value":value,"replica_number":1} for (_,key,value) in entries]
+    hashes = [k for (k,_,_) in entries]
+    result = {"hash":entries[0][0], "key":entries[0][1], "value":entries[0][2], "replica_number":1, "node_ip":"192.168.0.10", "node_port":5000}
+
+    # name: (json encode, json decode, binary encode, binary decode)
+    return {
+        "insertReplicas (1 key)": (
+            lambda: "key={}&value={}&replica_number=1".format(entries[0][1], entries[0][2]).encode(),
+            lambda b: b.decode().split("&"),
+            lambda: wire.encode_entries([(None, entries[0][1], entries[0][2], 1)], with_hash=False),
+            lambda b: wire.decode_entries(b),
+        ),
+        "insertReplicasBatch ({} keys)".format(keys): (
+            lambda: json.dumps(json.dumps({"replicas":replicas})).encode(),
+            lambda b: json.loads(json.loads(b))["replicas"],
+            lambda: wire.encode_entries(((None,d["key"],d["value"],d["replica_number"]) for d in replicas), with_hash=False),
+            lambda b: wire.decode_entries(b),
+        ),
+        "fixReplicas ({} hashes)".format(keys): (
+            lambda: json.dumps(json.dumps({"keys":hashes})).encode(),
+            lambda b: json.loads(json.loads(b))["keys"],
+            lambda: wire.encode_hashes(hashes),
+            lambda b: wire.decode_hashes(b),
+        ),
+        "send/transferKeys ({} keys)".format(keys): (
+            lambda: json.dumps(json.dumps({"keys":[{"key_hash":k,"key":key,"value":value} for (k,key,value) in entries]})).encode(),
+            lambda b: json.loads(json.loads(b))["keys"],
+            lambda: wire.encode_entries((k,key,value,None) for (k,key,value) in entries),
+            lambda b: wire.decode_entries(b),
+        ),
+        "queryReplicas (result)": (
+            lambda: json.dumps(result).encode(),
+            lambda b: json.loads(b),
+            lambda: wire.encode_result(result),
+            lambda b: wire.decode_result(b),
+        ),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=1000, help="Keys per batch message")
+    parser.add_argument("--value-size", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print("{:<32} {:>10} {:>10} {:>7} {:>11} {:>11} {:>7}".format("operation", "json B", "binary B", "saved", "json us", "binary us", "saved"))
+    for name, (json_encode, json_decode, binary_encode, binary_decode) in cases(args.keys, args.value_size).items():
+        json_body, binary_body = json_encode(), binary_encode()
+        json_time = timed(lambda: json_decode(json_encode()), args.repeat) * 1e6
+        binary_time = timed(lambda: binary_decode(binary_encode()), args.repeat) * 1e6
+        print("{:<32} {:>10} {:>10} {:>6.0%} {:>11.1f} {:>11.1f} {:>6.0%}".format(
+            name, len(json_body), len(binary_body), 1 - len(binary_body) / len(json_body),
+            json_time, binary_time, 1 - binary_time / json_time))
+
+if __name__ == "__main__":
+    main()
@@ -65,12 +65,13 @@ def port_in_use(ip, port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         return s.connect_ex((ip, port)) == 0
 
-def start_server(kappa, consistency_type):
-    ip = socket.gethostbyname(socket.gethostname())
-    # Find available port
+def start_server(kappa, consistency_type, server_mode, vnodes = 1):
+    # Same address as the server binds to
+    ip = os.environ.get("CHORDIFY_HOST") or socket.gethostbyname(socket.gethostname())
+    # Find available port, and the next ones for the virtual nodes of the server
     port = None
     for p in range(5000,5150):
-        if port_in_use(ip, p) == 0:
+        if not any(port_in_use(ip, p + v) for v in range(vnodes)):
             port = p
             break
 
@@ -82,10 +83,11 @@ def start_server(kappa, consistency_type):
     # Set environment variables for cli commands
     os.environ['CHORDIFYSERVER_IP'] = ip
     os.environ['CHORDIFYSERVER_PORT'] = str(port)
+    os.environ['CHORDIFY_VNODES'] = str(vnodes)
 
     pid = os.fork()
     if pid == 0:
-        os.execle("./server.py","server.py",str(port),str(kappa),consistency_type,os.environ)
+        os.execle("./server.py","server.py",str(port),str(kappa),consistency_type,server_mode,os.environ)
         # The following should never get executed:
         click.echo("Couldn't start chordify server")     
     else:
@@ -100,6 +102,29 @@ def start_server(kappa, consistency_type):
     
     return True
 
+def check_and_return_vnodes():
+    # --vnodes N makes the server claim N identifiers on the ring
+    if "--vnodes" in sys.argv:
+        index = sys.argv.index("--vnodes")
+        try:
+            vnodes = int(sys.argv[index + 1])
+        except (IndexError, ValueError):
+            click.echo("--vnodes takes a positive integer!")
+            exit()
+        if vnodes <= 0:
+            click.echo("--vnodes takes a positive integer!")
+            exit()
+        del sys.argv[index:index + 2]
+        return vnodes
+    return int(os.environ.get("CHORDIFY_VNODES", 1))
+
+def check_and_return_server_mode():
+    # --asyncio selects the asyncio server instead of the threaded Flask one
+    if "--asyncio" in sys.argv:
+        sys.argv.remove("--asyncio")
+        return "asyncio"
+    return "flask"
+
 def check_and_return_chordify_parameters():
 
     if len(sys.argv) < 2:
@@ -130,13 +155,15 @@ def check_and_return_chordify_parameters():
 
 def main():
 
+    server_mode = check_and_return_server_mode()
+    vnodes = check_and_return_vnodes()
     kappa, consistency_type = check_and_return_chordify_parameters()
 
     f = Figlet(font='slant')
     click.echo(f.renderText('CHORDIFLYYY'))
     click.echo("Welcome to Our Chord Implementation!!\n")
 
-    if not start_server(kappa, consistency_type):
+    if not start_server(kappa, consistency_type, server_mode, vnodes):
         exit() 
     chordifyshell = ChordifyShell()
     try:
@@ -2,11 +2,13 @@
 
 import click
 import requests
+import json
 import socket
 from pathlib import Path
 import os
 import time
 from prettytable import PrettyTable
+from client import Client
 
 CONTEXT_SETTINGS = dict(help_option_names=['--help','-h'])
 
@@ -20,6 +22,31 @@ def chordify_server_addr():
     else:
         return ip, int(port)
 
+def resolve_owner(ip, port, key):
+    # Iterative lookup: follow the hops returned by /findSuccessor
+    # until the node responsible for the key is reached
+    while True:
+        url = "http://{}:{}/findSuccessor".format(ip,port)
+        r = requests.get(url, params={"key":key,"iterative":1})
+        if r.status_code != 200:
+            click.echo(r.text)
+            return None
+        data = r.json()
+        ip, port = data["ip"], int(data["port"])
+        if data["owner"]:
+            return ip, port
+
+def page_table(store, items):
+    # Table of one page of a streamed dump
+    t = PrettyTable()
+    if store == "keys":
+        t.field_names = ["Hash", "Key", "Value"]
+    else:
+        t.field_names = ["Hash", "Key", "Value", "Replica Number"]
+    for k in items:
+        t.add_row(list(k.values()))
+    return t
+
 @click.group(add_help_option=False,options_metavar="",subcommand_metavar="COMMAND [OPTIONS] [ARGS]")
 def cli_group():
     pass
@@ -80,7 +107,10 @@ def join(bnode):
 
 @cli_group.command(context_settings=CONTEXT_SETTINGS)
 @click.argument('key', metavar='<key>')
-def query(key):
+@click.option('-i','--iterative',is_flag=True,help='Resolve the responsible node first and contact it directly')
+@click.option('-d','--direct',is_flag=True,help='Route with a copy of the ring, straight to a node that holds the key')
+@click.option('--page-size','page_size',default=100,type=click.IntRange(min=1),help='Keys per table when listing all keys (<key> is *)')
+def query(key, iterative, direct, page_size):
     """
         Finds the value of <key>.
     """
@@ -88,37 +118,45 @@ def query(key):
 
     if key == "*":
 
+        # Streamed a page at a time, so big rings are never held in memory
         url = "http://{}:{}/queryAll".format(ip,port)
-        r = requests.get(url)
+        r = requests.get(url, params={"format":"ndjson","limit":page_size}, stream=True)
 
         if r.status_code == 200:
-            data = r.json()
-            for node in data:
-
-                click.echo("Node Info:")
-                click.echo(f"* Node Hash: {node['node']['hash']}")
-                click.echo(f"* Node IP: {node['node']['ip']}")
-                click.echo(f"* Node Port: {node['node']['port']}")
-                click.echo()
-
-                click.echo("Primary Keys:")
-                t1 = PrettyTable()
-                t1.field_names = ["Hash", "Key", "Value"]
-                for k in node["keys"]:
-                    t1.add_row(list(k.values()))
-                print(t1)
-
-                click.echo()
-                click.echo("Replicas Keys:")
-                t2 = PrettyTable()
-                t2.field_names = ["Hash", "Key", "Value", "Replica Number"]
-                for k in node["replicas"]:
-                    t2.add_row(list(k.values()))
-                print(t2)
-                click.echo()
+            current = None
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                page = json.loads(line)
+                if current == None or page["node"] != current[0]:
+                    if current != None:
+                        click.echo()
+                    current = (page["node"], None)
+                    click.echo("Node Info:")
+                    click.echo(f"* Node Hash: {page['node']['hash']}")
+                    click.echo(f"* Node IP: {page['node']['ip']}")
+                    click.echo(f"* Node Port: {page['node']['port']}")
+                    click.echo()
+                if page["store"] != current[1]:
+                    current = (page["node"], page["store"])
+                    if page["store"] == "replicas":
+                        click.echo()
+                    click.echo("Primary Keys:" if page["store"] == "keys" else "Replicas Keys:")
+                print(page_table(page["store"], page["items"]))
+            click.echo()
+        else:
+            click.echo(r.text)
     else:
-        url = "http://{}:{}/query".format(ip,port)
-        r = requests.get(url, params={"key":key})
+        if direct:
+            r = Client(ip, port).query(key)
+        else:
+            if iterative:
+                owner = resolve_owner(ip, port, key)
+                if owner == None:
+                    return
+                ip, port = owner
+            url = "http://{}:{}/query".format(ip,port)
+            r = requests.get(url, params={"key":key})
         if r.status_code == 200:
             t1 = PrettyTable()
             t1.field_names = ["Hash", "Key", "Value","Replica Number","Node IP", "Node Port"]
@@ -131,14 +169,25 @@ def query(key):
 @cli_group.command(context_settings=CONTEXT_SETTINGS)
 @click.argument('key', metavar='<key>')
 @click.argument('value', metavar='<value>')
-def insert(key, value):
+@click.option('-i','--iterative',is_flag=True,help='Resolve the responsible node first and contact it directly')
+@click.option('-d','--direct',is_flag=True,help='Route with a copy of the ring, straight to the responsible node')
+def insert(key, value, iterative, direct):
     """
         Inserts the pair (<key>, <value>).
     """
     ip, port = chordify_server_addr()
 
-    url = "http://{}:{}/insert".format(ip,port)
-    r = requests.post(url, params={"key":key,"value":value})
+    if direct:
+        r = Client(ip, port).insert(key, value)
+    else:
+        if iterative:
+            owner = resolve_owner(ip, port, key)
+            if owner == None:
+                return
+            ip, port = owner
+
+        url = "http://{}:{}/insert".format(ip,port)
+        r = requests.post(url, params={"key":key,"value":value})
     if r.status_code == 200:
         t1 = PrettyTable()
         t1.field_names = ["Hash", "Key", "Value","Node IP", "Node Port"]
@@ -151,14 +200,25 @@ def insert(key, value):
 
 @cli_group.command(context_settings=CONTEXT_SETTINGS)
 @click.argument('key', metavar='<key>')
-def delete(key):
+@click.option('-i','--iterative',is_flag=True,help='Resolve the responsible node first and contact it directly')
+@click.option('-d','--direct',is_flag=True,help='Route with a copy of the ring, straight to the responsible node')
+def delete(key, iterative, direct):
     """
         Deletes the specified <key>.
     """
     ip, port = chordify_server_addr()
 
-    url = "http://{}:{}/delete".format(ip,port)
-    r = requests.delete(url, params={"key":key})
+    if direct:
+        r = Client(ip, port).delete(key)
+    else:
+        if iterative:
+            owner = resolve_owner(ip, port, key)
+            if owner == None:
+                return
+            ip, port = owner
+
+        url = "http://{}:{}/delete".format(ip,port)
+        r = requests.delete(url, params={"key":key})
     if r.status_code == 200:
         t1 = PrettyTable()
         t1.field_names = ["Hash", "Key", "Value","Node IP", "Node Port"]
@@ -207,49 +267,54 @@ def overlay():
 
         click.echo("Info of whole Cluster:")
         t1 = PrettyTable()
-        t1.field_names = ["Hash", "Node IP", "Node Port"]
+        t1.field_names = ["Hash", "Node IP", "Node Port", "Server", "Share"]
         data["nodes"].sort(key = lambda d: d["node_key"])
         for d in data["nodes"]:
+            row = [d["node_key"], d["ip"], d["port"], d["server"], "{:.2%}".format(d["share"])]
             if d["ip"] == ip and d["port"] == port:
-                t1.add_row(list(map(lambda x: click.style(str(x),fg='green'), list(d.values()))))
+                t1.add_row(list(map(lambda x: click.style(str(x),fg='green'), row)))
             else:
-                t1.add_row(list(d.values()))
+                t1.add_row(row)
         print(t1)
+
+        click.echo("Key space share per server:")
+        t2 = PrettyTable()
+        t2.field_names = ["Server", "Virtual Nodes", "Share"]
+        for d in sorted(data["servers"], key = lambda d: d["share"], reverse=True):
+            t2.add_row([d["server"], d["vnodes"], "{:.2%}".format(d["share"])])
+        print(t2)
     else:
         click.echo(r.text)
 
 @cli_group.command(context_settings=CONTEXT_SETTINGS)
-def info():
+@click.option('--page-size','page_size',default=100,type=click.IntRange(min=1),help='Keys per table')
+def info(page_size):
     """
         Displays info of current node.
     """
     ip, port = chordify_server_addr()
 
     url = "http://{}:{}/info".format(ip,port)
-    r = requests.get(url)
+    r = requests.get(url, params={"format":"ndjson","limit":page_size}, stream=True)
     if r.status_code == 200:
 
-        data = r.json()
+        lines = (json.loads(line) for line in r.iter_lines() if line)
+        # Neighbours first, then the keys a page at a time
+        data = next(lines)
 
         click.echo("Info of current Node:")
         click.echo(f"* Current Node IP: {ip}")
         click.echo(f"* Current Node Port: {port}")
         click.echo()
 
-        click.echo("Primary Keys:")
-        t1 = PrettyTable()
-        t1.field_names = ["Hash", "Key", "Value"]
-        for k in data["keys"]:
-            t1.add_row(list(k.values()))
-        print(t1)
-
-        click.echo()
-        click.echo("Replica Keys:")
-        t2 = PrettyTable()
-        t2.field_names = ["Hash", "Key", "Value", "Replica Number"]
-        for k in data["replicas"]:
-            t2.add_row(list(k.values()))
-        print(t2)
+        store = None
+        for page in lines:
+            if page["store"] != store:
+                store = page["store"]
+                if store == "replicas":
+                    click.echo()
+                click.echo("Primary Keys:" if store == "keys" else "Replica Keys:")
+            print(page_table(store, page["items"]))
 
         click.echo()
         click.echo("Connected Nodes:")
@@ -266,6 +331,34 @@ def info():
     else:
         click.echo(r.text)
 
+@cli_group.command(context_settings=CONTEXT_SETTINGS)
+@click.argument('trace_id', metavar='<trace id>')
+def trace(trace_id):
+    """
+        Displays the hops of a request (id from its X-Trace-Id header).
+    """
+    ip, port = chordify_server_addr()
+
+    url = "http://{}:{}/trace/{}".format(ip,port,trace_id)
+    r = requests.get(url)
+
+    if r.status_code == 200:
+
+        data = r.json()
+
+        t = PrettyTable()
+        t.field_names = ["Hop", "Node", "Path", "Status", "Total ms", "Self ms", "Next", "Transit ms"]
+        for s in data["spans"]:
+            calls = [c for c in s["calls"] if "transit_ms" in c] or [{}]
+            t.add_row([s["hop"], s["node"], s["path"], s["status"], "{:.2f}".format(s["ms"]), "{:.2f}".format(s["self_ms"]),
+                       calls[0].get("peer", ""), "{:.2f}".format(calls[0]["transit_ms"]) if calls[0] else ""])
+        print(t)
+        click.echo("Total: {:.2f} ms over {} hops".format(data["total_ms"] or 0.0, data["hops"]))
+        if data["missing"] != []:
+            click.echo("No answer from: {}".format(", ".join(data["missing"])))
+    else:
+        click.echo(r.text)
+
 # For the help command
 @cli_group.command(context_settings=CONTEXT_SETTINGS, short_help="Prints this message and exits.")
 def help():
@@ -278,27 +371,59 @@ def help():
 
 @cli_group.command(context_settings=CONTEXT_SETTINGS)
 @click.argument('filename', metavar='<filename>')
-def insertfile(filename):
+@click.option('--batch-size','batch_size',default=1,type=click.IntRange(min=1),help='Number of keys sent per /batchInsert request')
+@click.option('-d','--direct',is_flag=True,help='Send every key (or sub-batch) straight to the responsible node')
+def insertfile(filename, batch_size, direct):
     """Inserts all keys from a file (song titles as keys)."""
     ip, port = chordify_server_addr()
     total_time = 0
     count = 0
+    client = Client(ip, port) if direct else None
     
     with open(f"insert/{filename}", 'r') as f:  # Path to insert folder
-        for line in f:
-            key = line.strip()
+        keys = [line.strip() for line in f]
+
+    if batch_size > 1:
+        for i in range(0, len(keys), batch_size):
+            batch = [{"key": key, "value": key} for key in keys[i:i + batch_size]]
+            # One sub-batch per responsible node, or the whole batch to our server
+            groups = {}
+            for item in batch:
+                groups.setdefault(client.route(item["key"]) if direct else (ip, port), []).append(item)
             start_time = time.time()
-            try:
-                # Use song title as both key and value
+            for (node_ip, node_port), items in groups.items():
+                try:
+                    r = requests.post(
+                        f"http://{node_ip}:{node_port}/batchInsert",
+                        json=json.dumps({"items": items})
+                    )
+                    if r.status_code == 200:
+                        count += sum(1 for res in r.json()["results"] if res["status"] == 200)
+                    else:
+                        click.echo(f"Error inserting batch: {r.text}")
+                except Exception as e:
+                    click.echo(f"Error inserting batch: {str(e)}")
+            total_time += time.time() - start_time
+
+        click.echo(f"Inserted {count} keys in {total_time:.2f}s")
+        return total_time
+
+    for key in keys:
+        start_time = time.time()
+        try:
+            # Use song title as both key and value
+            if direct:
+                r = client.insert(key, key)
+            else:
                 r = requests.post(
                     f"http://{ip}:{port}/insert",
                     params={"key": key, "value": key}
                 )
-                if r.status_code == 200:
-                    count += 1
-            except Exception as e:
-                click.echo(f"Error inserting {key}: {str(e)}")
-            total_time += time.time() - start_time
+            if r.status_code == 200:
+                count += 1
+        except Exception as e:
+            click.echo(f"Error inserting {key}: {str(e)}")
+        total_time += time.time() - start_time
     
     click.echo(f"Inserted {count} keys in {total_time:.2f}s")
     return total_time
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import random
+import threading
+import requests
+
+from node import hash_key, Placement
+from pool import peers
+
+# Client side routing: the client keeps a copy of the ring and sends every
+# insert, query & delete straight to the node that serves the key, instead
+# of letting the node it talks to route the request around the ring.
+#
+# The copy is refreshed from GET /membership, revalidated with its version,
+# whenever a response shows that it is out of date: the key was served by
+# another node than the one we expected, or that node is gone.
+
+class Client():
+    """
+        One-hop access to a chord ring, given any of its nodes.
+    """
+
+    def __init__(self, ip, port):
+        # Node we ask for the membership, and fall back to for routing
+        self.ip = ip
+        self.port = int(port)
+        self.lock = threading.Lock()
+        self.version = None
+        # Replica chains of the ring, None until the first refresh
+        self.placement = None
+        self.kappa = 1
+        self.consistency = None
+        self.stale = True
+
+    def refresh(self):
+        # Fetch the membership, unless our copy is still the current one
+        headers = {}
+        if self.version != None:
+            headers["If-None-Match"] = '"{}"'.format(self.version)
+        r = peers.get(self.ip, self.port, "/membership", headers=headers)
+        if r.status_code == 304:
+            self.stale = False
+            return True
+        if r.status_code == 404:
+            # Older node: the overlay has the ring, without the replication settings
+            r = peers.get(self.ip, self.port, "/overlay")
+        if not r.status_code == 200:
+            return False
+
+        data = r.json()
+        # Nodes of older servers run on servers of their own
+        members = sorted((d["node_key"], d["ip"], d["port"], d.get("server") or "{}:{}".format(d["ip"], d["port"]))
+                         for d in data["nodes"])
+        with self.lock:
+            self.version = data.get("version")
+            self.kappa = data.get("kappa", 1)
+            self.consistency = data.get("consistency")
+            self.placement = Placement(members, self.kappa) if members else None
+            self.stale = False
+        return True
+
+    def route(self, key, read = False):
+        # (ip, port) to send the request for key to. Writes go to the
+        # node responsible for the key, reads may go to one of its replicas.
+        if self.stale:
+            try:
+                self.refresh()
+            except requests.exceptions.RequestException:
+                pass
+        with self.lock:
+            if self.placement == None:
+                return self.ip, self.port
+            chain = self.placement.chain(hash_key(key))
+            target = chain[0]
+            if read:
+                if self.consistency == "chain-replication":
+                    # Tail of the chain, it answers without forwarding
+                    target = chain[-1]
+                elif self.consistency == "eventual-consistency":
+                    target = random.choice(chain)
+            return target.ip, target.port
+
+    def request(self, method, path, key, read = False, **params):
+        # Returns the response, sent to the node routed to, or through
+        # the entry node if that node is gone
+        params["key"] = key
+        target = self.route(key, read)
+        try:
+            r = peers.request(method, target[0], target[1], path, params=params)
+        except requests.exceptions.ConnectionError:
+            self.stale = True
+            return peers.request(method, self.ip, self.port, path, params=params)
+
+        if r.status_code == 403:
+            # Node departed since we fetched the ring
+            self.stale = True
+            return peers.request(method, self.ip, self.port, path, params=params)
+        if r.status_code == 200:
+            data = r.json()
+            if (data.get("node_ip"), data.get("node_port")) != tuple(target):
+                # Answered by another node, the ring has changed
+                self.stale = True
+        return r
+
+    def insert(self, key, value):
+        return self.request("POST", "/insert", key, value=value)
+
+    def query(self, key):
+        return self.request("GET", "/query", key, read=True)
+
+    def delete(self, key):
+        return self.request("DELETE", "/delete", key)
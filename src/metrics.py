@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+import bisect
+import threading
+import time
+
+# Counters, gauges & latency histograms served in the Prometheus text
+# format. Updates are lock free: every thread writes to its own shard and
+# a scrape sums the shards up. Shards of finished threads are merged into
+# one whenever a thread starts recording, so short lived request threads
+# do not pile up.
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+class Shard():
+    def __init__(self, thread = None):
+        self.thread = thread
+        # (name, labels) -> value
+        self.counters = {}
+        # (name, labels) -> [count per bucket..., count above the last one, sum]
+        self.histograms = {}
+
+    def merge(self, other):
+        # Add the totals of other to ours
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, counts in other.histograms.items():
+            mine = self.histograms.setdefault(key, [0] * len(counts))
+            for i, c in enumerate(counts):
+                mine[i] += c
+
+def copy(table):
+    # Copy of a shard table another thread may be adding keys to
+    while True:
+        try:
+            return [(key, list(value) if isinstance(value, list) else value) for (key, value) in list(table.items())]
+        except RuntimeError:
+            pass
+
+class Registry():
+    """
+        Metrics of a server. Names & labels are passed on every update,
+        labels as a tuple of (name, value) pairs.
+    """
+
+    def __init__(self, buckets = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.shards = []
+        # Totals of the threads that are gone
+        self.retired = Shard()
+        # name -> (type, help)
+        self.help = {}
+        # name -> function returning [(labels, value)], evaluated on scrape
+        self.gauges = {}
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard == None:
+            shard = Shard(threading.current_thread())
+            self.local.shard = shard
+            with self.lock:
+                # Fold the shards of finished threads in as new ones come,
+                # so they do not pile up on a node that is never scraped
+                self.retire()
+                self.shards.append(shard)
+        return shard
+
+    def retire(self):
+        # Merge the shards of the threads that are gone, with self.lock held
+        alive = []
+        for shard in self.shards:
+            if shard.thread.is_alive():
+                alive.append(shard)
+            else:
+                self.retired.merge(shard)
+        self.shards = alive
+        return alive
+
+    def add(self, name, labels = (), value = 1):
+        counters = self.shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        histograms = self.shard().histograms
+        key = (name, labels)
+        counts = histograms.get(key)
+        if counts == None:
+            counts = histograms[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        counts[-1] += seconds
+
+    def gauge(self, name, text, function, kind = "gauge"):
+        # function returns [(labels, value)], read on every scrape. kind may
+        # be "counter" for totals kept elsewhere (e.g. by the replication queue)
+        self.describe(name, kind, text)
+        self.gauges[name] = function
+
+    def collect(self):
+        # Totals over every shard: (counters, histograms)
+        total = Shard()
+        with self.lock:
+            alive = self.retire()
+            total.merge(self.retired)
+        for shard in alive:
+            # The owner thread keeps writing to it, merge a copy
+            snapshot = Shard()
+            snapshot.counters = dict(copy(shard.counters))
+            snapshot.histograms = dict(copy(shard.histograms))
+            total.merge(snapshot)
+        return total.counters, total.histograms
+
+    def render(self):
+        # Every metric in the Prometheus text exposition format
+        counters, histograms = self.collect()
+        # name -> [(labels, lines of the sample)]
+        families = {}
+        for (name, labels), value in counters.items():
+            families.setdefault(name, []).append((labels, [(name, labels, value)]))
+        for (name, labels), counts in histograms.items():
+            lines = []
+            cumulative = 0
+            for bound, c in zip(self.buckets + [float("inf")], counts):
+                cumulative += c
+                lines.append((name + "_bucket", labels + (("le", format_bound(bound)),), cumulative))
+            lines.append((name + "_sum", labels, counts[-1]))
+            lines.append((name + "_count", labels, cumulative))
+            families.setdefault(name, []).append((labels, lines))
+        for name, function in self.gauges.items():
+            families[name] = [(labels, [(name, labels, value)]) for (labels, value) in function()]
+
+        out = []
+        for name in sorted(families):
+            if name in self.help:
+                kind, text = self.help[name]
+                out.append("# HELP {} {}".format(name, text))
+                out.append("# TYPE {} {}".format(name, kind))
+            for (_, lines) in sorted(families[name], key=lambda sample: sample[0]):
+                for (sample, labels, value) in lines:
+                    out.append("{}{} {}".format(sample, format_labels(labels), format_value(value)))
+        return "\n".join(out) + "\n"
+
+def format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for (k, v) in labels) + "}"
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+# Outbound calls of the process (connection pool & RPC clients), shared
+# by every server of the process. A server renders it after its own.
+outbound = Registry()
+outbound.describe("chordify_peer_requests_total", "counter", "Requests sent to other nodes, by peer, path, transport and outcome")
+outbound.describe("chordify_peer_request_duration_seconds", "histogram", "Latency of the requests sent to other nodes, by peer and transport")
+
+# Names of the ids in the paths of the routes that take one
+PATH_PARAMS = {"trace": "trace_id"}
+
+def path_label(path):
+    # Route of a path as a label, so that ids do not make new series
+    # ("/trace/12ab" -> "/trace/<trace_id>")
+    head, sep, _ = path[1:].partition("/")
+    if not sep:
+        return path
+    return "/{}/<{}>".format(head, PATH_PARAMS.get(head, "id"))
+
+def peer_call(peer, path, transport, start, ok):
+    # Record an outbound call that started at start (time.perf_counter())
+    path = path_label(path)
+    outbound.add("chordify_peer_requests_total", (("peer", peer), ("path", path), ("transport", transport), ("ok", "true" if ok else "false")))
+    outbound.observe("chordify_peer_request_duration_seconds", (("peer", peer), ("transport", transport)), time.perf_counter() - start)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+import argparse
+import importlib.util
+import os
+import socket
+import threading
+import time
+import requests
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+# Hosts many ring members in one process, e.g. for load tests.
+# Every member runs its own copy of the server module, so it has its own
+# Flask app, globals & Node, and listens on its own port. The connection
+# pool, the replication pipeline and the ring maintenance thread are
+# shared by all the members of the process; every member batches its
+# chain replicas on its own, so members do not wait on each other.
+#
+# With --vnodes V every physical server claims V identifiers on the ring:
+# it is hosted as V members on consecutive ports that report the first
+# one as their server, so the bootstrap node can group them in /overlay
+# and replica chains skip the other members of the same server. Joining
+# or departing the first member does the same for the others.
+# server.py hosts itself this way when CHORDIFY_VNODES is set.
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+
+class Member():
+    def __init__(self, server, http_server, physical):
+        self.server = server
+        self.physical = physical
+        self.http_server = http_server
+
+    @property
+    def port(self):
+        return self.server.port
+
+    @property
+    def node(self):
+        return self.server.node
+
+def load_server(ip, port, kappa, consistency, shared = None):
+    # Execute server.py again as a fresh module named after the port
+    spec = importlib.util.spec_from_file_location("server_{}".format(port), SERVER_PATH)
+    server = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(server)
+    server.ip = ip
+    server.port = port
+    server.kappa = kappa
+    server.consistency = consistency
+    server.node = None
+    if shared is not None:
+        server.replication = shared.replication
+    return server
+
+def with_shutdown(app, http_server):
+    # Werkzeug dropped 'werkzeug.server.shutdown', provide it for /shutdown
+    def wsgi(environ, start_response):
+        environ['werkzeug.server.shutdown'] = lambda: threading.Thread(target=http_server.shutdown).start()
+        return app(environ, start_response)
+    return wsgi
+
+class MultiNode():
+    """
+        A set of ring members served by one process.
+    """
+
+    def __init__(self, ip, kappa, consistency):
+        self.ip = ip
+        self.kappa = kappa
+        self.consistency = consistency
+        self.members = []
+        self.lock = threading.Lock()
+        self.maintaining = False
+
+    def add(self, port, physical = None):
+        shared = self.members[0].server if self.members else None
+        server = load_server(self.ip, port, self.kappa, self.consistency, shared)
+        http_server = make_server(self.ip, port, None, threaded=True)
+        http_server.app = with_shutdown(server.app, http_server)
+        server.start_rpc()
+        member = Member(server, http_server, physical)
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        with self.lock:
+            self.members.append(member)
+        return member
+
+    def add_server(self, port, vnodes):
+        # A physical server of vnodes members on ports port, port + 1, ...
+        physical = "{}:{}".format(self.ip, port) if vnodes > 1 else None
+        members = []
+        for v in range(vnodes):
+            members.append(self.add(port + v, physical))
+        members[0].server.vnodes = [member.port for member in members[1:]]
+        return members
+
+    def join(self, member, bootstrap_ip, bootstrap_port):
+        # Same request the CLI sends to a freshly started server
+        params = {"ip":bootstrap_ip, "port":bootstrap_port}
+        if member.physical != None:
+            params["server"] = member.physical
+        r = requests.put("http://{}:{}/join".format(self.ip, member.port), params=params)
+        return r.status_code == 200
+
+    def maintain_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            with self.lock:
+                members = list(self.members)
+            for member in members:
+                member.server.maintain()
+
+    def start_maintenance(self):
+        if self.maintaining or not self.members:
+            return
+        interval = self.members[0].server.FIX_FINGERS_INTERVAL
+        threading.Thread(target=self.maintain_loop, args=(interval,), daemon=True).start()
+        self.maintaining = True
+
+    def stop(self):
+        with self.lock:
+            members, self.members = self.members, []
+        for member in members:
+            member.http_server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Host many chord nodes in one process")
+    parser.add_argument("port", type=int, help="Port of the first node, the rest use the next ones")
+    parser.add_argument("count", type=int, help="Number of (physical) nodes")
+    parser.add_argument("kappa", type=int, help="Replication factor")
+    parser.add_argument("consistency", type=str, help="chain-replication or eventual-consistency")
+    parser.add_argument("--ip", type=str, default=socket.gethostbyname(socket.gethostname()))
+    parser.add_argument("--vnodes", type=int, default=1, help="Virtual nodes per physical node")
+    parser.add_argument("--bootstrap", nargs=2, metavar=("IP", "PORT"),
+                        help="Join an existing ring, by default the first node becomes the bootstrap node")
+    args = parser.parse_args()
+
+    # HTTP/1.1 keeps connections of the peers' pools alive between requests
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+
+    hosted = MultiNode(args.ip, args.kappa, args.consistency)
+    if args.bootstrap:
+        bootstrap_ip, bootstrap_port = args.bootstrap[0], int(args.bootstrap[1])
+    else:
+        bootstrap_ip, bootstrap_port = args.ip, args.port
+
+    try:
+        for i in range(args.count):
+            member = hosted.add_server(args.port + i * args.vnodes, args.vnodes)[0]
+            if not hosted.join(member, bootstrap_ip, bootstrap_port):
+                print("Node {}:{} could not join the ring".format(args.ip, member.port))
+    except socket.error:
+        print("Port {} is not available".format(args.port + len(hosted.members)))
+        hosted.stop()
+        exit()
+
+    hosted.start_maintenance()
+    print("{} nodes running in {}:{}-{}".format(len(hosted.members), args.ip, args.port, args.port + len(hosted.members) - 1))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        hosted.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,36 @@
 #!/usr/bin/env python
 
+import bisect
 import hashlib
+import threading
+from functools import lru_cache
+from store import KeyStore
+
+# Number of bits of the identifier space (SHA-1)
+M = 160
+RING_SIZE = 1 << M
+# Number of recently hashed keys to remember
+HASH_CACHE_SIZE = 65536
 
 def modulo(x, y):
     # when y is a power of 2
     return x & (y - 1)
 
+@lru_cache(maxsize=HASH_CACHE_SIZE)
 def hash_key(s):
-    return modulo(int(hashlib.sha1(str.encode(s)).hexdigest(),16), 1 << 160)
+    return modulo(int.from_bytes(hashlib.sha1(str.encode(s)).digest(), "big"), RING_SIZE)
+
+def in_range(key, start, end):
+    # True if key lies in the ring interval (start, end]
+    if start < end:
+        return start < key <= end
+    else:
+        # Interval wraps around zero (or covers the whole ring when start == end)
+        return key > start or key <= end
+
+def finger_start(key, i):
+    # First identifier covered by the i-th finger of node key
+    return modulo(key + (1 << i), RING_SIZE)
 
 class RefNode():
     def __init__(self,ip,port):
@@ -15,25 +38,81 @@ class RefNode():
         self.port = port
         self.key = hash_key("{}:{}".format(ip, port))
 
+class Placement():
+    """
+        Replica chains of a ring where physical servers run many virtual
+        nodes. The copies of a key go to the node responsible for it and
+        to the next nodes of the ring that run on other servers, so no
+        server holds two copies of a key.
+    """
+
+    def __init__(self, members, kappa):
+        # members: (key, ip, port, server) of every node, in ring order
+        self.members = members
+        self.keys = [key for (key, _, _, _) in members]
+        self.kappa = kappa
+        # Chains by index of the node responsible, made on first use
+        self.chains = {}
+
+    def chain(self, key):
+        # RefNodes holding the copies of key: the primary, then replicas 1, 2, ...
+        index = bisect.bisect_left(self.keys, key) % len(self.keys)
+        chain = self.chains.get(index)
+        if chain == None:
+            chain = []
+            servers = set()
+            for i in range(len(self.members)):
+                _, ip, port, server = self.members[(index + i) % len(self.members)]
+                if not server in servers:
+                    servers.add(server)
+                    chain.append(RefNode(ip, port))
+                    if len(chain) == self.kappa:
+                        break
+            self.chains[index] = chain
+        return chain
+
+def shared_servers(members):
+    # True if some physical server runs more than one of the members
+    return len(set(server for (_, _, _, server) in members)) < len(members)
+
 class Node():
-    data = {}
-    replicas = {}
-    next_node = None
-    previous_node = None
 
-    def __init__(self, ip, port, bnode, kappa = 1, consistency_type = "eventual-consistency"):
+    def __init__(self, ip, port, bnode, kappa = 1, consistency_type = "eventual-consistency", server = None, storage = None):
+        # Every node has its own stores, even when many nodes share a process
+        self.storage = storage
+        if storage == None:
+            self.data = KeyStore()
+            self.replicas = KeyStore()
+        else:
+            # Durable stores, with the keys recovered from the local log
+            self.data = storage.data
+            self.replicas = storage.replicas
+        self.next_node = None
+        self.previous_node = None
         self.ip = ip
         self.port = port
         self.key = hash_key("{}:{}".format(ip, port))
+        # Reference to ourselves, returned by successor_of()
+        self.ref = RefNode(ip, port)
+        # Physical server ("ip:port") this node is a virtual node of
+        self.server = server if server != None else "{}:{}".format(ip, port)
         self.bnode = RefNode(bnode[0],bnode[1])
         self.kappa = kappa
         self.consistency_type = consistency_type
+        # finger[i] is the first node that succeeds key + 2^i
+        self.finger = [None] * M
+        # Replica chains of the ring if servers run many virtual nodes,
+        # None when replicas simply go to the next nodes
+        self.placement = None
+        # Keys handed over by a departing node since the last reconcile
+        self.keys_received = False
 
     def is_bootstrap(self):
         return self.key == self.bnode.key
 
-    def add_key(self, key, value):
-        key_hash = hash_key(key)
+    def add_key(self, key, value, key_hash = None):
+        if key_hash == None:
+            key_hash = hash_key(key)
         if key_hash in self.data:
             # If the key already exists, concatenate the new value to the old one
             old_key, old_value = self.data[key_hash]
@@ -43,8 +122,9 @@ class Node():
             self.data[key_hash] = (key, value)
         return key_hash
 
-    def add_replica(self, key, value, replica_number):
-        key_hash = hash_key(key)
+    def add_replica(self, key, value, replica_number, key_hash = None):
+        if key_hash == None:
+            key_hash = hash_key(key)
         if key_hash in self.replicas:
             # If the replica key exists, concatenate the new value to the existing replica value
             old_key, old_value, _ = self.replicas[key_hash]
@@ -54,56 +134,91 @@ class Node():
             self.replicas[key_hash] = (key, value, replica_number)
         return key_hash
 
+    def replica_next(self, key, replica_number):
+        # Node holding the copy of key that follows ours, None if ours is the
+        # last one. replica_number is the number of our copy, 0 for the primary.
+        if self.placement != None:
+            chain = self.placement.chain(key)
+            return chain[replica_number + 1] if replica_number + 1 < len(chain) else None
+        if replica_number + 1 >= self.kappa:
+            return None
+        return self.next_node
+
+    def owns(self, key):
+        # A node is responsible for (previous_node, self]
+        if self.previous_node == None:
+            return True
+        return in_range(key, self.previous_node.key, self.key)
+
     def successor(self,key_value):
+        return self.successor_of(hash_key(key_value))
 
-        key = hash_key(key_value)
+    def successor_of(self, key):
+        # Returns the node responsible for key if it is known locally,
+        # otherwise the closest preceding node to forward the request to.
 
-        if self.next_node == None or self.previous_node == None:
-            return RefNode(self.ip, self.port)
+        if self.next_node == None or self.previous_node == None or self.owns(key):
+            return self.ref
 
-        if self.previous_node.key < self.next_node.key:
-            # Inner node
-            if key <= self.previous_node.key:
-                return self.previous_node
-            elif key <= self.key:
-                return RefNode(self.ip, self.port)
-            else:
-                return self.next_node
-        else:
-            # Edge node
-            if self.key > self.previous_node.key:
-                # Greates edge node
-                if key > self.key or key <= self.next_node.key:
-                    return self.next_node
-                elif key <= self.previous_node.key:
-                    return self.previous_node
-                else:
-                    return RefNode(self.ip, self.port)
+        if in_range(key, self.key, self.next_node.key):
+            return self.next_node
+
+        return self.closest_preceding_finger(key)
+
+    def closest_preceding_finger(self, key):
+        for i in range(M - 1, -1, -1):
+            f = self.finger[i]
+            if f != None and in_range(f.key, self.key, key):
+                return f
+        return self.next_node
+
+    def update_finger(self, i, ref):
+        # Store finger i and every following finger that falls
+        # in the same interval, as they share the same successor
+        self.finger[i] = ref
+        for j in range(i + 1, M):
+            if ref != None and in_range(finger_start(self.key, j), self.key, ref.key) and ref.key != self.key:
+                self.finger[j] = ref
             else:
-                # Lowest Edge node
-                if key <= self.key or key > self.previous_node.key:
-                    return RefNode(self.ip, self.port)
-                else:
-                    return self.next_node
+                return j
+        return M
 
-class BootstrapNode(Node):
+    def remove_finger(self, key):
+        # Forget a node that is no longer reachable
+        self.finger = [None if f != None and f.key == key else f for f in self.finger]
+
+    def reset_fingers(self):
+        self.finger = [None] * M
+        if self.next_node != None:
+            self.update_finger(0, self.next_node)
 
-    nodes = {}
-    number_of_nodes = 0
+class BootstrapNode(Node):
 
-    def __init__(self, ip, port, kappa = 1, consistency_type = "chain-replication"):
-        super().__init__(ip, port, (ip,port), kappa, consistency_type)
-        self.nodes[self.key] = (ip, port)
-        self.number_of_nodes += 1
+    def __init__(self, ip, port, kappa = 1, consistency_type = "chain-replication", server = None, storage = None):
+        super().__init__(ip, port, (ip,port), kappa, consistency_type, server, storage)
+        self.nodes = {self.key: (ip, port)}
+        # Physical server of every (virtual) node
+        self.servers = {self.key: self.server}
+        self.number_of_nodes = 1
+        # Sorted identifiers of the members, kept up to date on every join & departure
+        self.ring = [self.key]
+        # Bumped on every membership change, so copies can be revalidated
+        self.version = 1
+        # Joins & departures are served concurrently
+        self.lock = threading.Lock()
         
-    def add_node(self, ip, port):
+    def add_node(self, ip, port, server = None):
         keynode = hash_key("{}:{}".format(ip, port))
-        if not keynode in self.nodes:
-            self.nodes[keynode] = (ip, port)
-            self.number_of_nodes += 1
-            return keynode
-        else:
-            return -1
+        with self.lock:
+            if not keynode in self.nodes:
+                self.nodes[keynode] = (ip, port)
+                self.servers[keynode] = server if server != None else "{}:{}".format(ip, port)
+                self.number_of_nodes += 1
+                bisect.insort(self.ring, keynode)
+                self.version += 1
+                return keynode
+            else:
+                return -1
 
     def next_index(self, index):
         return (index + 1) % self.number_of_nodes
@@ -111,17 +226,31 @@ class BootstrapNode(Node):
         return (index - 1) % self.number_of_nodes
 
     def find_neighboors(self, keynode):
-        temp = list(self.nodes.keys())
-        temp.sort()
-        for index, key in enumerate(temp):
-            if key == keynode:
-                return self.nodes[temp[self.previous_index(index)]], self.nodes[temp[self.next_index(index)]]
+        with self.lock:
+            index = bisect.bisect_left(self.ring, keynode)
+            if index == self.number_of_nodes or self.ring[index] != keynode:
+                return None
+            return self.nodes[self.ring[self.previous_index(index)]], self.nodes[self.ring[self.next_index(index)]]
 
     def delete_node(self, keynode):
-        if keynode in self.nodes:
-            self.number_of_nodes -= 1
-            del self.nodes[keynode]
-            return keynode
-        else:
-            return -1
-            
+        with self.lock:
+            if keynode in self.nodes:
+                self.number_of_nodes -= 1
+                del self.nodes[keynode]
+                del self.servers[keynode]
+                del self.ring[bisect.bisect_left(self.ring, keynode)]
+                self.version += 1
+                return keynode
+            else:
+                return -1
+
+    def membership(self):
+        # Consistent copy of the ring: version and (key, ip, port, server) in ring order
+        with self.lock:
+            return self.version, [(key, self.nodes[key][0], self.nodes[key][1], self.servers[key]) for key in self.ring]
+
+    def shares(self):
+        # Fraction of the key space every node is responsible for
+        with self.lock:
+            temp = list(self.ring)
+        return {key: (modulo(key - temp[index - 1], RING_SIZE) or RING_SIZE) / RING_SIZE for index, key in enumerate(temp)}
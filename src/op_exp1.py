@@ -2,6 +2,9 @@ import requests
 import time
 import json
 import threading
+import sys
+
+from client import Client
 
 # Assume each node is running a server on a fixed port (e.g., 5000)
 DEFAULT_PORT = 5000
@@ -27,12 +30,14 @@ def join_node(node_ip, node_port, is_bootstrap=False, bootstrap_ip=None, bootstr
     except Exception as e:
         print(f"Error joining node at {node_ip}:{node_port}: {e}")
 
-def run_inserts(node_ip, node_port, insert_file):
+def run_inserts(node_ip, node_port, insert_file, direct=False):
     """
     For a given node, sequentially read keys from insert_file and insert them.
     Each insert is sent to the /insert endpoint, and the next key is only sent if
     the previous insertion was successful (HTTP status 200).
+    With direct, every key is sent straight to the node responsible for it.
     """
+    client = Client(node_ip, node_port) if direct else None
     total_keys = 0
     first_insertion_time = None
     last_insertion_time = None
@@ -47,9 +52,12 @@ def run_inserts(node_ip, node_port, insert_file):
                 if first_insertion_time is None:
                     first_insertion_time = time.time()
 
-                url = f"http://{node_ip}:{node_port}/insert"
                 # Here we assume the value is the same as the key; adjust as needed.
-                r = requests.post(url, params={"key": key, "value": key})
+                if direct:
+                    r = client.insert(key, key)
+                else:
+                    url = f"http://{node_ip}:{node_port}/insert"
+                    r = requests.post(url, params={"key": key, "value": key})
                 if r.status_code == 200:
                     total_keys += 1
                     last_insertion_time = time.time()
@@ -65,7 +73,7 @@ def run_inserts(node_ip, node_port, insert_file):
     print(f"[{node_ip}:{node_port}] Finished inserting {total_keys} keys in {duration:.5f} sec")
     return total_keys, duration
 
-def run_experiment(k, consistency, node_configs):
+def run_experiment(k, consistency, node_configs, direct=False):
     """
     node_configs: List of dictionaries each with:
         - 'vm': the VM hostname (for logging)
@@ -73,6 +81,7 @@ def run_experiment(k, consistency, node_configs):
         - 'port': the node's server port (e.g., 5000)
         - 'insert_file': the file containing keys for that node.
     The first node in the list is considered the bootstrap.
+    With direct, inserts go straight to the responsible nodes (see client.py).
     """
     threads = []
     durations = []
@@ -91,7 +100,7 @@ def run_experiment(k, consistency, node_configs):
     
     # Start insertions concurrently on each node.
     def insert_worker(config):
-        _, duration = run_inserts(config['ip'], config['port'], config['insert_file'])
+        _, duration = run_inserts(config['ip'], config['port'], config['insert_file'], direct)
         durations.append(duration)
     
     for config in node_configs:
@@ -131,6 +140,9 @@ if __name__ == "__main__":
         {"vm": "team_32-vm5", "ip": "10.0.0.5", "port": DEFAULT_PORT, "insert_file": "insert_9.txt"}
     ]
 
+    # With --direct the client routes each insert to the responsible node
+    direct = "--direct" in sys.argv[1:]
+
     # Run experiments for different configurations.
     replication_factors = [1, 3, 5]
     consistency_options = ["linearizability", "eventual-consistency"]
@@ -141,7 +153,7 @@ if __name__ == "__main__":
             print(f"\n=== Starting experiment with k={k} and consistency={cons} ===")
             # In this simplified example, we assume that k and consistency are configured via other means
             # (e.g., when the node starts) so that the /insert endpoint uses them.
-            result = run_experiment(k, cons, node_configs)
+            result = run_experiment(k, cons, node_configs, direct)
             results.append(result)
             time.sleep(2)
 
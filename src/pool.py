@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import tracing
+
+# Connection settings, can be overridden through environment variables
+POOL_SIZE = int(os.environ.get("CHORDIFY_POOL_SIZE", 16))
+KEEP_ALIVE = os.environ.get("CHORDIFY_KEEP_ALIVE", "1") != "0"
+CONNECT_TIMEOUT = float(os.environ.get("CHORDIFY_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.environ["CHORDIFY_READ_TIMEOUT"]) if "CHORDIFY_READ_TIMEOUT" in os.environ else None
+
+class ConnectionPool():
+    """
+        Keeps one requests.Session per peer (ip, port), so that
+        consecutive calls to the same node reuse open TCP connections.
+    """
+
+    def __init__(self, pool_size = POOL_SIZE, keep_alive = KEEP_ALIVE, timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def session(self, ip, port):
+        peer = (ip, int(port))
+
+        if self.pid != os.getpid():
+            # Forked child: never share the parent's sockets
+            with self.lock:
+                self.sessions = {}
+                self.pid = os.getpid()
+
+        s = self.sessions.get(peer)
+        if s is None:
+            with self.lock:
+                s = self.sessions.get(peer)
+                if s is None:
+                    s = requests.Session()
+                    s.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0))
+                    if not self.keep_alive:
+                        s.headers["Connection"] = "close"
+                    self.sessions[peer] = s
+        return s
+
+    def request(self, method, ip, port, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        kwargs["params"] = tracing.carry(path, kwargs.get("params"))
+        url = "http://{}:{}{}".format(ip, port, path)
+        peer = "{}:{}".format(ip, port)
+        start = time.perf_counter()
+        try:
+            r = self.session(ip, port).request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            metrics.peer_call(peer, path, "http", start, False)
+            tracing.called(peer, path, start, None)
+            raise
+        metrics.peer_call(peer, path, "http", start, r.status_code < 500)
+        tracing.called(peer, path, start, r.status_code)
+        return r
+
+    def get(self, ip, port, path, **kwargs):
+        return self.request("GET", ip, port, path, **kwargs)
+
+    def post(self, ip, port, path, **kwargs):
+        return self.request("POST", ip, port, path, **kwargs)
+
+    def put(self, ip, port, path, **kwargs):
+        return self.request("PUT", ip, port, path, **kwargs)
+
+    def delete(self, ip, port, path, **kwargs):
+        return self.request("DELETE", ip, port, path, **kwargs)
+
+    def close(self):
+        with self.lock:
+            for s in self.sessions.values():
+                s.close()
+            self.sessions = {}
+
+# Per-process pool shared by every inter-node call
+peers = ConnectionPool()
@@ -4,6 +4,8 @@ import requests
 import time
 import json
 
+from client import Client
+
 DEFAULT_PORT = 5000
 
 def join_node(is_bootstrap, bootstrap_ip=None, bootstrap_port=None):
@@ -23,7 +25,8 @@ def join_node(is_bootstrap, bootstrap_ip=None, bootstrap_port=None):
     except Exception as e:
         print(f"[ERROR] Exception during join: {e}")
 
-def run_inserts(insert_file):
+def run_inserts(insert_file, direct=False):
+    client = Client("localhost", DEFAULT_PORT) if direct else None
     total_keys = 0
     first_insertion_time = None
     last_insertion_time = None
@@ -37,9 +40,12 @@ def run_inserts(insert_file):
                     continue
                 if first_insertion_time is None:
                     first_insertion_time = time.time()
-                url = f"http://localhost:{DEFAULT_PORT}/insert"
                 print(f"[DEBUG] Inserting key '{key}' at localhost:{DEFAULT_PORT}")
-                r = requests.post(url, params={"key": key, "value": key})
+                if direct:
+                    r = client.insert(key, key)
+                else:
+                    url = f"http://localhost:{DEFAULT_PORT}/insert"
+                    r = requests.post(url, params={"key": key, "value": key})
                 if r.status_code == 200:
                     total_keys += 1
                     last_insertion_time = time.time()
@@ -60,6 +66,7 @@ def main():
     parser.add_argument("--k", type=int, required=True)
     parser.add_argument("--consistency", type=str, required=True)
     parser.add_argument("--bootstrap", action="store_true")
+    parser.add_argument("--direct", action="store_true", help="Send every key straight to the node responsible for it")
     args = parser.parse_args()
 
     print(f"[INFO] Starting remote experiment on node {args.node_id} with k={args.k} and consistency={args.consistency}")
@@ -74,7 +81,7 @@ def main():
     time.sleep(2)
 
     insert_file = f"insert_{args.node_id}.txt"
-    run_inserts(insert_file)
+    run_inserts(insert_file, args.direct)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+import requests
+
+from bench_ring import summary
+
+# Replays request traces against a running ring and reports latencies
+# and read-your-writes freshness.
+#
+# Trace formats, one operation per line:
+#   .txt    "query, <key>" / "insert, <key>, <value>" / "delete, <key>"
+#   .jsonl  {"op": "insert", "key": ..., "value": ...}, lines without "op" are skipped
+#
+# Every trace file is a session: a client that reads its own writes.
+# Inserted values get a unique token, and a read of a key the session has
+# written, sent after the write was acknowledged, is stale if the value
+# does not hold the token (inserts append to the value of a key).
+#
+# Closed loop: N clients replay the sessions, each sending its next
+# operation when the previous one returned. Open loop: operations of all
+# sessions start at a fixed rate, whatever the latency of the ring;
+# latency counts from the scheduled start, so queueing is included.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRACES = os.path.join(ROOT, "requests", "requests_*.txt")
+# Upper bounds (ms) of the latency histogram buckets
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+def parse_line(line):
+    # (op, key, value or None), None for lines that are not operations
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith("{"):
+        d = json.loads(line)
+        if not "op" in d:
+            return None
+        return d["op"], d["key"], d.get("value")
+    parts = [p.strip() for p in line.split(",")]
+    op = parts[0]
+    if op == "insert":
+        # Keys may hold commas, the value is the last field
+        return op, ", ".join(parts[1:-1]), parts[-1]
+    return op, ", ".join(parts[1:]), None
+
+def parse_trace(path):
+    with open(path) as f:
+        return [op for op in map(parse_line, f) if op != None]
+
+class Session():
+    def __init__(self, name, ops, node):
+        self.name = name
+        self.ops = ops
+        # (ip, port) the session talks to
+        self.node = node
+        # key -> token of the last acknowledged insert of this session
+        self.written = {}
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def token(self):
+        with self.lock:
+            self.count += 1
+            return "[{}:{}]".format(self.name, self.count)
+
+class Recorder():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        # Reads of keys the session had written, and how many were stale
+        self.checked = 0
+        self.stale = 0
+
+    def record(self, op, latency, ok, fresh = None):
+        with self.lock:
+            self.latencies.setdefault(op, []).append(latency)
+            if not ok:
+                self.errors[op] = self.errors.get(op, 0) + 1
+            if fresh != None:
+                self.checked += 1
+                if not fresh:
+                    self.stale += 1
+
+def execute(http, session, op, key, value, recorder, start = None):
+    # Send one operation of session, latency counts from start (now by default)
+    if start == None:
+        start = time.perf_counter()
+    url = "http://{}:{}".format(*session.node)
+    # Only writes acknowledged before we send count for freshness
+    expected = session.written.get(key)
+    fresh = None
+    try:
+        if op == "insert":
+            token = session.token()
+            r = http.post(url + "/insert", params={"key":key, "value":"{}{}".format(value, token)})
+            if r.status_code == 200:
+                session.written[key] = token
+        elif op == "delete":
+            r = http.delete(url + "/delete", params={"key":key})
+            if r.status_code == 200:
+                session.written.pop(key, None)
+        else:
+            r = http.get(url + "/query", params={"key":key})
+            if expected != None:
+                fresh = r.status_code == 200 and expected in r.json()["value"]
+        # A query of a missing key is an answer, not an error
+        ok = r.status_code == 200 or (op == "query" and r.status_code == 404)
+    except requests.exceptions.RequestException:
+        ok = False
+    recorder.record(op, time.perf_counter() - start, ok, fresh)
+
+def closed_loop(sessions, clients, recorder):
+    # clients threads take sessions off a queue and replay them in order
+    pending = queue.Queue()
+    for session in sessions:
+        pending.put(session)
+
+    def client():
+        http = requests.Session()
+        while True:
+            try:
+                session = pending.get_nowait()
+            except queue.Empty:
+                return
+            for (op, key, value) in session.ops:
+                execute(http, session, op, key, value, recorder)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+def open_loop(sessions, rate, workers, recorder, poisson = False):
+    # Operations of all sessions, interleaved, start rate times per second.
+    # The operations of a session keep their order of arrival.
+    arrivals = [(session, op) for ops in itertools.zip_longest(*[[(s, op) for op in s.ops] for s in sessions])
+                for (session, op) in filter(None, ops)]
+    pending = queue.Queue()
+
+    def worker():
+        http = requests.Session()
+        while True:
+            item = pending.get()
+            if item == None:
+                return
+            scheduled, session, (op, key, value) = item
+            execute(http, session, op, key, value, recorder, scheduled)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.start()
+
+    start = time.perf_counter()
+    scheduled = start
+    for session, op in arrivals:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        pending.put((scheduled, session, op))
+        scheduled += random.expovariate(rate) if poisson else 1 / rate
+
+    for _ in threads:
+        pending.put(None)
+    for t in threads:
+        t.join()
+
+def histogram(latencies):
+    # Counts per bucket, the last one for everything above the last bound
+    counts = [0] * (len(BUCKETS) + 1)
+    for latency in latencies:
+        ms = latency * 1000
+        counts[next((i for (i, bound) in enumerate(BUCKETS) if ms <= bound), len(BUCKETS))] += 1
+    return counts
+
+def report(recorder, consistency, seconds):
+    result = {"consistency":consistency, "seconds":seconds, "operations":{}}
+    for op, latencies in sorted(recorder.latencies.items()):
+        stats = {"count":len(latencies), "errors":recorder.errors.get(op, 0), "throughput":len(latencies) / seconds}
+        stats.update(summary(latencies))
+        stats["histogram"] = dict(zip(["<={}ms".format(b) for b in BUCKETS] + [">{}ms".format(BUCKETS[-1])], histogram(latencies)))
+        result["operations"][op] = stats
+    result["reads_checked"] = recorder.checked
+    result["stale_reads"] = recorder.stale
+    result["staleness_rate"] = recorder.stale / recorder.checked if recorder.checked else 0.0
+    return result
+
+def print_report(result):
+    reads = "linearizable" if result["consistency"] == "chain-replication" else "eventual"
+    print("{} ({} reads), {:.2f}s".format(result["consistency"], reads, result["seconds"]))
+    for op, stats in result["operations"].items():
+        print("  {:<7} {:>6} ops {:>4} errors {:>9.1f} ops/sec  p50 {:>7.2f}  p95 {:>7.2f}  p99 {:>7.2f} ms".format(
+            op, stats["count"], stats["errors"], stats["throughput"], stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]))
+        peak = max(stats["histogram"].values())
+        for bucket, count in stats["histogram"].items():
+            if count:
+                print("    {:>9} {:>6} {}".format(bucket, count, "#" * max(1, round(40 * count / peak))))
+    print("  read-your-writes: {} of {} reads stale ({:.2%})".format(
+        result["stale_reads"], result["reads_checked"], result["staleness_rate"]))
+
+def ring_nodes(ip, port):
+    # (ip, port) of the members and the consistency mode, from /membership
+    r = requests.get("http://{}:{}/membership".format(ip, port))
+    if not r.status_code == 200:
+        return [(ip, port)], None
+    data = r.json()
+    return [(d["ip"], d["port"]) for d in data["nodes"]], data.get("consistency")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay request traces against a running ring")
+    parser.add_argument("traces", nargs="*", help="Trace files, requests/requests_*.txt by default")
+    parser.add_argument("--ip", type=str, default="127.0.0.1", help="Node to start from")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--entry-only", action="store_true", help="Send every session to --ip/--port, instead of spreading them over the ring")
+    parser.add_argument("--clients", type=int, default=None, help="Closed loop with this many clients, one per session by default")
+    parser.add_argument("--rate", type=float, default=None, help="Open loop with this many operations per second")
+    parser.add_argument("--poisson", action="store_true", help="Open loop with exponential inter-arrival times")
+    parser.add_argument("--workers", type=int, default=64, help="Threads sending the open loop operations")
+    parser.add_argument("--repeat", type=int, default=1, help="Times every trace is replayed")
+    parser.add_argument("--json", type=str, default=None, help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    paths = args.traces or sorted(glob.glob(TRACES))
+    nodes, consistency = ring_nodes(args.ip, args.port)
+    if args.entry_only:
+        nodes = [(args.ip, args.port)]
+
+    sessions = []
+    for i, path in enumerate(paths):
+        ops = parse_trace(path) * args.repeat
+        name = os.path.splitext(os.path.basename(path))[0]
+        sessions.append(Session(name, ops, nodes[i % len(nodes)]))
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    if args.rate != None:
+        open_loop(sessions, args.rate, args.workers, recorder, args.poisson)
+    else:
+        closed_loop(sessions, args.clients or len(sessions), recorder)
+    result = report(recorder, consistency, time.perf_counter() - start)
+    result["mode"] = "open" if args.rate != None else "closed"
+
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
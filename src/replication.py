@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import os
+import queue
+import threading
+import time
+import requests
+
+from pool import peers
+import wire
+import rpc
+import tracing
+
+# Replication pipeline settings, can be overridden through environment variables
+REPLICATION_WORKERS = int(os.environ.get("CHORDIFY_REPLICATION_WORKERS", 4))
+REPLICATION_QUEUE_SIZE = int(os.environ.get("CHORDIFY_REPLICATION_QUEUE_SIZE", 4096))
+REPLICATION_LINGER = float(os.environ.get("CHORDIFY_REPLICATION_LINGER_MS", 2)) / 1000
+REPLICATION_BATCH_SIZE = int(os.environ.get("CHORDIFY_REPLICATION_BATCH_SIZE", 256))
+
+def send_replicas(ip, port, replicas, batch_size = REPLICATION_BATCH_SIZE):
+    # Send replicas to a node with as few /insertReplicasBatch requests as possible,
+    # returns (data, status) of the last one
+    result = ("No replicas to send", 200)
+    for i in range(0, len(replicas), batch_size):
+        result = post_replicas(ip, port, replicas[i:i + batch_size])
+    return result
+
+def post_replicas(ip, port, replicas):
+    # Over the RPC transport if the node has one, otherwise HTTP
+    client = rpc.client(ip, port)
+    if client != None:
+        return client.call("/insertReplicasBatch", {"replicas":replicas})
+    r = wire.request("POST", ip, port, "/insertReplicasBatch",
+                     lambda: wire.encode_entries(((None,d["key"],d["value"],d["replica_number"]) for d in replicas), with_hash=False),
+                     lambda: {"replicas":replicas})
+    return r.text, r.status_code
+
+class ReplicationQueue():
+    """
+        Sends replica updates in the background (eventual consistency).
+        Updates are sharded by key over the workers, so the updates of
+        one key are delivered in order. Queues are bounded: when they
+        are full, submit() blocks the caller (backpressure).
+    """
+
+    def __init__(self, workers = REPLICATION_WORKERS, maxsize = REPLICATION_QUEUE_SIZE):
+        self.queues = [queue.Queue(max(1, maxsize // workers)) for _ in range(workers)]
+        self.lock = threading.Lock()
+        self.started = False
+        self.enqueued = 0
+        self.delivered = 0
+        self.failed = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            for q in self.queues:
+                threading.Thread(target=self.worker, args=(q,), daemon=True).start()
+            self.started = True
+
+    def submit(self, key, method, ip, port, path, params = None, json = None, block = True, data = None, headers = None):
+        # Returns False if block is False and the queue of the key is full
+        if not self.started:
+            self.start()
+        q = self.queues[hash(key) % len(self.queues)]
+        # Delivered by a worker, so the trace of the caller goes with the update
+        params = tracing.carry(path, params)
+        try:
+            q.put((time.time(), method, ip, port, path, params, json, data, headers), block=block)
+        except queue.Full:
+            return False
+        with self.lock:
+            self.enqueued += 1
+        return True
+
+    def worker(self, q):
+        while True:
+            enqueued_at, method, ip, port, path, params, json, data, headers = q.get()
+            try:
+                r = peers.request(method, ip, port, path, params=params, json=json, data=data, headers=headers)
+                ok = r.status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            lag = time.time() - enqueued_at
+
+            with self.lock:
+                if ok:
+                    self.delivered += 1
+                else:
+                    self.failed += 1
+                self.last_lag = lag
+                self.max_lag = max(self.max_lag, lag)
+                self.total_lag += lag
+            q.task_done()
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def flush(self):
+        # Wait until every submitted update has been sent
+        for q in self.queues:
+            q.join()
+
+    def stats(self):
+        with self.lock:
+            done = self.delivered + self.failed
+            return {
+                "queue_depth": self.depth(),
+                "workers": len(self.queues),
+                "enqueued": self.enqueued,
+                "delivered": self.delivered,
+                "failed": self.failed,
+                "last_lag": self.last_lag,
+                "max_lag": self.max_lag,
+                "avg_lag": self.total_lag / done if done > 0 else 0.0,
+            }
+
+class Batch():
+    def __init__(self, seq, ip, port):
+        self.seq = seq
+        self.ip = ip
+        self.port = port
+        self.items = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+
+class Lane():
+    # Batches for one node: the one open for writes, and the order they are sent in
+    def __init__(self):
+        self.pending = None
+        self.next_seq = 0
+        self.sent_seq = 0
+        self.sending = threading.Condition()
+
+class ReplicaBatcher():
+    """
+        Group commit for chain replication. Concurrent writes that are
+        submitted within `linger` seconds share one /insertReplicasBatch
+        request, and every writer returns once its batch is acknowledged.
+        Batches for a node are sent one at a time, in the order they were
+        opened; batches for different nodes are independent.
+    """
+
+    def __init__(self, linger = REPLICATION_LINGER, batch_size = REPLICATION_BATCH_SIZE):
+        self.linger = linger
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        # Lane of every node we sent replicas to, by (ip, port)
+        self.lanes = {}
+
+    def submit(self, ip, port, item):
+        with self.lock:
+            lane = self.lanes.get((ip, port))
+            if lane is None:
+                lane = self.lanes[(ip, port)] = Lane()
+            batch = lane.pending
+            leader = batch is None
+            if leader:
+                batch = Batch(lane.next_seq, ip, port)
+                lane.next_seq += 1
+                lane.pending = batch
+            batch.items.append(item)
+            if len(batch.items) >= self.batch_size:
+                lane.pending = None
+                batch.full.set()
+
+        if not leader:
+            batch.done.wait()
+            return batch.result
+
+        # Leader: wait for more writes to join. The batch stays open
+        # while the previous one is in flight, then it is sent as a whole.
+        batch.full.wait(self.linger)
+        with lane.sending:
+            lane.sending.wait_for(lambda: lane.sent_seq == batch.seq)
+        with self.lock:
+            if lane.pending is batch:
+                lane.pending = None
+
+        try:
+            batch.result = post_replicas(ip, port, batch.items)
+        except requests.exceptions.RequestException as e:
+            batch.result = (str(e), 500)
+        finally:
+            with lane.sending:
+                lane.sent_seq += 1
+                lane.sending.notify_all()
+            batch.done.set()
+
+        return batch.result
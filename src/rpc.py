@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+import os
+import json
+import queue
+import socket
+import struct
+import threading
+import time
+import requests
+
+import metrics
+import tracing
+from pool import peers, CONNECT_TIMEOUT, READ_TIMEOUT
+
+# Framed TCP transport for the routing & replication calls between nodes.
+# Every peer gets one persistent connection, shared by all in-flight calls:
+# requests carry an id and responses may come back in any order.
+# The HTTP API stays for clients, the CLI and every other endpoint.
+#
+# Frame: payload length, request id, payload
+# Request payload: JSON [path, params], response payload: JSON [data, status]
+
+# CHORDIFY_RPC=0 turns the transport off, nodes then talk HTTP only
+ENABLED = not os.environ.get("CHORDIFY_RPC", "1") == "0"
+FRAME = struct.Struct("<IQ")
+# Seconds before connecting again to a peer that could not be reached
+RETRY_INTERVAL = float(os.environ.get("CHORDIFY_RPC_RETRY", 1.0))
+
+class RpcConnectionError(requests.exceptions.ConnectionError):
+    # Raised like a failed HTTP request, so callers handle both the same way
+    pass
+
+def read_frame(f):
+    header = f.read(FRAME.size)
+    if len(header) < FRAME.size:
+        return None, None
+    length, request_id = FRAME.unpack(header)
+    payload = f.read(length)
+    if len(payload) < length:
+        return None, None
+    return request_id, payload
+
+def encode_frame(request_id, message):
+    payload = json.dumps(message).encode()
+    return FRAME.pack(len(payload), request_id) + payload
+
+class Workers():
+    """
+        Threads that run the calls of the RPC server. A thread is started
+        whenever no one is idle: calls forward to other nodes and wait for
+        them, so a bounded pool could deadlock across the ring.
+    """
+
+    def __init__(self):
+        self.tasks = queue.Queue()
+        self.lock = threading.Lock()
+        self.idle = 0
+
+    def submit(self, function, *args):
+        with self.lock:
+            if self.idle == 0:
+                threading.Thread(target=self.worker, daemon=True).start()
+            else:
+                self.idle -= 1
+        self.tasks.put((function, args))
+
+    def worker(self):
+        while True:
+            function, args = self.tasks.get()
+            function(*args)
+            with self.lock:
+                self.idle += 1
+
+class RpcServer():
+    def __init__(self, ip, handlers, port = 0):
+        # handlers: path -> function(params) returning (data, status)
+        self.handlers = handlers
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((ip, port))
+        self.sock.listen(128)
+        self.port = self.sock.getsockname()[1]
+        self.workers = Workers()
+
+    def start(self):
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        return self
+
+    def accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                if self.sock.fileno() == -1:
+                    # Listener closed
+                    return
+                # e.g. out of file descriptors, or the peer reset before we got to it
+                time.sleep(0.1)
+                continue
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def serve(self, conn):
+        write_lock = threading.Lock()
+        f = conn.makefile("rb")
+        try:
+            while True:
+                request_id, payload = read_frame(f)
+                if request_id == None:
+                    break
+                self.workers.submit(self.handle, conn, write_lock, request_id, payload)
+        except OSError:
+            pass
+        finally:
+            f.close()
+            conn.close()
+
+    def handle(self, conn, write_lock, request_id, payload):
+        try:
+            path, params = json.loads(payload)
+            handler = self.handlers.get(path)
+            if handler == None:
+                result = ("Not supported RPC path {}".format(path), 404)
+            else:
+                result = handler(params)
+        except Exception as e:
+            result = (str(e), 500)
+        try:
+            with write_lock:
+                conn.sendall(encode_frame(request_id, result))
+        except OSError:
+            # Caller is gone
+            pass
+
+class Call():
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+class RpcClient():
+    def __init__(self, ip, port, peer = None):
+        # peer: "ip:port" of the node's HTTP API, to label its metrics
+        self.peer = peer if peer != None else "{}:{}".format(ip, port)
+        self.sock = socket.create_connection((ip, port), timeout=CONNECT_TIMEOUT)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Reentrant, as a failed send closes the connection with the lock held
+        self.lock = threading.RLock()
+        self.calls = {}
+        self.next_id = 0
+        self.closed = False
+        threading.Thread(target=self.read_loop, daemon=True).start()
+
+    def call(self, path, params = None, timeout = READ_TIMEOUT):
+        # Returns (data, status), like server.from_response
+        params = tracing.carry(path, params)
+        start = time.perf_counter()
+        try:
+            data, status = self.send(path, params, timeout)
+        except requests.exceptions.RequestException:
+            metrics.peer_call(self.peer, path, "rpc", start, False)
+            tracing.called(self.peer, path, start, None)
+            raise
+        metrics.peer_call(self.peer, path, "rpc", start, status < 500)
+        tracing.called(self.peer, path, start, status)
+        return data, status
+
+    def send(self, path, params, timeout):
+        call = Call()
+        with self.lock:
+            if self.closed:
+                raise RpcConnectionError("RPC connection closed")
+            self.next_id += 1
+            request_id = self.next_id
+            self.calls[request_id] = call
+            try:
+                self.sock.sendall(encode_frame(request_id, (path, params)))
+            except OSError as e:
+                self.calls.pop(request_id, None)
+                self.close()
+                raise RpcConnectionError(str(e))
+
+        if not call.done.wait(timeout):
+            with self.lock:
+                self.calls.pop(request_id, None)
+            raise requests.exceptions.ReadTimeout("RPC call {} timed out".format(path))
+        if call.result == None:
+            raise RpcConnectionError("RPC connection closed")
+        data, status = call.result
+        return data, status
+
+    def read_loop(self):
+        f = self.sock.makefile("rb")
+        try:
+            while True:
+                request_id, payload = read_frame(f)
+                if request_id == None:
+                    break
+                with self.lock:
+                    call = self.calls.pop(request_id, None)
+                if call != None:
+                    call.result = json.loads(payload)
+                    call.done.set()
+        except OSError:
+            pass
+        finally:
+            f.close()
+            self.close()
+
+    def close(self):
+        # Fail the calls still waiting for a response
+        with self.lock:
+            self.closed = True
+            calls, self.calls = self.calls, {}
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        for call in calls.values():
+            call.done.set()
+
+class Peer():
+    def __init__(self):
+        # Held while connecting, so a slow peer only holds up its own callers
+        self.lock = threading.Lock()
+        # RpcClient, False if the peer has no RPC server, None if not connected
+        self.client = None
+        # An unreachable peer is not tried again before this time (time.monotonic())
+        self.retry_at = 0.0
+
+# Connection state of the RPC servers of peers, by the (ip, port) of their HTTP API
+clients = {}
+clients_lock = threading.Lock()
+
+def client(ip, port):
+    # RpcClient of a peer, or None if we have to use HTTP
+    if not ENABLED:
+        return None
+    with clients_lock:
+        peer = clients.get((ip, port))
+        if peer == None:
+            peer = clients[(ip, port)] = Peer()
+    c = peer.client
+    if c == None or (c != False and c.closed):
+        with peer.lock:
+            c = peer.client
+            if c == None or (c != False and c.closed):
+                if time.monotonic() < peer.retry_at:
+                    return None
+                c = connect(ip, port)
+                if c == None:
+                    # Unreachable peer, use HTTP until it is time to ask again
+                    peer.retry_at = time.monotonic() + RETRY_INTERVAL
+                    return None
+                peer.client = c
+    return c if c != False else None
+
+def connect(ip, port):
+    try:
+        r = peers.get(ip, port, "/rpc", timeout=(CONNECT_TIMEOUT, CONNECT_TIMEOUT))
+        if not r.status_code == 200 or r.json()["port"] == 0:
+            return False
+        return RpcClient(ip, r.json()["port"], "{}:{}".format(ip, port))
+    except (requests.exceptions.RequestException, OSError, ValueError, KeyError):
+        return None
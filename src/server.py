@@ -2,21 +2,119 @@
 
 from flask import Flask
 from flask import request
+from flask import g
+from flask import make_response
 import requests
-from requests.adapters import HTTPAdapter
-import multiprocessing
+from werkzeug.serving import WSGIRequestHandler
 import logging
+import os
 import socket
 import sys
 import json
+import threading
+import itertools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from node import *
+from pool import peers
+from replication import ReplicationQueue, ReplicaBatcher, send_replicas
+from storage import open_storage, RecoveryError
+import wire
+import rpc
+import metrics
+import tracing
+
+# Seconds between two rounds of the stabilize/fix-fingers loop
+FIX_FINGERS_INTERVAL = 1.0
+# Parallel sub-batches/keys handled by a batch request
+BATCH_WORKERS = 16
+# Keys per chunk of a streamed key transfer
+TRANSFER_CHUNK = 1024
+# Nodes dumped at once by /queryAll
+SCAN_WORKERS = 16
+# Items per page (or NDJSON line) of a dump, unless the request sets a limit
+DUMP_PAGE = 1000
 
 # Initialize the Flask application
 app = Flask(__name__)
+# Background delivery of replicas for eventual consistency
+replication = ReplicationQueue()
+# Group commit of replicas for chain replication
+batcher = ReplicaBatcher()
+# Ports of the other virtual nodes of this server (see multinode.py),
+# they join & depart along with this node
+vnodes = []
+# Framed TCP transport for routing & replication, started with the server
+rpc_server = None
 log = logging.getLogger('werkzeug')
 # Hide logs of HTTP requests
 log.disabled = True
 
+# Metrics of this server, served on /metrics
+registry = metrics.Registry()
+registry.describe("chordify_http_requests_total", "counter", "HTTP requests served, by route, method and status")
+registry.describe("chordify_http_request_duration_seconds", "histogram", "Time to answer HTTP requests, by route")
+registry.describe("chordify_http_requests_in_flight", "gauge", "HTTP requests being served, by route")
+registry.gauge("chordify_keys", "Primary keys stored by this node",
+               lambda: [] if node == None else [((), len(node.data))])
+registry.gauge("chordify_replicas", "Replicas stored by this node",
+               lambda: [] if node == None else [((), len(node.replicas))])
+registry.gauge("chordify_replication_queue_depth", "Replica updates waiting for delivery (eventual consistency)",
+               lambda: [((), replication.depth())])
+registry.gauge("chordify_replication_updates_total", "Replica updates delivered in the background, by outcome",
+               lambda: [((("outcome", "delivered"),), replication.delivered), ((("outcome", "failed"),), replication.failed)],
+               kind="counter")
+
+# Spans of the requests served by this server, see /trace
+tracer = tracing.Tracer()
+
+def route():
+    # Route of the current request, as a metric label
+    return request.url_rule.rule if request.url_rule != None else "unmatched"
+
+def request_started(route):
+    registry.add("chordify_http_requests_in_flight", (("route", route),), 1)
+    return time.perf_counter()
+
+def request_finished(route, method, status, start):
+    labels = (("route", route),)
+    registry.add("chordify_http_requests_in_flight", labels, -1)
+    registry.add("chordify_http_requests_total", labels + (("method", method), ("status", str(status))))
+    registry.observe("chordify_http_request_duration_seconds", labels, time.perf_counter() - start)
+
+@app.before_request
+def start_metrics():
+    g.metrics_start = request_started(route())
+
+@app.after_request
+def response_metrics(response):
+    g.metrics_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_metrics(error):
+    # Runs after every request, whatever happened to it
+    start = g.pop("metrics_start", None)
+    if start != None:
+        request_finished(route(), request.method, g.pop("metrics_status", 500), start)
+
+@app.before_request
+def start_trace():
+    g.trace = tracer.begin("{}:{}".format(ip, port), request.path, request.args)
+
+@app.after_request
+def trace_header(response):
+    if g.get("trace") != None:
+        # So that the client can ask for /trace/<id>
+        response.headers["X-Trace-Id"] = g.trace[0].trace
+        g.trace_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_trace(error):
+    tracer.end(g.pop("trace", None), g.pop("trace_status", 500))
+
 def shutdown_server():
     func = request.environ.get('werkzeug.server.shutdown')
     if func is None:
@@ -30,80 +128,212 @@ def health_check():
 
 @app.route('/join', methods=['PUT'])
 def join():
+    response = make_response(join_node())
+    if response.status_code == 200:
+        # Our other virtual nodes join through the same bootstrap node, as part of our server
+        params = dict(request.args.items(), server=request.args.get("server") or "{}:{}".format(ip, port))
+        for vnode_port in vnodes:
+            r = peers.put(ip, vnode_port, "/join", params=params)
+            if not r.status_code == 200:
+                return "Virtual node {}:{} could not join: {}".format(ip, vnode_port, r.text), r.status_code
+    return response
+
+def join_node():
     global node, ip, port, kappa, consistency
     bnode_ip = request.args.get("ip")
     bnode_port = int(request.args.get("port")) # port number was given as string, so we have to cast to (int)
+    # Virtual nodes of the same physical server share its "ip:port"
+    server = request.args.get("server")
 
     if not node is None:
         return "You're already part of chord.", 403
 
+    # Durable stores (if enabled) come back with the keys of the local log
+    try:
+        storage = open_storage(ip, port)
+    except RecoveryError as e:
+        print("Could not recover the local storage: {}".format(e), file=sys.stderr)
+        return "Could not recover the local storage: {}".format(e), 500
+
     if ip == bnode_ip and port == bnode_port:
-        node = BootstrapNode(ip, port, kappa, consistency)
+        node = BootstrapNode(ip, port, kappa, consistency, server, storage)
         return "New chord created.", 200
     else:
         
-        node = Node(ip, port, (bnode_ip, bnode_port), kappa, consistency)
+        node = Node(ip, port, (bnode_ip, bnode_port), kappa, consistency, server, storage)
+        params = {"ip":node.ip,"port":node.port,"server":node.server}
+        if storage != None and storage.recovered():
+            # We may have crashed while still being part of chord
+            params["rejoin"] = 1
         
         # Communicate with bootstrap node
-        url = "http://{}:{}/addNode".format(bnode_ip,bnode_port)
-        r = requests.put(url, params={"ip":node.ip,"port":node.port})
+        r = peers.put(bnode_ip, bnode_port, "/addNode", params=params)
         
         if r.status_code == 200:
 
             data = r.json()
             node.previous_node = RefNode(data["previous"]["ip"],int(data["previous"]["port"]))
             node.next_node = RefNode(data["next"]["ip"],int(data["next"]["port"]))
+            node.reset_fingers()
+
+            # Servers run many virtual nodes: replica chains skip nodes of the
+            # same server and are repaired by reconcile_ring, not by position
+            shared = data.get("shared", False)
+
+            if data.get("rejoin"):
+                # Nobody took over our keys, so the recovered ones are up to date
+                peers.put(node.previous_node.ip, node.previous_node.port, "/changeNext", params={"ip":node.ip,"port":node.port})
+                peers.put(node.next_node.ip, node.next_node.port, "/changePrevious", params={"ip":node.ip,"port":node.port})
+                if data.get("restore"):
+                    # We came back without any keys, the ring still has copies of them
+                    restore_keys(shared)
+                    return "Node restored {} keys & {} replicas from the ring.".format(len(node.data), len(node.replicas)), 200
+                if shared:
+                    reconcile_ring()
+                return "Node recovered {} keys & {} replicas from local storage.".format(len(node.data), len(node.replicas)), 200
+
+            if storage != None and storage.recovered():
+                # Keys of a previous membership are stale, the ring sends the current ones
+                node.data.clear()
+                node.replicas.clear()
             
             # Inform neighboors
             # Receive keys from next
-            url = "http://{}:{}/transferKeys".format(node.next_node.ip,node.next_node.port)
-            r1 = requests.get(url, params={"keynode":node.key})
+            r1 = peers.get(node.next_node.ip, node.next_node.port, "/transferKeys", params={"keynode":node.key}, stream=True, headers=accept(node.next_node))
 
-            # Download Primary Keys
-            data = r1.json()
-            node.data = {d["key_hash"]:(d["key"],d["value"]) for d in data["keys"]}
+            # Download Primary Keys (and replicas) as they arrive
+            receive_keys(r1)
 
-            if node.kappa > 1:
+            if node.kappa > 1 and not shared:
 
                 if node.consistency_type == "chain-replication" or node.consistency_type == "eventual-consistency":
                     
-                    node.replicas = {d["key_hash"]:(d["key"],d["value"],d["replica_number"]) for d in data["replicas"]}
                     # Initiate fix replicas operation
-                    s = requests.Session()
-                    s.mount('http://', HTTPAdapter(max_retries=0))
-                    url = "http://{}:{}/initfixReplicas".format(node.next_node.ip,node.next_node.port)
-                    s.get(url)
+                    peers.get(node.next_node.ip, node.next_node.port, "/initfixReplicas")
 
             # Inform previous
-            url = "http://{}:{}/changeNext".format(node.previous_node.ip,node.previous_node.port)
-            r2 = requests.put(url, params={"ip":node.ip,"port":node.port})
+            r2 = peers.put(node.previous_node.ip, node.previous_node.port, "/changeNext", params={"ip":node.ip,"port":node.port})
             
             # Inform next
-            url = "http://{}:{}/changePrevious".format(node.next_node.ip,node.next_node.port)
-            r3 = requests.put(url, params={"ip":node.ip,"port":node.port})
+            r3 = peers.put(node.next_node.ip, node.next_node.port, "/changePrevious", params={"ip":node.ip,"port":node.port})
 
             if node.kappa == 1:
                 # Tell next to delete unnecessary keys
-                url = "http://{}:{}/deleteKeys".format(node.next_node.ip,node.next_node.port)
-                r4 = requests.delete(url, params={"keynode":node.key})
+                r4 = peers.delete(node.next_node.ip, node.next_node.port, "/deleteKeys", params={"keynode":node.key})
 
             # Edge case:
-            elif node.kappa > 1:
-                
-                data = {"existing":list(node.replicas.keys()) + list(node.data.keys())}
-                url = "http://{}:{}/generateReplicas".format(node.previous_node.ip,node.previous_node.port)
-                r5 = requests.get(url,json=json.dumps(data))
-
-                data = r5.json()["keys"]
+            elif node.kappa > 1 and not shared:
+                generate_replicas_from_previous()
 
-                for d in data:
-                    node.add_replica(d["key"],d["value"],d["replica_number"])
+            if node.kappa > 1 and shared:
+                reconcile_ring()
             
             return "New node added successfully!", 200
 
         else:
             return r.text, r.status_code
 
+def generate_replicas_from_previous():
+    # Replicas we miss, made by the previous node out of its keys & replicas
+    existing = list(node.replicas.keys()) + list(node.data.keys())
+    r = wire.request("GET", node.previous_node.ip, node.previous_node.port, "/generateReplicas",
+                     lambda: wire.encode_hashes(existing), lambda: {"existing":existing})
+
+    if wire.is_binary(r):
+        data = [{"key":key,"value":value,"replica_number":replica_number} for (_,key,value,replica_number) in wire.decode_entries(r.content)[0]]
+    else:
+        data = r.json()["keys"]
+
+    for d in data:
+        node.add_replica(d["key"],d["value"],d["replica_number"])
+
+def restore_keys(shared):
+    # We are still a member but lost our keys (restarted with an empty store):
+    # our keys come back from their first replicas, our replicas from the
+    # nodes whose keys they are. With kappa 1 there are no copies to restore.
+    members = ring_membership()
+    if node.kappa == 1 or members == None:
+        return
+    chain = Placement(members, node.kappa).chain(node.key)
+    if len(chain) > 1:
+        holder = chain[1]
+        params = {"key":"*","store":"replicas","after":-1,"limit":DUMP_PAGE}
+        while True:
+            r = peers.get(holder.ip, holder.port, "/query", params=params)
+            if not r.status_code == 200:
+                break
+            page = r.json()
+            node.data.update((d["hash"], (d["key"], d["value"])) for d in page["items"]
+                             if d["replica_number"] == 1 and in_range(d["hash"], node.previous_node.key, node.key))
+            if page["cursor"] == None:
+                break
+            params.update(store=page["cursor"]["store"], after=page["cursor"]["after"])
+
+    if shared:
+        # Every node sends the replicas of its keys again, ours among them
+        reconcile_ring(push=True)
+    else:
+        generate_replicas_from_previous()
+
+def receive_keys(r):
+    # Stores an NDJSON (or binary) stream of /transferKeys line by line,
+    # so only TRANSFER_CHUNK keys are decoded at a time
+    global node
+    if wire.is_binary(r):
+        for payload in wire.read_frames(r.iter_content(chunk_size=64 * 1024)):
+            entries, _ = wire.decode_entries(payload, 1)
+            if payload[0] == 0:
+                node.data.update((k,(key,value)) for (k,key,value,_) in entries)
+            else:
+                node.replicas.update((k,(key,value,replica_number)) for (k,key,value,replica_number) in entries)
+        return
+
+    for line in r.iter_lines(chunk_size=64 * 1024):
+        if not line:
+            continue
+        d = json.loads(line)
+        if d["store"] == "keys":
+            node.data.update((k,(key,value)) for (k,key,value) in d["items"])
+        else:
+            node.replicas.update((k,(key,value,replica_number)) for (k,key,value,replica_number) in d["items"])
+
+def chunks(items):
+    # Lists of up to TRANSFER_CHUNK items, taken from items as they are needed
+    items = iter(items)
+    chunk = list(itertools.islice(items, TRANSFER_CHUNK))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(items, TRANSFER_CHUNK))
+
+def page_items(store, start, end):
+    # Items of store in the ring interval (start, end] in hash order, read
+    # a page at a time instead of copying the whole interval up front
+    for (after, last) in ([(start, end)] if start < end else [(start, None), (-1, end)]):
+        while True:
+            page = store.page(after, TRANSFER_CHUNK)
+            for (k, v) in page:
+                if not last == None and k > last:
+                    return
+                yield (k, v)
+            if len(page) < TRANSFER_CHUNK:
+                break
+            after = page[-1][0]
+
+def stream_frames(keys, replicas):
+    # Binary version of stream_keys: one frame per chunk, a store byte
+    # (0 for keys, 1 for replicas) followed by the entries of the chunk
+    for store, items in ((0, keys), (1, replicas)):
+        for chunk in chunks(items):
+            entries = [(k,v[0],v[1],v[2] if store == 1 else None) for (k,v) in chunk]
+            yield wire.frame(bytes([store]) + wire.encode_entries(entries))
+
+def stream_keys(keys, replicas):
+    # One NDJSON line per chunk of TRANSFER_CHUNK keys:
+    # {"store": "keys" or "replicas", "items": [[key_hash, key, value, (replica_number)], ...]}
+    for store, items in (("keys", keys), ("replicas", replicas)):
+        for chunk in chunks(items):
+            yield json.dumps({"store":store,"items":[(k,) + v for (k,v) in chunk]}) + "\n"
+
 @app.route('/changeNext',methods=['PUT'])
 def change_next():
     new_ip = request.args.get("ip")
@@ -112,6 +342,7 @@ def change_next():
         node.next_node = None
     else:
         node.next_node = RefNode(new_ip,new_port)
+    node.reset_fingers()
     return "Changed next node.", 200
 
 @app.route('/changePrevious',methods=['PUT'])
@@ -130,18 +361,28 @@ def add_node():
     if node.is_bootstrap():
         ip = request.args.get("ip")
         port = int(request.args.get("port"))
-        keynode = node.add_node(ip, port)
+        keynode = node.add_node(ip, port, request.args.get("server"))
+        rejoin = False
+        restore = False
         if keynode == -1:
-            return "Node is already inside chord.", 405
-        else:
-            prev_node, next_node = node.find_neighboors(keynode)
-            data = {"previous":{"ip":prev_node[0],"port":prev_node[1]}, "next":{"ip":next_node[0],"port":next_node[1]}}
-            response = app.response_class(
-                response=json.dumps(data),
-                status=200,
-                mimetype='application/json'
-            )
-            return response
+            # A node that crashed takes its place again, with the keys it
+            # recovered from its storage or without any (restore them)
+            keynode = hash_key("{}:{}".format(ip, port))
+            rejoin = True
+            restore = request.args.get("rejoin") == None
+        neighboors = node.find_neighboors(keynode)
+        if neighboors == None:
+            # Departed again while we were answering
+            return "Node left chord while joining.", 409
+        prev_node, next_node = neighboors
+        data = {"previous":{"ip":prev_node[0],"port":prev_node[1]}, "next":{"ip":next_node[0],"port":next_node[1]}, "rejoin":rejoin,
+                "restore":restore, "shared":shared_servers(node.membership()[1])}
+        response = app.response_class(
+            response=json.dumps(data),
+            status=200,
+            mimetype='application/json'
+        )
+        return response
     else:
         return "I'm not the bootstrap server. Please contact {}:{}".format(node.bnode.ip,node.bnode.port), 301
 
@@ -155,44 +396,56 @@ def depart():
     if node.is_bootstrap():
         return "Bootstrap node is not allowed to depart!", 403
     else:
+        # Our other virtual nodes leave first
+        for vnode_port in vnodes:
+            r = peers.delete(ip, vnode_port, "/depart")
+            if not r.status_code in (200, 403):
+                return "Virtual node {}:{} could not depart: {}".format(ip, vnode_port, r.text), r.status_code
+
+        # Pending replica updates must reach the ring before we leave
+        replication.flush()
+        # Replica chains skip nodes of the same server, reconcile_ring repairs them
+        shared = node.placement != None
+
         # Send keys to next node
-        if not node.data == {}:
-            data_list = [{"key_hash":k,"key":v[0],"value":v[1]} for (k,v) in node.data.items()]
-            data = {"keys":data_list}
-            r = requests.post("http://{}:{}/send".format(node.next_node.ip,node.next_node.port), json=json.dumps(data))
+        if len(node.data) > 0:
+            items = list(node.data.items())
+            r = wire.request("POST", node.next_node.ip, node.next_node.port, "/send",
+                             lambda: wire.encode_entries((k,v[0],v[1],None) for (k,v) in items),
+                             lambda: {"keys":[{"key_hash":k,"key":v[0],"value":v[1]} for (k,v) in items]})
 
             # In case of replication, my replicas sould shift
-            if node.kappa > 1:
+            if node.kappa > 1 and not shared:
                 
                 if node.consistency_type == "chain-replication" or node.consistency_type == "eventual-consistency":
                     
-                    s = requests.Session()
-                    s.mount('http://', HTTPAdapter(max_retries=0))
-                    r = s.post("http://{}:{}/shiftReplicas".format(node.next_node.ip,node.next_node.port))
+                    r = peers.post(node.next_node.ip, node.next_node.port, "/shiftReplicas")
 
         # Send replicas
-        if not node.replicas == {}:
+        if len(node.replicas) > 0 and not shared:
 
             if node.consistency_type == "chain-replication" or node.consistency_type == "eventual-consistency":            
                 
-                s = requests.Session()
-                s.mount('http://', HTTPAdapter(max_retries=0))
-                        
-                for (k,v) in node.replicas.items():
-                    r = s.post("http://{}:{}/insertReplicas".format(node.next_node.ip,node.next_node.port),params={"key":v[0],"value":v[1],"replica_number":v[2]})
+                replicas = [{"key":v[0],"value":v[1],"replica_number":v[2]} for (k,v) in node.replicas.items()]
+                r = send_replicas(node.next_node.ip, node.next_node.port, replicas)
 
         # Communicate with bootstrap node
-        url = "http://{}:{}/removeNode".format(node.bnode.ip,node.bnode.port)
-        r = requests.delete(url, params={"keynode":node.key})
+        r = peers.delete(node.bnode.ip, node.bnode.port, "/removeNode", params={"keynode":node.key})
         
         # Inform neighboors
         # Inform Previous
-        url = "http://{}:{}/changeNext".format(node.previous_node.ip,node.previous_node.port)
-        requests.put(url, params={"ip":node.next_node.ip,"port":node.next_node.port})
+        peers.put(node.previous_node.ip, node.previous_node.port, "/changeNext", params={"ip":node.next_node.ip,"port":node.next_node.port})
         
         # Inform Next
-        url = "http://{}:{}/changePrevious".format(node.next_node.ip,node.next_node.port)
-        requests.put(url, params={"ip":node.previous_node.ip,"port":node.previous_node.port})
+        peers.put(node.next_node.ip, node.next_node.port, "/changePrevious", params={"ip":node.previous_node.ip,"port":node.previous_node.port})
+
+        if shared:
+            # Our replicas are made again on the nodes that take our place in the chains
+            reconcile_ring()
+
+        # Our keys live on the next node now
+        if node.storage != None:
+            node.storage.reset()
         
         node = None
         
@@ -203,16 +456,15 @@ def shift_replicas():
     global node
     
     deletion_keys = set()
-    s = requests.Session()
-    s.mount('http://', HTTPAdapter(max_retries=0))
+    replicas = []
     
     for (k,(key,value,replica_num)) in node.replicas.items():
         if replica_num == 1:
-            
-            r = s.post("http://{}:{}/insertReplicas".format(node.next_node.ip,node.next_node.port),params={"key":key,"value":value,"replica_number":1})
-            
+            replicas.append({"key":key,"value":value,"replica_number":1})
             deletion_keys.add(k)
 
+    r = send_replicas(node.next_node.ip, node.next_node.port, replicas)
+
     # Delete unnecessary keys
     for k in deletion_keys:
         del node.replicas[k]
@@ -226,6 +478,8 @@ def kickout():
         return "Bootstrap node is not allowed to be excluded!", 200
     else:
         # Communicate with bootstrap node
+        if node.storage != None:
+            node.storage.close()
         node = None
         return "Node object deleted!", 200
 
@@ -253,15 +507,18 @@ def query():
         return "You have to join first.", 403
     
     if key_value == "*":
-        
-        data_list = [{
-                        "node":{"hash":node.key, "ip":node.ip, "port":node.port}, 
-                        "keys":[{"hash":k, "key":v[0], "value":v[1]} for k,v in node.data.items()], 
-                        "replicas":[{"hash":k, "key":v[0], "value":v[1],"replica_number":v[2]} for k,v in node.replicas.items()],
-                    }]
+
+        if "limit" in request.args or request.args.get("format") == "ndjson":
+            # One page of the dump, or all of it streamed as NDJSON
+            try:
+                store, after, limit = dump_args()
+            except ValueError as e:
+                return str(e), 400
+            header = {"node":{"hash":node.key,"ip":node.ip,"port":node.port}}
+            return dump_response(header, store, after, limit, dump_item)
 
         response = app.response_class(
-            response=json.dumps(data_list),
+            response=json.dumps([node_dump()]),
             status=200,
             mimetype='application/json'
         )
@@ -269,150 +526,124 @@ def query():
         return response
 
     else:
-
+        data, status = timed("/query", request.args, query_key, key_value)
+        if isinstance(data, dict) and "stats" in data:
+            # Time to encode the answer, measured on a first encoding
+            start = time.perf_counter()
+            json.dumps(data)
+            data["stats"]["serialize_ms"] = (time.perf_counter() - start) * 1000
+        return respond(data, status)
+
+def query_key(key_value, key = None):
+    # Returns (data, status) for a single key, forwarding if needed.
+    # key is the hash of key_value, if the caller has computed it already.
+    if key == None:
         key = hash_key(key_value)
-        successor = node.successor(key_value)
-        
-        if successor.key == node.key:
+    successor = node.successor_of(key)
+    
+    if successor.key == node.key:
 
-            if key in node.data:
-
-                data = {
-                        "hash": key,
-                        "key": node.data[key][0],
-                        "value": node.data[key][1],
-                        "replica_number": "original",
-                        "node_ip": node.ip,
-                        "node_port": node.port,
-                    }
-                my_response = app.response_class(
-                                response=json.dumps(data),
-                                status=200,
-                                mimetype='application/json'
-                            )
-                
-                if node.kappa == 1:
+        if key in node.data:
+
+            data = {
+                    "hash": key,
+                    "key": node.data[key][0],
+                    "value": node.data[key][1],
+                    "replica_number": "original",
+                    "node_ip": node.ip,
+                    "node_port": node.port,
+                }
+            
+            # Node with the first replica, if any
+            target = node.replica_next(key, 0)
 
-                    return my_response
+            if target == None:
 
-                elif node.consistency_type == "chain-replication":
-                    
-                    s = requests.Session()
-                    s.mount('http://', HTTPAdapter(max_retries=0))
-                    url = "http://{}:{}/queryReplicas".format(node.next_node.ip,node.next_node.port)
-                    r = s.get(url,params={"key":key_value})
-                    
-                    if r.status_code == 200:
-                        return  app.response_class(
-                            response=json.dumps(r.json()),
-                            status=r.status_code,
-                            mimetype='application/json'
-                        )
-                    else:
-                        return r.text, r.status_code
+                return data, 200
+
+            elif node.consistency_type == "chain-replication":
                 
-                elif node.consistency_type == "eventual-consistency":
-                    
-                    return  my_response  
-            else:
-                return "Key not found.",404
+                next_data, status = call("GET", target, "/queryReplicas", {"key":key_value}, key)
+                # 204: the chain is being repaired, our copy is the one to answer with
+                return (data, 200) if status == 204 else (next_data, status)
+            
+            elif node.consistency_type == "eventual-consistency":
+                
+                return data, 200
         else:
+            return "Key not found.",404
+    else:
 
-            s = requests.Session()
-            s.mount('http://', HTTPAdapter(max_retries=0))
-
-            if node.kappa > 1 and key in node.replicas:
+        if node.kappa > 1 and key in node.replicas:
 
-                data = {
-                    "hash": key,
-                    "key": node.replicas[key][0],
-                    "value": node.replicas[key][1],
-                    "replica_number": node.replicas[key][2],
-                    "node_ip": node.ip,
-                    "node_port": node.port,
-                }
+            data = {
+                "hash": key,
+                "key": node.replicas[key][0],
+                "value": node.replicas[key][1],
+                "replica_number": node.replicas[key][2],
+                "node_ip": node.ip,
+                "node_port": node.port,
+            }
+            
+            if node.consistency_type == "eventual-consistency":
+                
+                return data, 200
 
-                my_response = app.response_class(
-                                response=json.dumps(data),
-                                status=200,
-                                mimetype='application/json'
-                            )
+            elif node.consistency_type == "chain-replication":
                 
-                if node.consistency_type == "eventual-consistency":
-                    
-                    return my_response
+                target = node.replica_next(key, node.replicas[key][2])
 
-                elif node.consistency_type == "chain-replication":
-                    
-                    if node.replicas[key][2] == node.kappa - 1 or node.next_node.key == successor.key: 
+                # Last replica, or next node is the primary, so this is the tail of the chain
+                if target == None or in_range(key, node.key, node.next_node.key): 
 
-                        return my_response
+                    return data, 200
 
-                    else:
-                        url = "http://{}:{}/query".format(node.next_node.ip,node.next_node.port)
-                        r = s.get(url,params={"key":key_value})
-
-                        if r.status_code == 200:
-                            return  app.response_class(
-                                response=json.dumps(r.json()),
-                                status=r.status_code,
-                                mimetype='application/json'
-                            )
-                        else:
-                            return r.text, r.status_code
-                    
-            # Send key to successor
-            url = "http://{}:{}/query".format(successor.ip,successor.port)
-            r = s.get(url,params={"key":key_value})
-            if r.status_code == 200:
-                return  app.response_class(
-                    response=json.dumps(r.json()),
-                    status=r.status_code,
-                    mimetype='application/json'
-                )
-            else:
-                return r.text, r.status_code
+                else:
+                    return call("GET", target, "/query", {"key":key_value}, key)
+                
+        # Send key to successor
+        return forward_call("GET", successor, "/query", {"key":key_value}, key)
 
 @app.route('/queryReplicas')
 def query_replicas():
     global node
 
-    key_value = request.args.get("key")
-    k, v, replica_number = node.replicas[hash_key(key_value)]
+    data, status = timed("/queryReplicas", request.args, query_replica, request.args.get("key"))
+    if status == 200 and not "stats" in data:
+        return respond_result(data)
+    return respond(data, status)
+
+def query_replica(key_value, key = None):
+    # Returns (data, status) of the last replica of the chain
+    if key == None:
+        key = hash_key(key_value)
+    if not key in node.replicas:
+        # Chains are being repaired, the caller answers with its own copy
+        return "No replica of {} here.".format(key_value), 204
+    k, v, replica_number = node.replicas[key]
 
-    if not node.key == node.successor(key_value).key:
+    if not node.key == node.successor_of(key).key:
 
         data = {
-            "hash": k,
+            "hash": key,
             "key": key_value,
             "value": v,
             "replica_number": replica_number,
             "node_ip": node.ip,
             "node_port": node.port,
         }
-        my_response = app.response_class(
-                                response=json.dumps(data),
-                                status=200,
-                                mimetype='application/json'
-                            )
     
-        if replica_number == node.kappa - 1:
-            return my_response
+        target = node.replica_next(key, replica_number)
+        if target == None:
+            return data, 200
         else:
                 
-            s = requests.Session()
-            s.mount('http://', HTTPAdapter(max_retries=0))
-            url = "http://{}:{}/queryReplicas".format(node.next_node.ip,node.next_node.port)
-            r = s.get(url,params={"key":key_value})
+            next_data, status = call("GET", target, "/queryReplicas", {"key":key_value}, key)
 
-            if r.status_code == 200:
-                return app.response_class(
-                            response=json.dumps(r.json()),
-                            status=200,
-                            mimetype='application/json'
-                        )
-            elif r.status_code == 204:
-                return my_response
+            if status == 200:
+                return next_data, 200
+            elif status == 204:
+                return data, 200
     else:
         return "Replica manager only have original data.", 204
 
@@ -434,46 +665,264 @@ def next_node():
         )
     return response
 
-@app.route('/queryAll')
-def query_all():
+@app.route('/previousNode')
+def previous_node():
+    global node
+    if node == None or node.previous_node == None:
+        response = app.response_class(
+            response=json.dumps({}),
+            status=204,
+            mimetype='application/json'
+        )
+    else:
+        response = app.response_class(
+            response=json.dumps({"ip":node.previous_node.ip,"port":node.previous_node.port}),
+            status=200,
+            mimetype='application/json'
+        )
+    return response
+
+@app.route('/findSuccessor')
+def find_successor_route():
     global node
 
     if node is None:
         return "You have to join first.", 403
 
-    data_list = [{
-                    "node":{"hash":node.key,"ip":node.ip,"port":node.port}, 
-                    "keys":[{"hash":k,"key":v[0], "value":v[1]} for k,v in node.data.items()], 
-                    "replicas":[{"hash":k,"key":v[0], "value":v[1],"replica_number":v[2]} for k,v in node.replicas.items()],
-                }]
-    
-    next_node = node.next_node
+    # Lookup either by identifier or by key
+    if request.args.get("key") != None:
+        key = hash_key(request.args.get("key"))
+    else:
+        key = int(request.args.get("id"))
 
-    if not next_node == None:
+    if request.args.get("iterative") == None:
+        successor = find_successor(node, key)
+        owner = True
+    else:
+        # Iterative lookup: return the next hop and let the client contact it
+        successor = node.successor_of(key)
+        owner = successor.key == node.key or in_range(key, node.key, node.next_node.key)
 
-        while not next_node.key == node.key:
-            # Find next node for query
-            url = "http://{}:{}/nextNode".format(next_node.ip,next_node.port)
-            r1 = requests.get(url)
-            
-            # Receive keys for next node
-            url = "http://{}:{}/query".format(next_node.ip,next_node.port)
-            r2 = requests.get(url, params={"key":"*"})
+    data = {"hash":successor.key, "ip":successor.ip, "port":successor.port, "owner":owner}
+    return app.response_class(
+        response=json.dumps(data),
+        status=200,
+        mimetype='application/json'
+    )
 
-            # Update data_list
-            if r2.status_code == 200:
-                data_list = data_list + r2.json()
+def dump_item(store, k, v):
+    # An item of /query?key=*
+    if store == "keys":
+        return {"hash":k,"key":v[0],"value":v[1]}
+    return {"hash":k,"key":v[0],"value":v[1],"replica_number":v[2]}
+
+def dump_args():
+    # (store, after, limit) of a paged dump: the page holds up to limit
+    # items of store ("keys" or "replicas") with hashes above after
+    store = request.args.get("store", "keys")
+    if not store in ("keys", "replicas"):
+        raise ValueError("store must be keys or replicas")
+    after = int(request.args.get("after", -1))
+    limit = int(request.args.get("limit", DUMP_PAGE))
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return store, after, limit
+
+def dump_page(tables, store, after, limit, item):
+    # Items of a page and the cursor of the next one, None after the last.
+    # Keys are listed first, then replicas.
+    items = tables[store].page(after, limit + 1)
+    if len(items) > limit:
+        items = items[:limit]
+        cursor = {"store":store,"after":items[-1][0]}
+    elif store == "keys":
+        cursor = {"store":"replicas","after":-1}
+    else:
+        cursor = None
+    return [item(store, k, v) for (k, v) in items], cursor
+
+def dump_lines(tables, header, store, after, limit, item):
+    # NDJSON dump from a page on: one line per page of up to limit items,
+    # header fields included, so the lines of many nodes can be concatenated
+    stores = ("keys", "replicas") if store == "keys" else ("replicas",)
+    for s in stores:
+        while True:
+            items = tables[s].page(after, limit)
+            yield json.dumps(dict(header, store=s, items=[item(s, k, v) for (k, v) in items])) + "\n"
+            if len(items) < limit:
+                break
+            after = items[-1][0]
+        after = -1
+
+def dump_response(header, store, after, limit, item):
+    tables = {"keys":node.data, "replicas":node.replicas}
+    if request.args.get("format") == "ndjson":
+        return app.response_class(
+            response=dump_lines(tables, header, store, after, limit, item),
+            status=200,
+            mimetype='application/x-ndjson'
+        )
+    items, cursor = dump_page(tables, store, after, limit, item)
+    return respond(dict(header, store=store, items=items, cursor=cursor), 200)
+
+def node_dump():
+    # Everything this node stores, as listed by /query?key=*
+    return {
+        "node":{"hash":node.key,"ip":node.ip,"port":node.port},
+        "keys":[{"hash":k,"key":v[0], "value":v[1]} for k,v in node.data.items()],
+        "replicas":[{"hash":k,"key":v[0], "value":v[1],"replica_number":v[2]} for k,v in node.replicas.items()],
+    }
 
-            # Update next node
-            data = r1.json()
-            next_node = RefNode(data["ip"],data["port"])        
+@app.route('/queryAll')
+def query_all():
+    # The dumps of all nodes, as one JSON list streamed node by node.
+    # By default every node is asked at once (scan=parallel), with the
+    # members listed by the bootstrap node. scan=ring walks the ring
+    # through the next pointers, one node after the other.
+    global node
 
-    response = app.response_class(
-        response=json.dumps(data_list),
+    if node is None:
+        return "You have to join first.", 403
+
+    if "limit" in request.args or request.args.get("format") == "ndjson":
+        return query_all_pages()
+
+    members = None
+    if request.args.get("scan", "parallel") == "parallel":
+        members = ring_members()
+
+    if members == None:
+        parts = walk_ring(node.next_node)
+    else:
+        parts = scatter_gather(members)
+
+    return app.response_class(
+        response=stream_list(json.dumps(node_dump()).encode(), parts),
         status=200,
         mimetype='application/json'
     )
-    return response
+
+def query_all_pages():
+    # /queryAll a page at a time: a page comes from a single node and its
+    # cursor names the node of the next page. With format=ndjson the
+    # NDJSON dumps of all nodes are streamed one node after the other.
+    try:
+        store, after, limit = dump_args()
+    except ValueError as e:
+        return str(e), 400
+    members = [(node.ip, node.port)] + ring_order()
+
+    if request.args.get("format") == "ndjson":
+        def lines():
+            for (node_ip, node_port) in members:
+                try:
+                    r = peers.get(node_ip, node_port, "/query", params={"key":"*","format":"ndjson","limit":limit}, stream=True)
+                except requests.exceptions.RequestException:
+                    continue
+                if r.status_code == 200:
+                    yield from r.iter_content(chunk_size=64 * 1024)
+                r.close()
+        return app.response_class(response=lines(), status=200, mimetype='application/x-ndjson')
+
+    address = request.args.get("node", "{}:{}".format(node.ip, node.port))
+    node_ip, node_port = address.rsplit(":", 1)
+    member = (node_ip, int(node_port))
+    if not member in members:
+        return "Node {} is not part of chord.".format(address), 404
+    index = members.index(member)
+
+    r = peers.get(node_ip, node_port, "/query", params={"key":"*","store":store,"after":after,"limit":limit})
+    if not r.status_code == 200:
+        return r.text, r.status_code
+    data = r.json()
+    if data["cursor"] != None:
+        data["cursor"]["node"] = address
+    elif index + 1 < len(members):
+        data["cursor"] = {"node":"{}:{}".format(*members[index + 1]),"store":"keys","after":-1}
+    return respond(data, 200)
+
+def ring_order():
+    # (ip, port) of the other nodes in ring order starting after us
+    members = ring_members()
+    if members != None:
+        return members
+    members = []
+    next_node = node.next_node
+    while not next_node == None and not next_node.key == node.key:
+        members.append((next_node.ip, next_node.port))
+        data = peers.get(next_node.ip, next_node.port, "/nextNode").json()
+        next_node = RefNode(data["ip"],data["port"])
+    return members
+
+def ring_membership():
+    # (key, ip, port, server) of every member in ring order,
+    # or None if the bootstrap node does not tell
+    if node.is_bootstrap():
+        return node.membership()[1]
+    try:
+        r = peers.get(node.bnode.ip, node.bnode.port, "/membership")
+    except requests.exceptions.RequestException:
+        return None
+    if not r.status_code == 200:
+        return None
+    return [(d["node_key"], d["ip"], d["port"], d["server"]) for d in r.json()["nodes"]]
+
+def ring_members():
+    # (ip, port) of the other nodes in ring order starting after us,
+    # or None if the bootstrap node does not tell
+    members = ring_membership()
+    if members == None:
+        return None
+
+    after = [(node_ip, node_port) for (key, node_ip, node_port, _) in members if key > node.key]
+    before = [(node_ip, node_port) for (key, node_ip, node_port, _) in members if key < node.key]
+    return after + before
+
+def node_dumps(node_ip, node_port):
+    # The items of the JSON list returned by /query?key=* of a node, as
+    # raw bytes (no need to parse them to pass them on), None on failure
+    try:
+        r = peers.get(node_ip, node_port, "/query", params={"key":"*"})
+    except requests.exceptions.RequestException:
+        return None
+    if not r.status_code == 200:
+        return None
+    return r.content.strip()[1:-1]
+
+def scatter_gather(members):
+    # Fetch the dumps of members, SCAN_WORKERS at a time, and yield them
+    # in ring order. Only a window of dumps is held in memory at once.
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+        pending = deque()
+        members = iter(members)
+        for member in members:
+            pending.append(executor.submit(node_dumps, *member))
+            if len(pending) == SCAN_WORKERS:
+                break
+        while pending:
+            part = pending.popleft().result()
+            for member in members:
+                pending.append(executor.submit(node_dumps, *member))
+                break
+            if part:
+                yield part
+
+def walk_ring(next_node):
+    # Yield the dumps of the nodes following us, found through their next pointers
+    while not next_node == None and not next_node.key == node.key:
+        r = peers.get(next_node.ip, next_node.port, "/nextNode")
+        part = node_dumps(next_node.ip, next_node.port)
+        if part:
+            yield part
+        data = r.json()
+        next_node = RefNode(data["ip"],data["port"])
+
+def stream_list(first, parts):
+    # A JSON list out of the encoded items, sent as they come
+    yield b"[" + first
+    for part in parts:
+        yield b"," + part
+    yield b"]"
 
 @app.route('/insert',methods=['POST'])
 def insert():
@@ -483,13 +932,19 @@ def insert():
 
     if node is None:
         return "You have to join first.", 403
-    
-    successor = node.successor(key_value)
+
+    return respond(*insert_key(key_value, value))
+
+def insert_key(key_value, value, key = None):
+    # Returns (data, status) for a single key, forwarding if needed
+    if key == None:
+        key = hash_key(key_value)
+    successor = node.successor_of(key)
 
     if successor.key == node.key:
         
         # Add key here
-        key = node.add_key(key_value,value)
+        node.add_key(key_value, value, key)
 
         data = {
             "hash": key,
@@ -498,74 +953,104 @@ def insert():
             "node_ip": node.ip,
             "node_port": node.port,
         }
-        insert_response = app.response_class(
-                response=json.dumps(data),
-                status=200,
-                mimetype='application/json'
-            )
 
-        if node.kappa > 1:
+        # Node with the first replica, if any
+        target = node.replica_next(key, 0)
+
+        if target != None:
 
-            url = "http://{}:{}/insertReplicas".format(node.next_node.ip,node.next_node.port)
-            params = {"key":key_value,"value":value,"replica_number":1}
+            params = {"key":key_value,"value":value,"replica_number":1,"hash":key}
 
             if node.consistency_type == "chain-replication":
                 
-                s = requests.Session()
-                s.mount('http://', HTTPAdapter(max_retries=0))
-                r = s.post(url,params=params)
+                # Wait until the batch with this replica is acknowledged by the chain
+                batcher.submit(target.ip, target.port, params)
             
             elif node.consistency_type == "eventual-consistency":
                 
                 # Asychrnous call of insertReplicas
-                p1 = multiprocessing.Process(target=async_post, args=(url,params,{}))
-                # starting process 1
-                p1.start()
+                replication.submit(key_value, "POST", target.ip, target.port, "/insertReplicas",
+                                   **replica_request(target, key_value, value, 1))
             
-        return insert_response
+        return data, 200
     
     else:
         
         # Send key to successor
-        s = requests.Session()
-        s.mount('http://', HTTPAdapter(max_retries=0))
-        url = "http://{}:{}/insert".format(successor.ip,successor.port)
-        r = s.post(url,params={"key":key_value,"value":value})
-        
-        if r.status_code == 200:
-            return  app.response_class(
-                response=json.dumps(r.json()),
-                status=r.status_code,
-                mimetype='application/json'
-            )
-        else:
-            return r.text, r.status_code
+        return forward_call("POST", successor, "/insert", {"key":key_value,"value":value}, key)
 
 @app.route('/insertReplicas',methods=['POST'])
 def insert_replicas():
     global node
 
-    key_value = request.args.get("key")
-    value = request.args.get("value")
-    replica_number = int(request.args.get("replica_number"))
+    if wire.is_binary(request):
+        _, key_value, value, replica_number = wire.decode_entries(request.get_data())[0][0]
+    else:
+        key_value = request.args.get("key")
+        value = request.args.get("value")
+        replica_number = int(request.args.get("replica_number"))
+
+    return respond(*insert_replica(key_value, value, replica_number))
+
+def insert_replica(key_value, value, replica_number, key = None):
+    # Returns (data, status), passing the replica down the chain
+    if key == None:
+        key = hash_key(key_value)
     
     # Check if already have this key in data
     # Only edge case if kappa >= number on nodes
-    if not node.key == node.successor(key_value).key:
+    if not node.key == node.successor_of(key).key:
 
         # Update replica key
-        node.add_replica(key_value, value, replica_number)
+        node.add_replica(key_value, value, replica_number, key)
 
-        if replica_number < node.kappa - 1:
-            s = requests.Session()
-            s.mount('http://', HTTPAdapter(max_retries=0))
-            url = "http://{}:{}/insertReplicas".format(node.next_node.ip,node.next_node.port)
-            r = s.post(url,params={"key":key_value,"value":value,"replica_number":replica_number + 1})
-            
-            return r.text
+        target = node.replica_next(key, replica_number)
+        if target != None:
+            client = rpc.client(target.ip, target.port)
+            if client != None:
+                return client.call("/insertReplicas", {"key":key_value,"value":value,"replica_number":replica_number + 1,"hash":key})
+
+            r = peers.post(target.ip, target.port, "/insertReplicas", **replica_request(target, key_value, value, replica_number + 1))
+            return r.text, r.status_code
 
     return "Key {} & its replicas added successfully".format(key_value), 200
 
+@app.route('/insertReplicasBatch',methods=['POST'])
+def insert_replicas_batch():
+    global node
+
+    if wire.is_binary(request):
+        replicas = [{"key":key,"value":value,"replica_number":replica_number} for (_,key,value,replica_number) in wire.decode_entries(request.get_data())[0]]
+    else:
+        replicas = json.loads(request.get_json())["replicas"]
+
+    return respond(*insert_replicas_items(replicas))
+
+def insert_replicas_items(replicas):
+    # Returns (data, status), passing the replicas down the chain
+    # Replicas for the next nodes of their chains, by (ip, port)
+    next_replicas = {}
+
+    for d in replicas:
+        # Hash computed by the primary, if the encoding carried it
+        key = d.get("hash")
+        if key == None:
+            key = hash_key(d["key"])
+        # Only edge case if kappa >= number on nodes
+        if not node.key == node.successor_of(key).key:
+            node.add_replica(d["key"], d["value"], d["replica_number"], key)
+            target = node.replica_next(key, d["replica_number"])
+            if target != None:
+                next_replicas.setdefault((target.ip, target.port), []).append(
+                    {"key":d["key"],"value":d["value"],"replica_number":d["replica_number"] + 1,"hash":key})
+
+    result = "{} replicas added successfully".format(len(replicas)), 200
+    for (target_ip, target_port), items in next_replicas.items():
+        result = send_replicas(target_ip, target_port, items)
+        if not result[1] == 200:
+            return result
+    return result
+
 @app.route('/fixReplicas',methods=['PUT'])
 def fix_replicas():
     global node
@@ -573,8 +1058,11 @@ def fix_replicas():
     initial_node = int(request.args.get("keynode"))
     hop = int(request.args.get("hop"))
 
-    json_data = request.get_json()
-    keys_of_initial_node = set(json.loads(json_data)["keys"])
+    if wire.is_binary(request):
+        keys = wire.decode_hashes(request.get_data())
+    else:
+        keys = json.loads(request.get_json())["keys"]
+    keys_of_initial_node = set(keys)
     
     # Only edge case if kappa >= number on nodes
     if not node.key == initial_node:
@@ -584,7 +1072,7 @@ def fix_replicas():
         for (k,(key, value, replica_number)) in node.replicas.items():
             if replica_number > hop or (replica_number == hop and not k in keys_of_initial_node):
                 if replica_number < node.kappa - 1:
-                    node.add_replica(key,value,replica_number + 1)
+                    node.replicas[k] = (key, value, replica_number + 1)
                 else:
                     deletion_replicas.add(k)
         
@@ -592,15 +1080,97 @@ def fix_replicas():
             del node.replicas[k]
 
         if hop < node.kappa - 1:
-            s = requests.Session()
-            s.mount('http://', HTTPAdapter(max_retries=0))
-            url = "http://{}:{}/fixReplicas".format(node.next_node.ip,node.next_node.port)
-            r = s.put(url,params={"keynode":initial_node,"hop": hop + 1},json=json_data)
+            r = wire.request("PUT", node.next_node.ip, node.next_node.port, "/fixReplicas",
+                             lambda: wire.encode_hashes(keys), lambda: {"keys":keys}, params={"keynode":initial_node,"hop": hop + 1})
             
             return r.text
 
     return "Replication number updated.", 200
 
+@app.route('/reconcileReplicas', methods=['PUT'])
+def reconcile_replicas():
+    # Bring our replicas in line with the chains of the current membership
+    global node
+
+    if node is None:
+        return "You have to join first.", 403
+
+    members = ring_membership()
+    if members == None:
+        return "Could not get the membership from the bootstrap node.", 503
+    placement = Placement(members, node.kappa)
+    previous = node.placement
+    node.placement = placement if shared_servers(members) else None
+    me = (node.ip, node.port)
+
+    # Keep (renumbered) the replicas we are still on the chain of, drop the rest
+    for (k, (key, value, replica_number)) in node.replicas.items():
+        chain = [(r.ip, r.port) for r in placement.chain(k)]
+        if chain[0] == me:
+            # The key is ours now
+            if not k in node.data:
+                node.data[k] = (key, value)
+            del node.replicas[k]
+        elif me in chain:
+            if not chain.index(me) == replica_number:
+                node.replicas[k] = (key, value, chain.index(me))
+        else:
+            del node.replicas[k]
+
+    # Send our keys to the replicas of their chains, unless our chain is the
+    # same as before & nobody handed us keys (or asked for them with push)
+    chain = [(r.ip, r.port) for r in placement.chain(node.key)]
+    if (previous == None or node.keys_received or request.args.get("push") != None
+            or not chain == [(r.ip, r.port) for r in previous.chain(node.key)]):
+        node.keys_received = False
+        push_replicas(placement, me)
+
+    return "Replicas reconciled.", 200
+
+def push_replicas(placement, me):
+    # Send the replicas of our keys to the nodes of their chains
+    batches = {}
+    for (k, (key, value)) in node.data.items():
+        chain = placement.chain(k)
+        if not (chain[0].ip, chain[0].port) == me:
+            continue
+        for replica_number, target in enumerate(chain[1:], 1):
+            batches.setdefault((target.ip, target.port), []).append({"key":key,"value":value,"replica_number":replica_number,"hash":k})
+    for (target_ip, target_port), replicas in batches.items():
+        for i in range(0, len(replicas), TRANSFER_CHUNK):
+            peers.put(target_ip, target_port, "/storeReplicas", json=json.dumps({"replicas":replicas[i:i + TRANSFER_CHUNK]}))
+
+@app.route('/storeReplicas', methods=['PUT'])
+def store_replicas():
+    # Replicas sent by a reconcile: stored as they are, not passed down the chain
+    global node
+
+    if node is None:
+        return "You have to join first.", 403
+
+    replicas = json.loads(request.get_json())["replicas"]
+    node.replicas.update((d["hash"], (d["key"], d["value"], d["replica_number"])) for d in replicas)
+    return "{} replicas stored.".format(len(replicas)), 200
+
+def reconcile_ring(push = False):
+    # Have every member (us included) reconcile its replicas, after a join or
+    # departure on a ring where servers run many virtual nodes. With push,
+    # every member sends the replicas of its keys again.
+    # Returns False if some member could not be reached.
+    members = ring_membership()
+    if members == None:
+        return False
+    params = {"push":1} if push else None
+
+    def reconcile(member):
+        try:
+            return peers.put(member[1], member[2], "/reconcileReplicas", params=params).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+        return all(list(executor.map(reconcile, members)))
+
 @app.route('/initfixReplicas')
 def init_fix_replicas():
     global node
@@ -609,12 +1179,10 @@ def init_fix_replicas():
 
         # Send a list of your primary keys
         # , that weren't send to new node
-        data = {"keys":list(node.data.keys())}
+        keys = list(node.data.keys())
 
-        s = requests.Session()
-        s.mount('http://', HTTPAdapter(max_retries=0))
-        url = "http://{}:{}/fixReplicas".format(node.next_node.ip,node.next_node.port)
-        s.put(url,params={"keynode":node.key,"hop": 1},json=json.dumps(data))
+        wire.request("PUT", node.next_node.ip, node.next_node.port, "/fixReplicas",
+                     lambda: wire.encode_hashes(keys), lambda: {"keys":keys}, params={"keynode":node.key,"hop": 1})
 
         return "Fix Replicas Operation ended.", 200
     else:
@@ -625,7 +1193,10 @@ def generate_replicas():
     global node
 
     # Read set of existing keys
-    existing = set(json.loads(request.get_json())["existing"])
+    if wire.is_binary(request):
+        existing = set(wire.decode_hashes(request.get_data()))
+    else:
+        existing = set(json.loads(request.get_json())["existing"])
     # Check primary keys
     data = {}
     for (k,(key,value)) in node.data.items():
@@ -635,6 +1206,13 @@ def generate_replicas():
     for (k,(key,value,replica_number)) in node.replicas.items():
         if replica_number < node.kappa - 1 and k not in existing:
             data[k] = (key,value,replica_number + 1)
+
+    if wire.accepts(request):
+        return app.response_class(
+            response=wire.encode_entries(((None,v[0],v[1],v[2]) for v in data.values()), with_hash=False),
+            status=200,
+            mimetype=wire.MIME
+        )
     
     data = {"keys":[{"key":v[0],"value":v[1],"replica_number":v[2]} for (k,v) in data.items()]}
     response = app.response_class(
@@ -647,9 +1225,13 @@ def generate_replicas():
 @app.route('/send',methods=['POST'])
 def send():
     global node        
-    new_keys = json.loads(request.get_json())["keys"]
-    for d in new_keys:
-        node.data[d["key_hash"]] = (d["key"],d["value"])
+    if wire.is_binary(request):
+        node.data.update((k,(key,value)) for (k,key,value,_) in wire.decode_entries(request.get_data())[0])
+    else:
+        new_keys = json.loads(request.get_json())["keys"]
+        node.data.update((d["key_hash"],(d["key"],d["value"])) for d in new_keys)
+    # Their replicas are sent on the next reconcile
+    node.keys_received = True
     return "Keys transfered!", 200
 
 @app.route('/transferKeys')
@@ -657,46 +1239,59 @@ def transfer_keys():
     global node        
     keynode = int(request.args.get("keynode"))
 
+    # The new node (keynode) is our previous node now,
+    # so it takes over the keys in (node.key, keynode]
     if node.kappa == 1:
         
-        data_list = [{"key_hash":k,"key":v[0],"value":v[1]} for (k,v) in node.data.items() if k <= keynode or k > node.key]
-        data = {"keys":data_list}
+        primary_keys = page_items(node.data, node.key, keynode)
+        replicas_keys = []
+
+    elif node.placement != None:
+
+        # Chains skip nodes of the same server, so replicas are not a matter of
+        # position: the new node repairs them once it has joined (see reconcile_ring)
+        primary_keys = node.data.pop_range(node.key, keynode)
+        replicas_keys = []
         
     elif node.consistency_type == "chain-replication" or node.consistency_type == "eventual-consistency":
         
-        primary_keys = {k:v for (k,v) in node.data.items() if k <= keynode or k > node.key}
-        replicas_keys = [{"key_hash":k,"key":v[0],"value":v[1],"replica_number":v[2]} for (k,v) in node.replicas.items()]
-
+        # Uneccessary keys are removed from primary keys
+        primary_keys = node.data.pop_range(node.key, keynode)
         # Increase replication number on 
         # your own replication dictionairy
-        deletion_replicas = set()
-        
-        for (k,(key,value,replica_number)) in node.replicas.items():
+        dropped = []
+
+        for (k,(key,value,replica_number)) in page_items(node.replicas, -1, -1):
             if replica_number < node.kappa - 1:
-                node.add_replica(key, value, replica_number + 1)
+                node.replicas[k] = (key, value, replica_number + 1)
             else:
-                deletion_replicas.add(k)
+                dropped.append((k,(key,value,replica_number)))
+                del node.replicas[k]
 
-        for k in deletion_replicas:
-            del node.replicas[k]
+        # The new node gets the replicas as they were before we renumbered them,
+        # read from the store while streaming (renumbered back) & the dropped ones
+        replicas_keys = itertools.chain(
+            ((k,(key,value,replica_number - 1)) for (k,(key,value,replica_number)) in page_items(node.replicas, -1, -1)
+             if replica_number > 1),
+            dropped)
 
         # Each primary key of node, that will be send
         # to new node, must be added as a replica
-        for (k,(key,value)) in primary_keys.items():
+        for (k,(key,value)) in primary_keys:
             node.add_replica(key,value,1)
 
-        # Uneccessary keys must be now deleted
-        for k in primary_keys.keys():
-            del node.data[k]
-        
-        # Format json output
-        primary_keys = [{"key_hash":k,"key":v[0],"value":v[1]} for (k,v) in primary_keys.items()]
-        data = {"keys":primary_keys,"replicas":replicas_keys}
+    if wire.accepts(request):
+        return app.response_class(
+            response=stream_frames(primary_keys, replicas_keys),
+            status=200,
+            mimetype=wire.MIME
+        )
 
+    # Stream keys as NDJSON instead of one big json document
     response = app.response_class(
-        response=json.dumps(data),
+        response=stream_keys(primary_keys, replicas_keys),
         status=200,
-        mimetype='application/json'
+        mimetype='application/x-ndjson'
     )
     return response
 
@@ -708,7 +1303,7 @@ def delete_keys():
 
     if not keynode == None:
         keynode = int(keynode)
-        node.data = {k:v for (k,v) in node.data.items() if not(k <= keynode or k > node.key)}
+        node.data.pop_range(node.key, keynode)
 
     return "Keys deleted.", 200
 
@@ -716,12 +1311,18 @@ def delete_keys():
 def delete():
     global node
     key_value = request.args.get("key")
-    key = hash_key(key_value)
 
     if node is None:
         return "You have to join first.", 403
-    
-    successor = node.successor(key_value)
+
+    return respond(*delete_key(key_value))
+
+def delete_key(key_value, key = None):
+    # Returns (data, status) for a single key, forwarding if needed
+    if key == None:
+        key = hash_key(key_value)
+    successor = node.successor_of(key)
+
     if successor.key == node.key:
         if key in node.data:
 
@@ -732,51 +1333,35 @@ def delete():
                 "node_ip": node.ip,
                 "node_port": node.port,
             }
-            delete_response = response = app.response_class(
-                response=json.dumps(data),
-                status=200,
-                mimetype='application/json'
-            )
         
             del node.data[key]
 
-            if node.kappa == 1:
-                return delete_response
+            # Node with the first replica, if any
+            target = node.replica_next(key, 0)
+
+            if target == None:
+                return data, 200
             else:
 
-                url = "http://{}:{}/deleteReplicas".format(node.next_node.ip,node.next_node.port)
                 params = {"key":key_value,"replica_number":1}
 
                 if node.consistency_type == "chain-replication":
                     
-                    s = requests.Session()
-                    s.mount('http://', HTTPAdapter(max_retries=0))
-                    r = s.delete(url,params=params)
+                    r = peers.delete(target.ip, target.port, "/deleteReplicas", params=params)
                     
                     if r.status_code == 200:
-                        return delete_response
+                        return data, 200
                     else:
                         return r.text, r.status_code
 
                 elif node.consistency_type == "eventual-consistency":
-                    async_delete(url,params,{})
-                    return delete_response
+                    async_delete(key_value,target.ip,target.port,"/deleteReplicas",params)
+                    return data, 200
         else:
             return "Key not found.",404
     else:
         # Send key to successor
-        s = requests.Session()
-        s.mount('http://', HTTPAdapter(max_retries=0))
-        url = "http://{}:{}/delete".format(successor.ip,successor.port)
-        r = s.delete(url,params={"key":key_value})
-        if r.status_code == 200:
-            return app.response_class(
-                response=json.dumps(r.json()),
-                status=200,
-                mimetype='application/json'
-            )
-        else:
-            return r.text, r.status_code
+        return forward_call("DELETE", successor, "/delete", {"key":key_value}, key)
 
 @app.route('/deleteReplicas',methods=['DELETE'])
 def delete_replicas():
@@ -786,23 +1371,54 @@ def delete_replicas():
     replica_number = int(request.args.get("replica_number"))
     
 
+    key = hash_key(key_value)
+
     # Edge case for kappa >= number of nodes
-    if not node.key == node.successor(key_value).key:
+    if not node.key == node.successor_of(key).key:
         
         # Delete replica key
-        del node.replicas[hash_key(key_value)]
+        if key in node.replicas:
+            del node.replicas[key]
 
-        if replica_number < node.kappa - 1:
+        target = node.replica_next(key, replica_number)
+        if target != None:
                 
-            s = requests.Session()
-            s.mount('http://', HTTPAdapter(max_retries=0))
-            url = "http://{}:{}/deleteReplicas".format(node.next_node.ip,node.next_node.port)
-            r = s.delete(url,params={"key":key_value,"replica_number":replica_number + 1})
+            r = peers.delete(target.ip, target.port, "/deleteReplicas", params={"key":key_value,"replica_number":replica_number + 1})
             
             return r.text, r.status_code
     
     return "Key '{}' & its replicas deleted.".format(key_value), 200
 
+@app.route('/batchInsert',methods=['POST'])
+def batch_insert():
+    global node
+
+    if node is None:
+        return "You have to join first.", 403
+
+    items = json.loads(request.get_json())["items"]
+    return batch_apply("/batchInsert", items, lambda d: insert_key(d["key"], d["value"]))
+
+@app.route('/batchQuery',methods=['POST'])
+def batch_query():
+    global node
+
+    if node is None:
+        return "You have to join first.", 403
+
+    items = json.loads(request.get_json())["items"]
+    return batch_apply("/batchQuery", items, lambda d: query_key(d["key"]))
+
+@app.route('/batchDelete',methods=['POST'])
+def batch_delete():
+    global node
+
+    if node is None:
+        return "You have to join first.", 403
+
+    items = json.loads(request.get_json())["items"]
+    return batch_apply("/batchDelete", items, lambda d: delete_key(d["key"]))
+
 @app.route('/overlay')
 def overlay():
     global node
@@ -811,15 +1427,24 @@ def overlay():
         return "You have to join first.", 403
     
     if node.is_bootstrap():
-        data = {"nodes":[{"node_key":key,"ip":ip_port[0],"port":ip_port[1]} for key,ip_port in node.nodes.items()]}
+        shares = node.shares()
+        _, members = node.membership()
+        data = {"nodes":[{"node_key":key,"ip":node_ip,"port":node_port,"server":server,"share":shares.get(key, 0.0)} for (key,node_ip,node_port,server) in members]}
+
+        # Key space share of every physical server, summed over its virtual nodes
+        servers = {}
+        for d in data["nodes"]:
+            servers.setdefault(d["server"], {"server":d["server"],"vnodes":0,"share":0.0})
+            servers[d["server"]]["vnodes"] += 1
+            servers[d["server"]]["share"] += d["share"]
+        data["servers"] = list(servers.values())
         return app.response_class(
             response=json.dumps(data),
             status=200,
             mimetype='application/json'
         )
     else:
-        url = "http://{}:{}/overlay".format(node.bnode.ip,node.bnode.port)
-        r = requests.get(url)
+        r = peers.get(node.bnode.ip, node.bnode.port, "/overlay")
         if r.status_code == 200:
             return app.response_class(
                 response=json.dumps(r.json()),
@@ -829,6 +1454,85 @@ def overlay():
         else:
             return r.text, r.status_code
 
+@app.route('/metrics')
+def metrics_text():
+    # Prometheus text format: this server, then the outbound calls of the process
+    return app.response_class(
+        response=registry.render() + metrics.outbound.render(),
+        status=200,
+        mimetype='text/plain; version=0.0.4'
+    )
+
+@app.route('/trace/<trace_id>')
+def trace(trace_id):
+    # The spans of a trace on every node of the ring, assembled into its path.
+    # With local=1 only the spans of this node, as a list.
+    if request.args.get("local") == "1":
+        return respond(tracer.find(trace_id), 200)
+
+    spans = tracer.find(trace_id)
+    members = ring_members() if node != None else []
+    missing = []
+    if members == None:
+        members = []
+        missing.append(node.bnode.ip + ":" + str(node.bnode.port))
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+        for (member, part) in zip(members, executor.map(lambda m: node_spans(m[0], m[1], trace_id), members)):
+            if part == None:
+                missing.append("{}:{}".format(*member))
+            else:
+                spans.extend(part)
+
+    if spans == []:
+        return "Trace {} not found.".format(trace_id), 404
+    data = tracing.assemble(trace_id, spans)
+    data["missing"] = missing
+    return respond(data, 200)
+
+def node_spans(node_ip, node_port, trace_id):
+    # Spans of a trace on a node, None on failure
+    try:
+        r = peers.get(node_ip, node_port, "/trace/" + trace_id, params={"local":"1"})
+    except requests.exceptions.RequestException:
+        return None
+    if not r.status_code == 200:
+        return None
+    return r.json()
+
+@app.route('/wire')
+def wire_version():
+    # Binary encoding version of the internal endpoints, 0 if only JSON is spoken
+    data = {"version":wire.VERSION if wire.ENABLED else 0, "mime":wire.MIME}
+    return app.response_class(
+        response=json.dumps(data),
+        status=200,
+        mimetype='application/json'
+    )
+
+@app.route('/rpc')
+def rpc_port():
+    # Port of our RPC transport, 0 if peers have to use HTTP
+    data = {"port":rpc_server.port if rpc_server != None else 0}
+    return app.response_class(
+        response=json.dumps(data),
+        status=200,
+        mimetype='application/json'
+    )
+
+@app.route('/replicationStats')
+def replication_stats():
+    return app.response_class(
+        response=json.dumps(replication.stats()),
+        status=200,
+        mimetype='application/json'
+    )
+
+def info_item(store, k, v):
+    # An item of /info
+    if store == "keys":
+        return {"key_hash":k,"key":v[0],"value":v[1]}
+    return {"key_hash":k,"key":v[0],"value":v[1],"replica_num":v[2]}
+
 @app.route('/info')
 def info():
     global node
@@ -836,15 +1540,20 @@ def info():
     if node is None:
         return "You have to join first.", 403
 
-    if node.previous_node == None:
-        p_hash, p_ip, p_port = "none", "none", "none"
+    paged = "limit" in request.args or request.args.get("format") == "ndjson"
+    if paged:
+        try:
+            store, after, limit = dump_args()
+        except ValueError as e:
+            return str(e), 400
 
     data = {
-        "keys": [{"key_hash":k,"key":v[0],"value":v[1]} for (k,v) in node.data.items()],
-        "replicas": [{"key_hash":k,"key":v[0],"value":v[1],"replica_num":v[2]} for (k,v) in node.replicas.items()],
         "previous": {},
         "next": {},
     }
+    if not paged:
+        data["keys"] = [{"key_hash":k,"key":v[0],"value":v[1]} for (k,v) in node.data.items()]
+        data["replicas"] = [{"key_hash":k,"key":v[0],"value":v[1],"replica_num":v[2]} for (k,v) in node.replicas.items()]
     if node.previous_node != None:
         data["previous"] = {
             "hash": node.previous_node.key,
@@ -859,6 +1568,18 @@ def info():
             "port": node.next_node.port,
         }
 
+    if paged:
+        # Neighbours on the first line (or in every page), then the keys
+        if request.args.get("format") == "ndjson":
+            tables = {"keys":node.data, "replicas":node.replicas}
+            lines = dump_lines(tables, {}, store, after, limit, info_item)
+            return app.response_class(
+                response=itertools.chain([json.dumps(data) + "\n"], lines),
+                status=200,
+                mimetype='application/x-ndjson'
+            )
+        return dump_response(data, store, after, limit, info_item)
+
     response = app.response_class(
         response=json.dumps(data),
         status=200,
@@ -866,6 +1587,53 @@ def info():
     )
     return response
 
+# Last served membership snapshot: (version, body)
+membership_body = (0, None)
+
+@app.route('/membership')
+def membership():
+    # Versioned snapshot of the ring, for clients & nodes that cache it.
+    # The ETag is the version: send it back in If-None-Match and the
+    # answer is an empty 304 for as long as the membership is unchanged.
+    global node, membership_body
+
+    if node is None:
+        return "You have to join first.", 403
+
+    if not node.is_bootstrap():
+        headers = {}
+        if "If-None-Match" in request.headers:
+            headers["If-None-Match"] = request.headers["If-None-Match"]
+        r = peers.get(node.bnode.ip, node.bnode.port, "/membership", headers=headers)
+        response = app.response_class(response=r.content, status=r.status_code, mimetype=r.headers.get("Content-Type", "application/json"))
+        if "ETag" in r.headers:
+            response.headers["ETag"] = r.headers["ETag"]
+        return response
+
+    version = node.version
+    if request.if_none_match.contains(str(version)):
+        response = app.response_class(status=304)
+        response.set_etag(str(version))
+        return response
+
+    cached_version, body = membership_body
+    if cached_version != version:
+        version, members = node.membership()
+        body = json.dumps({
+            "version":version,
+            "kappa":node.kappa,
+            "consistency":node.consistency_type,
+            "nodes":[{"node_key":key,"ip":node_ip,"port":node_port,"server":server} for (key,node_ip,node_port,server) in members],
+        })
+        membership_body = (version, body)
+    response = app.response_class(
+        response=body,
+        status=200,
+        mimetype='application/json'
+    )
+    response.set_etag(str(version))
+    return response
+
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
     # Notify bootstrap node
@@ -877,51 +1645,326 @@ def shutdown():
             if node.number_of_nodes == 1:
                 shutdown_server()
             else:
-                for n in node.nodes:
-                    url = "http://{}:{}/kickout".format(node.nodes[n][0],node.nodes[n][1])
-                    requests.delete(url)
+                _, members = node.membership()
+                for (_, node_ip, node_port, _) in members:
+                    peers.delete(node_ip, node_port, "/kickout")
                     shutdown_server()
         else:
-            url = "http://{}:{}/depart".format(node.ip,node.port)
-            r = requests.delete(url)
+            r = peers.delete(node.ip, node.port, "/depart")
             shutdown_server()
     return 'Server shutting down...'
 
-def async_get(url, params, data):
-    s = requests.Session()
-    s.mount('http://', HTTPAdapter(max_retries=0))
-    s.get(url,params=params,json = json.dumps(data))
+def respond(data, status):
+    # Build a response out of a (data, status) pair
+    if isinstance(data, str):
+        return data, status
+    return app.response_class(
+        response=json.dumps(data),
+        status=status,
+        mimetype='application/json'
+    )
+
+def respond_result(data):
+    # Result of /queryReplicas, binary if the caller understands it
+    if wire.accepts(request):
+        return app.response_class(
+            response=wire.encode_result(data),
+            status=200,
+            mimetype=wire.MIME
+        )
+    return respond(data, 200)
+
+def accept(peer):
+    # Headers asking peer for a binary response
+    return wire.ACCEPT if wire.binary(peer.ip, peer.port) else None
+
+def replica_request(peer, key_value, value, replica_number):
+    # Arguments of an /insertReplicas request to peer
+    if wire.binary(peer.ip, peer.port):
+        return {"data":wire.encode_entries([(None,key_value,value,replica_number)], with_hash=False), "headers":wire.HEADERS}
+    return {"params":{"key":key_value,"value":value,"replica_number":replica_number}}
+
+def from_response(r):
+    # (data, status) pair of a forwarded request
+    if r.status_code == 200 and wire.is_binary(r):
+        return wire.decode_result(r.content), 200
+    if r.status_code == 200:
+        return r.json(), 200
+    else:
+        return r.text, r.status_code
+
+def forward(method, successor, path, params = None, **kwargs):
+    # Forward a request to the next hop. If the hop was taken from a stale
+    # finger (node departed or unreachable), drop the finger and use next node.
+    if successor.key == node.next_node.key:
+        return peers.request(method, successor.ip, successor.port, path, params=params, **kwargs)
+
+    try:
+        r = peers.request(method, successor.ip, successor.port, path, params=params, **kwargs)
+        if not r.status_code == 403:
+            return r
+    except requests.exceptions.ConnectionError:
+        pass
+
+    node.remove_finger(successor.key)
+    return peers.request(method, node.next_node.ip, node.next_node.port, path, params=params, **kwargs)
+
+def call(method, peer, path, params = None, key = None):
+    # (data, status) of a routing/replication request to peer,
+    # over the RPC transport if the peer has one, otherwise HTTP.
+    # The key hash travels with RPC calls, so the peer need not hash again.
+    if getattr(timing, "on", False):
+        # Ask the next hop for its timings too
+        params = dict(params, stats=1)
+    client = rpc.client(peer.ip, peer.port)
+    if client != None:
+        return client.call(path, params if key == None else dict(params, hash=key))
+    return from_response(peers.request(method, peer.ip, peer.port, path, params=params, headers=accept(peer)))
+
+def forward_call(method, successor, path, params, key = None):
+    # forward() for the paths served over RPC, returns (data, status)
+    if successor.key == node.next_node.key:
+        return call(method, successor, path, params, key)
+
+    try:
+        data, status = call(method, successor, path, params, key)
+        if not status == 403:
+            return data, status
+    except requests.exceptions.ConnectionError:
+        pass
+
+    node.remove_finger(successor.key)
+    return call(method, node.next_node, path, params, key)
+
+# Set while this thread serves a request that asked for timings, see timed()
+timing = threading.local()
+
+def timed(path, params, function, *args):
+    # (data, status) of function(*args). If the request asked for timings
+    # (stats=1), data gets a "stats" entry with the hops taken and the
+    # milliseconds spent routing (/query forwards), down the replica chain
+    # (/queryReplicas) and on the lookup at the last node. Every node adds
+    # its own share: its time minus the time of the node it called.
+    if params.get("stats") == None:
+        return function(*args)
+    timing.on = True
+    start = time.perf_counter()
+    try:
+        data, status = function(*args)
+    finally:
+        timing.on = False
+    if not isinstance(data, dict):
+        return data, status
+
+    total = (time.perf_counter() - start) * 1000
+    below = data.get("stats")
+    if below == None:
+        stats = {"path":path, "hops":0, "routing_hops":0, "chain_hops":0,
+                 "routing_ms":0.0, "chain_ms":0.0, "local_ms":total, "total_ms":total}
+    else:
+        stats = dict(below, path=path, hops=below["hops"] + 1, total_ms=total)
+        if below["path"] == "/queryReplicas":
+            stats["chain_hops"] += 1
+            stats["chain_ms"] += total - below["total_ms"]
+        else:
+            stats["routing_hops"] += 1
+            stats["routing_ms"] += total - below["total_ms"]
+    return dict(data, stats=stats), status
+
+def joined(handler):
+    # RPC version of the "join first" check of the HTTP routes
+    def wrapper(params):
+        if node is None:
+            return "You have to join first.", 403
+        return handler(params)
+    return wrapper
+
+def traced(path, handler):
+    # RPC version of the span of the HTTP routes
+    def wrapper(params):
+        token = tracer.begin("{}:{}".format(ip, port), path, params)
+        status = 500
+        try:
+            data, status = handler(params)
+            return data, status
+        finally:
+            tracer.end(token, status)
+    return wrapper
+
+# Routing & replication paths served by the RPC transport
+rpc_handlers = {
+    "/insert": joined(lambda p: insert_key(p["key"], p["value"], p.get("hash"))),
+    "/query": joined(lambda p: timed("/query", p, query_key, p["key"], p.get("hash"))),
+    "/delete": joined(lambda p: delete_key(p["key"], p.get("hash"))),
+    "/insertReplicas": joined(lambda p: insert_replica(p["key"], p["value"], int(p["replica_number"]), p.get("hash"))),
+    "/insertReplicasBatch": joined(lambda p: insert_replicas_items(p["replicas"])),
+    "/queryReplicas": joined(lambda p: timed("/queryReplicas", p, query_replica, p["key"], p.get("hash"))),
+}
+
+def start_rpc():
+    global rpc_server
+    if rpc.ENABLED:
+        handlers = {path:traced(path, handler) for (path, handler) in rpc_handlers.items()}
+        rpc_server = rpc.RpcServer(ip, handlers).start()
+
+def batch_apply(path, items, operation):
+    # Group the items of a batch request by next hop. Local keys are handled
+    # here and one sub-batch is forwarded to every other node, in parallel.
+    # Results keep the order of items.
+    groups = {}
+    for index, item in enumerate(items):
+        successor = node.successor(item["key"])
+        if not successor.key in groups:
+            groups[successor.key] = (successor, [])
+        groups[successor.key][1].append(index)
+
+    def local(index):
+        data, status = operation(items[index])
+        return [(index, {"key":items[index]["key"], "status":status, "data":data})]
+
+    def remote(successor, indexes):
+        try:
+            r = forward("POST", successor, path, json=json.dumps({"items":[items[i] for i in indexes]}))
+            if r.status_code == 200:
+                return list(zip(indexes, r.json()["results"]))
+            error, status = r.text, r.status_code
+        except requests.exceptions.RequestException as e:
+            error, status = str(e), 500
+        return [(i, {"key":items[i]["key"], "status":status, "data":error}) for i in indexes]
+
+    results = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as executor:
+        futures = []
+        for (successor, indexes) in groups.values():
+            if successor.key == node.key:
+                futures.extend(executor.submit(local, i) for i in indexes)
+            else:
+                futures.append(executor.submit(remote, successor, indexes))
+        for f in futures:
+            for (index, result) in f.result():
+                results[index] = result
+
+    return app.response_class(
+        response=json.dumps({"results":results}),
+        status=200,
+        mimetype='application/json'
+    )
+
+def find_successor(node, key):
+    # Resolve the node responsible for key, jumping through fingers
+    successor = node.successor_of(key)
+    if successor.key == node.key or in_range(key, node.key, node.next_node.key):
+        return successor
+
+    r = forward("GET", successor, "/findSuccessor", {"id":key})
+    data = r.json()
+    return RefNode(data["ip"],int(data["port"]))
+
+def stabilize(node):
+    # Neighbours are updated explicitly on join/depart (changeNext/changePrevious),
+    # so only keep the first finger in line with the next node
+    if not node.finger[0] == node.next_node:
+        node.update_finger(0, node.next_node)
+
+def fix_fingers(node):
+    i = 0
+    while i < M:
+        successor = find_successor(node, finger_start(node.key, i))
+        if successor.key == node.key:
+            node.finger[i] = None
+            i += 1
+        else:
+            i = node.update_finger(i, successor)
+
+def maintain():
+    # One round of ring maintenance for the node of this server
+    global node
+    current = node
+    if current is None or current.next_node is None:
+        return
+    try:
+        stabilize(current)
+        fix_fingers(current)
+    except (requests.exceptions.RequestException, ValueError, AttributeError):
+        # Ring is changing under us, retry on next round
+        pass
+
+def fix_fingers_loop():
+    while True:
+        time.sleep(FIX_FINGERS_INTERVAL)
+        maintain()
+
+# Asynchronous calls are queued on the replication pipeline,
+# requests for the same key are delivered in order
+def async_get(key, ip, port, path, params, data=None):
+    replication.submit(key, "GET", ip, port, path, params, data)
 
-def async_put(url, params, data):
-    s = requests.Session()
-    s.mount('http://', HTTPAdapter(max_retries=0))
-    s.put(url,params=params,json = json.dumps(data))
+def async_put(key, ip, port, path, params, data=None):
+    replication.submit(key, "PUT", ip, port, path, params, data)
 
-def async_post(url, params, data):
-    s = requests.Session()
-    s.mount('http://', HTTPAdapter(max_retries=0))
-    s.post(url,params=params,json = json.dumps(data))
+def async_post(key, ip, port, path, params, data=None):
+    replication.submit(key, "POST", ip, port, path, params, data)
 
-def async_delete(url, params, data):
-    s = requests.Session()
-    s.mount('http://', HTTPAdapter(max_retries=0))
-    s.delete(url,params=params,json = json.dumps(data))        
+def async_delete(key, ip, port, path, params, data=None):
+    replication.submit(key, "DELETE", ip, port, path, params, data)
 
 if __name__ == "__main__":
 
-    if not len(sys.argv) == 4:
+    if not len(sys.argv) in (4, 5):
         print("Please provide available port number, replication factor & consistency type")
+        print("Optionally, choose the server mode: flask (default) or asyncio")
         exit()
 
-    ip = socket.gethostbyname(socket.gethostname())
+    # CHORDIFY_HOST picks the address to bind to & announce, the host's by default
+    ip = os.environ.get("CHORDIFY_HOST") or socket.gethostbyname(socket.gethostname())
     port = int(sys.argv[1])
     kappa = int(sys.argv[2])
     consistency = sys.argv[3]
+    mode = sys.argv[4] if len(sys.argv) == 5 else "flask"
+    # Identifiers this server claims on the ring, served on consecutive ports
+    virtual = int(os.environ.get("CHORDIFY_VNODES", 1))
     node = None
 
+    if mode == "asyncio" and virtual > 1:
+        print("Virtual nodes (CHORDIFY_VNODES) need the flask server mode")
+        exit()
+    elif mode == "asyncio":
+        import async_server
+        try:
+            async_server.run(ip, port, kappa, consistency)
+        except socket.error:
+            print("Port {} is not available".format(sys.argv[1]))
+        exit()
+    elif not mode == "flask":
+        print("Not supported server mode! Choose EITHER flask OR asyncio")
+        exit()
+
+    # HTTP/1.1 keeps connections of the peers' pools alive between requests
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+
+    if virtual > 1:
+        # Every virtual node is a member of its own, the first one joins & departs the others
+        import multinode
+        hosted = multinode.MultiNode(ip, kappa, consistency)
+        try:
+            hosted.add_server(port, virtual)
+        except socket.error:
+            print("Ports {}-{} are not available".format(port, port + virtual - 1))
+            hosted.stop()
+            exit()
+        hosted.start_maintenance()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            hosted.stop()
+        exit()
+
+    threading.Thread(target=fix_fingers_loop, daemon=True).start()
+    start_rpc()
+
     try:
         app.run(host=ip, port=port, threaded=True)
     except socket.error:
         print("Port {} is not available".format(sys.argv[1]))
         exit()
-
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+
+import os
+import json
+import mmap
+import struct
+import threading
+import time
+import zlib
+
+from store import KeyStore
+
+# Durable storage settings, can be overridden through environment variables.
+# Storage is disabled (keys only live in memory) unless a data directory is set.
+DATA_DIR = os.environ.get("CHORDIFY_DATA_DIR")
+# group: a write returns once it is fsynced, concurrent writes share one fsync
+# interval: fsync every WAL_SYNC_INTERVAL in the background
+# none: never fsync, the OS decides (a crash of the process loses nothing)
+WAL_SYNC = os.environ.get("CHORDIFY_WAL_SYNC", "group")
+WAL_SYNC_INTERVAL = float(os.environ.get("CHORDIFY_WAL_SYNC_MS", 10)) / 1000
+WAL_SEGMENT_SIZE = int(os.environ.get("CHORDIFY_WAL_SEGMENT_MB", 64)) * 1024 * 1024
+# A snapshot is taken every SNAPSHOT_INTERVAL seconds (0 disables them),
+# if at least SNAPSHOT_MIN_RECORDS were logged since the previous one
+SNAPSHOT_INTERVAL = float(os.environ.get("CHORDIFY_SNAPSHOT_INTERVAL", 60))
+SNAPSHOT_MIN_RECORDS = int(os.environ.get("CHORDIFY_SNAPSHOT_MIN_RECORDS", 10000))
+
+# Every record is framed as: payload length, crc32 of payload, payload (JSON)
+HEADER = struct.Struct("<II")
+
+# Snapshot file: magic, entries, then footer with number of entries, offset in
+# its log segment where the snapshot was taken & crc32 of everything before it.
+# Entry: store, key hash, key length, value length, replica number (-1 for
+# primary keys), key, value
+SNAPSHOT_MAGIC = b"CHSNAP1\n"
+SNAPSHOT_ENTRY = struct.Struct("<B20sIIi")
+SNAPSHOT_FOOTER = struct.Struct("<QQI")
+STORES = ("data", "replicas")
+
+class RecoveryError(Exception):
+    # The stores cannot be recovered without losing updates
+    pass
+
+def open_storage(ip, port):
+    if DATA_DIR == None:
+        return None
+    return Storage(os.path.join(DATA_DIR, "{}-{}".format(ip, port)))
+
+def encode(record):
+    payload = json.dumps(record, separators=(',', ':')).encode()
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+def write_snapshot(path, tables, offset = 0):
+    # Write to a temporary file & rename, so a snapshot is either complete or missing
+    tmp = path + ".tmp"
+    count = 0
+    crc = zlib.crc32(SNAPSHOT_MAGIC)
+    with open(tmp, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        for store, table in enumerate(tables):
+            chunk = []
+            for key_hash, value in table.items():
+                key, val = value[0].encode(), value[1].encode()
+                replica_number = value[2] if len(value) == 3 else -1
+                chunk.append(SNAPSHOT_ENTRY.pack(store, key_hash.to_bytes(20, "big"), len(key), len(val), replica_number) + key + val)
+                count += 1
+                if len(chunk) == 4096:
+                    buf = b"".join(chunk)
+                    crc = zlib.crc32(buf, crc)
+                    f.write(buf)
+                    chunk = []
+            buf = b"".join(chunk)
+            crc = zlib.crc32(buf, crc)
+            f.write(buf)
+        f.write(SNAPSHOT_FOOTER.pack(count, offset, crc))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fd = os.open(os.path.dirname(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def snapshot_footer(mm, size):
+    # (number of entries, log offset) of a mapped snapshot, None if it is not valid
+    if size < len(SNAPSHOT_MAGIC) + SNAPSHOT_FOOTER.size:
+        return None
+    end = size - SNAPSHOT_FOOTER.size
+    count, log_offset, crc = SNAPSHOT_FOOTER.unpack_from(mm, end)
+    with memoryview(mm) as view:
+        valid = mm[:len(SNAPSHOT_MAGIC)] == SNAPSHOT_MAGIC and zlib.crc32(view[:end]) == crc
+    return (count, log_offset) if valid else None
+
+def verify_snapshot(path):
+    # True if the snapshot reads back intact
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return snapshot_footer(mm, size) != None
+
+def read_snapshot(path, stores):
+    # Loads a snapshot through a memory map, returns the offset of the log
+    # where it was taken, or None if it is not valid
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            footer = snapshot_footer(mm, size)
+            if footer == None:
+                return None
+            count, log_offset = footer
+
+            items = ([], [])
+            offset = len(SNAPSHOT_MAGIC)
+            for _ in range(count):
+                store, key_hash, key_length, value_length, replica_number = SNAPSHOT_ENTRY.unpack_from(mm, offset)
+                offset += SNAPSHOT_ENTRY.size
+                key = mm[offset:offset + key_length].decode()
+                offset += key_length
+                value = mm[offset:offset + value_length].decode()
+                offset += value_length
+                if replica_number < 0:
+                    items[store].append((int.from_bytes(key_hash, "big"), (key, value)))
+                else:
+                    items[store].append((int.from_bytes(key_hash, "big"), (key, value, replica_number)))
+
+    for name, store_items in zip(STORES, items):
+        stores[name].update(store_items)
+    return log_offset
+
+def read_segment(path, offset = 0):
+    # Returns the valid records of a segment from offset on and the offset
+    # where they end, a torn or corrupted tail (crash in the middle of a
+    # write) is ignored
+    records = []
+    with open(path, "rb") as f:
+        content = f.read()
+    while offset + HEADER.size <= len(content):
+        length, crc = HEADER.unpack_from(content, offset)
+        payload = content[offset + HEADER.size:offset + HEADER.size + length]
+        if len(payload) < length or not zlib.crc32(payload) == crc:
+            break
+        records.append(json.loads(payload))
+        offset += HEADER.size + length
+    return records, offset
+
+class WriteAheadLog():
+    """
+        Append-only log of store updates, split in numbered segment files.
+        Records are written (and flushed to the OS) in the order they are
+        appended. How they are fsynced depends on the sync mode.
+    """
+
+    def __init__(self, directory, sync = WAL_SYNC, interval = WAL_SYNC_INTERVAL, segment_size = WAL_SEGMENT_SIZE):
+        if not sync in ("group", "interval", "none"):
+            raise ValueError("Not supported sync mode {}".format(sync))
+        self.directory = directory
+        self.sync = sync
+        self.interval = interval
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.synced = threading.Condition()
+        self.syncing = False
+        self.written_seq = 0
+        self.synced_seq = 0
+        self.file = None
+        self.closed = False
+
+    def segments(self):
+        names = [n for n in os.listdir(self.directory) if n.startswith("wal-") and n.endswith(".log")]
+        return [os.path.join(self.directory, n) for n in sorted(names)]
+
+    def segment_number(self, path):
+        return int(os.path.basename(path)[4:-4])
+
+    def replay(self, start = 0, offset = 0):
+        # Yields every record from offset of segment start on, must be called before open()
+        for path in self.segments():
+            if self.segment_number(path) < start:
+                continue
+            records, end = read_segment(path, offset if self.segment_number(path) == start else 0)
+            if end < os.path.getsize(path):
+                # Drop the torn tail, so records appended later are readable
+                with open(path, "r+b") as f:
+                    f.truncate(end)
+            yield from records
+
+    def open(self, start = 1):
+        segments = self.segments()
+        number = max(self.segment_number(segments[-1]) + 1 if segments else 1, start)
+        self.file = open(os.path.join(self.directory, "wal-{:08d}.log".format(number)), "ab")
+        if self.sync == "interval":
+            threading.Thread(target=self.sync_loop, daemon=True).start()
+
+    def rotate(self):
+        # Called with self.lock held
+        self.file.flush()
+        if not self.sync == "none":
+            os.fsync(self.file.fileno())
+        self.file.close()
+        number = self.segment_number(self.file.name) + 1
+        self.file = open(os.path.join(self.directory, "wal-{:08d}.log".format(number)), "ab")
+
+    def position(self):
+        # Segment number & offset the next record is written at
+        with self.lock:
+            return self.segment_number(self.file.name), self.file.tell()
+
+    def checkpoint(self):
+        # Start a new segment and return its number
+        with self.lock:
+            self.rotate()
+            return self.segment_number(self.file.name)
+
+    def truncate(self, number):
+        # Remove the segments before segment number
+        for path in self.segments():
+            if self.segment_number(path) < number:
+                os.remove(path)
+
+    def append(self, record):
+        frame = encode(record)
+        with self.lock:
+            self.file.write(frame)
+            self.file.flush()
+            self.written_seq += 1
+            if self.file.tell() >= self.segment_size:
+                self.rotate()
+            return self.written_seq
+
+    def commit(self, seq):
+        # Returns once record seq is durable according to the sync mode
+        if not self.sync == "group":
+            return
+        with self.synced:
+            while self.synced_seq < seq:
+                if not self.syncing:
+                    # Nobody is syncing: this writer syncs for everyone waiting
+                    self.syncing = True
+                    break
+                self.synced.wait()
+            else:
+                return
+        target = self.synced_seq
+        try:
+            target = self.fsync()
+        finally:
+            with self.synced:
+                self.syncing = False
+                self.synced_seq = max(self.synced_seq, target)
+                self.synced.notify_all()
+
+    def fsync(self):
+        with self.lock:
+            target = self.written_seq
+            fd = self.file.fileno()
+        try:
+            os.fsync(fd)
+        except (OSError, ValueError):
+            # The segment was rotated (and synced) meanwhile
+            pass
+        return target
+
+    def sync_loop(self):
+        while not self.closed:
+            time.sleep(self.interval)
+            if not self.closed:
+                self.fsync()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if self.file != None:
+                self.file.close()
+
+class Journal():
+    # Logs the updates of one named store
+    def __init__(self, log, name):
+        self.log = log
+        self.name = name
+
+    def append(self, op, *args):
+        return self.log.append([op, self.name, *args])
+
+    def commit(self, seq):
+        self.log.commit(seq)
+
+def apply(stores, record):
+    op, store = record[0], stores[record[1]]
+    if op == "set":
+        store[record[2]] = tuple(record[3])
+    elif op == "del":
+        if record[2] in store:
+            del store[record[2]]
+    elif op == "pop":
+        store.pop_range(record[2], record[3])
+    elif op == "clear":
+        store.clear()
+
+class Storage():
+    """
+        Durable data & replicas stores of a node. Every update is appended
+        to a write-ahead log in directory. Snapshots of the stores are taken
+        in the background and replace the log before them, so start up loads
+        the latest snapshot and replays only the log after it.
+    """
+
+    def __init__(self, directory, sync = WAL_SYNC, snapshot_interval = SNAPSHOT_INTERVAL, snapshot_min_records = SNAPSHOT_MIN_RECORDS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.log = WriteAheadLog(directory, sync)
+        self.data = KeyStore()
+        self.replicas = KeyStore()
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_min_records = snapshot_min_records
+        self.snapshot_lock = threading.Lock()
+
+        start = time.time()
+        stores = {"data":self.data, "replicas":self.replicas}
+        # Log position the latest valid snapshot was taken at, replay starts there
+        self.snapshot_segment = 0
+        offset = 0
+        for path in reversed(self.snapshots()):
+            offset = read_snapshot(path, stores)
+            if offset != None:
+                self.snapshot_segment = self.snapshot_number(path)
+                break
+            offset = 0
+        # The log before the snapshot was compacted away, so without the
+        # snapshot the updates in there are lost: better not start at all
+        segments = self.log.segments()
+        if segments and self.log.segment_number(segments[0]) > max(self.snapshot_segment, 1):
+            raise RecoveryError("No valid snapshot in {} for the log starting at segment {}, refusing to recover "
+                                "without it".format(directory, self.log.segment_number(segments[0])))
+        self.replayed = 0
+        for record in self.log.replay(self.snapshot_segment, offset):
+            apply(stores, record)
+            self.replayed += 1
+        self.recovery_time = time.time() - start
+
+        self.log.open(self.snapshot_segment)
+        # Records logged since the latest snapshot
+        self.snapshot_seq = -self.replayed
+        self.data.journal = Journal(self.log, "data")
+        self.replicas.journal = Journal(self.log, "replicas")
+
+        if self.snapshot_interval > 0:
+            threading.Thread(target=self.snapshot_loop, daemon=True).start()
+
+    def snapshots(self):
+        names = [n for n in os.listdir(self.directory) if n.startswith("snapshot-") and n.endswith(".snap")]
+        return [os.path.join(self.directory, n) for n in sorted(names)]
+
+    def snapshot_number(self, path):
+        return int(os.path.basename(path)[9:-5])
+
+    def snapshot(self):
+        # Copy both stores & note the log position, request threads only
+        # wait for that. Rotating the log, writing the file & compacting the
+        # log happen afterwards.
+        with self.snapshot_lock:
+            if self.log.closed:
+                return None
+            with self.data.lock, self.replicas.lock:
+                number, offset = self.log.position()
+                seq = self.log.written_seq
+                tables = (dict(self.data.table), dict(self.replicas.table))
+
+            # Later records go to a new segment, so the next snapshot can remove this one
+            self.log.checkpoint()
+            path = os.path.join(self.directory, "snapshot-{:08d}.snap".format(number))
+            write_snapshot(path, tables, offset)
+            if not verify_snapshot(path):
+                # Keep the previous snapshot & the log after it
+                os.remove(path)
+                return None
+            self.snapshot_segment = number
+            self.snapshot_seq = seq
+
+            # The snapshot covers everything before its position
+            self.log.truncate(number)
+            for old in self.snapshots():
+                if self.snapshot_number(old) < number:
+                    os.remove(old)
+            return path
+
+    def snapshot_loop(self):
+        while not self.log.closed:
+            time.sleep(self.snapshot_interval)
+            if not self.log.closed and self.log.written_seq - self.snapshot_seq >= self.snapshot_min_records:
+                self.snapshot()
+
+    def recovered(self):
+        return len(self.data) + len(self.replicas) > 0
+
+    def close(self):
+        self.data.journal = None
+        self.replicas.journal = None
+        self.log.close()
+
+    def reset(self):
+        # Forget everything, e.g. when the keys were handed over on depart
+        self.close()
+        with self.snapshot_lock:
+            for path in self.log.segments() + self.snapshots():
+                os.remove(path)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import bisect
+import threading
+
+class KeyStore():
+    """
+        Dictionary of key_hash -> value that also keeps the hashes sorted,
+        so the keys of a ring interval (start, end] can be found in
+        O(log n + r) instead of scanning every key.
+        Updates are written to journal (see storage.py), if there is one.
+    """
+
+    def __init__(self, items = (), journal = None):
+        self.table = dict(items)
+        self.hashes = sorted(self.table)
+        self.lock = threading.Lock()
+        self.journal = journal
+
+    def log(self, *record):
+        # Called with self.lock held, so the journal keeps the order of the updates
+        if self.journal == None:
+            return None
+        return self.journal.append(*record)
+
+    def commit(self, seq):
+        if seq != None and self.journal != None:
+            self.journal.commit(seq)
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, key_hash):
+        return key_hash in self.table
+
+    def __getitem__(self, key_hash):
+        return self.table[key_hash]
+
+    def __setitem__(self, key_hash, value):
+        with self.lock:
+            seq = self.log("set", key_hash, value)
+            if not key_hash in self.table:
+                bisect.insort(self.hashes, key_hash)
+            self.table[key_hash] = value
+        self.commit(seq)
+
+    def __delitem__(self, key_hash):
+        with self.lock:
+            if not key_hash in self.table:
+                raise KeyError(key_hash)
+            seq = self.log("del", key_hash)
+            del self.table[key_hash]
+            del self.hashes[bisect.bisect_left(self.hashes, key_hash)]
+        self.commit(seq)
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def get(self, key_hash, default = None):
+        return self.table.get(key_hash, default)
+
+    def keys(self):
+        return self.table.keys()
+
+    def values(self):
+        return self.table.values()
+
+    def items(self):
+        # A copy, as writers may change the table while the caller iterates
+        with self.lock:
+            return list(self.table.items())
+
+    def slices(self, start, end):
+        # Index ranges of self.hashes that fall in the ring interval (start, end]
+        lo = bisect.bisect_right(self.hashes, start)
+        hi = bisect.bisect_right(self.hashes, end)
+        if start < end:
+            return [(lo, hi)]
+        else:
+            # Interval wraps around zero
+            return [(lo, len(self.hashes)), (0, hi)]
+
+    def range_keys(self, start, end):
+        with self.lock:
+            return [k for (lo, hi) in self.slices(start, end) for k in self.hashes[lo:hi]]
+
+    def range_items(self, start, end):
+        with self.lock:
+            return [(k, self.table[k]) for (lo, hi) in self.slices(start, end) for k in self.hashes[lo:hi]]
+
+    def page(self, after, limit):
+        # Up to limit items with hashes above after, in hash order
+        with self.lock:
+            lo = bisect.bisect_right(self.hashes, after)
+            return [(k, self.table[k]) for k in self.hashes[lo:lo + limit]]
+
+    def update(self, items):
+        seq = None
+        with self.lock:
+            new_hashes = []
+            for key_hash, value in items:
+                seq = self.log("set", key_hash, value)
+                if not key_hash in self.table:
+                    new_hashes.append(key_hash)
+                self.table[key_hash] = value
+            self.merge(new_hashes)
+        # One commit covers every update of the batch
+        self.commit(seq)
+
+    def merge(self, new_hashes):
+        # Called with self.lock held. Streamed chunks arrive in hash order,
+        # so instead of sorting self.hashes again each run of new hashes is
+        # spliced in where it belongs: one splice per chunk of a key range
+        new_hashes.sort()
+        runs = []
+        lo = 0
+        for key_hash in new_hashes:
+            lo = bisect.bisect_left(self.hashes, key_hash, lo)
+            if runs and runs[-1][0] == lo:
+                runs[-1][1].append(key_hash)
+            else:
+                runs.append((lo, [key_hash]))
+        # Last run first, so the positions of the other ones stay valid
+        for (at, run) in reversed(runs):
+            self.hashes[at:at] = run
+
+    def clear(self):
+        with self.lock:
+            seq = self.log("clear")
+            self.table.clear()
+            self.hashes.clear()
+        self.commit(seq)
+
+    def pop_range(self, start, end):
+        # Remove and return the items of the ring interval (start, end]
+        with self.lock:
+            seq = self.log("pop", start, end)
+            popped = []
+            # Higher slice first, so the indexes of the other one stay valid
+            for (lo, hi) in sorted(self.slices(start, end), reverse=True):
+                for k in self.hashes[lo:hi]:
+                    popped.append((k, self.table.pop(k)))
+                del self.hashes[lo:hi]
+        self.commit(seq)
+        return popped
@@ -0,0 +1,70 @@
+import json
+
+import server
+from node import Node
+from store import KeyStore
+
+def tables(keys, replicas):
+    return {"keys": KeyStore((k, ("key{}".format(k), "v")) for k in keys),
+            "replicas": KeyStore((k, ("key{}".format(k), "v", 1)) for k in replicas)}
+
+def walk(tables, limit):
+    # Every page of a dump, following the cursors
+    pages = []
+    cursor = {"store": "keys", "after": -1}
+    while cursor != None:
+        items, cursor = server.dump_page(tables, cursor["store"], cursor["after"], limit, server.dump_item)
+        pages.append(items)
+    return pages
+
+def test_page_after_a_hash():
+    s = KeyStore((k, ("a", "b")) for k in [30, 10, 20])
+    assert [k for (k, _) in s.page(-1, 2)] == [10, 20]
+    assert [k for (k, _) in s.page(10, 5)] == [20, 30]
+    assert s.page(30, 5) == []
+
+def test_pages_list_keys_then_replicas():
+    pages = walk(tables([3, 1, 2], [5, 4]), 2)
+    listed = [(("replica" if "replica_number" in d else "key"), d["hash"]) for items in pages for d in items]
+    assert listed == [("key", 1), ("key", 2), ("key", 3), ("replica", 4), ("replica", 5)]
+    assert all(len(items) <= 2 for items in pages)
+
+def test_page_limit_on_a_boundary():
+    # A full last page of keys points straight at the replicas, no empty page
+    items, cursor = server.dump_page(tables([1, 2], [3]), "keys", -1, 2, server.dump_item)
+    assert [d["hash"] for d in items] == [1, 2]
+    assert cursor == {"store": "replicas", "after": -1}
+    items, cursor = server.dump_page(tables([1, 2, 3], []), "keys", -1, 2, server.dump_item)
+    assert cursor == {"store": "keys", "after": 2}
+
+def test_empty_stores():
+    assert walk(tables([], []), 10) == [[], []]
+
+def test_ndjson_lines_cover_everything():
+    lines = [json.loads(line) for line in server.dump_lines(tables([1, 2, 3], [4]), {"node": "n"}, "keys", -1, 2, server.dump_item)]
+    assert [(line["store"], [d["hash"] for d in line["items"]]) for line in lines] == [
+        ("keys", [1, 2]), ("keys", [3]), ("replicas", [4])]
+    assert all(line["node"] == "n" for line in lines)
+
+def test_query_pages_over_http():
+    # Set by the command line (or multinode) otherwise
+    server.ip, server.port = "127.0.0.1", 5000
+    server.node = Node(server.ip, server.port, (server.ip, server.port))
+    try:
+        for k in range(5):
+            server.node.data[k] = ("key{}".format(k), "v")
+        server.node.replicas[10] = ("key10", "v", 1)
+        client = server.app.test_client()
+        listed = []
+        params = {"key": "*", "limit": 2}
+        while True:
+            page = client.get("/query", query_string=params).get_json()
+            listed += [d["hash"] for d in page["items"]]
+            if page["cursor"] == None:
+                break
+            params.update(page["cursor"])
+        assert listed == [0, 1, 2, 3, 4, 10]
+        assert client.get("/query", query_string={"key": "*", "limit": 0}).status_code == 400
+        assert client.get("/query", query_string={"key": "*", "store": "other", "limit": 2}).status_code == 400
+    finally:
+        server.node = None
@@ -0,0 +1,64 @@
+import threading
+
+import metrics
+
+def record(registry, n, barrier = None):
+    for _ in range(n):
+        registry.add("requests_total", (("path", "/query"),))
+    # Exact in binary, so the sums compare exactly
+    for seconds in (0.0625, 0.25, 0.5, 2.0):
+        registry.observe("duration_seconds", (("path", "/query"),), seconds)
+    if barrier != None:
+        # Every thread has its shard before any of them exits
+        barrier.wait()
+
+def test_shards_of_finished_threads_are_folded():
+    registry = metrics.Registry(buckets=[0.1, 0.5, 1.0])
+    registry.describe("requests_total", "counter", "Requests")
+    registry.describe("duration_seconds", "histogram", "Latency")
+    barrier = threading.Barrier(8)
+    threads = [threading.Thread(target=record, args=(registry, 100, barrier)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(registry.shards) == 8
+
+    # A new shard folds the ones of the threads that are gone
+    registry.add("requests_total", (("path", "/insert"),), 5)
+    assert len(registry.shards) == 1
+    assert registry.shards[0].thread is threading.current_thread()
+    assert registry.retired.counters == {("requests_total", (("path", "/query"),)): 800}
+    assert registry.retired.histograms == {("duration_seconds", (("path", "/query"),)): [8, 16, 0, 8, 22.5]}
+
+    assert registry.render().splitlines() == [
+        '# HELP duration_seconds Latency',
+        '# TYPE duration_seconds histogram',
+        'duration_seconds_bucket{path="/query",le="0.1"} 8',
+        'duration_seconds_bucket{path="/query",le="0.5"} 24',
+        'duration_seconds_bucket{path="/query",le="1.0"} 24',
+        'duration_seconds_bucket{path="/query",le="+Inf"} 32',
+        'duration_seconds_sum{path="/query"} 22.5',
+        'duration_seconds_count{path="/query"} 32',
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{path="/insert"} 5',
+        'requests_total{path="/query"} 800',
+    ]
+
+def test_collect_adds_live_and_retired_shards():
+    registry = metrics.Registry(buckets=[0.1, 0.5, 1.0])
+    t = threading.Thread(target=record, args=(registry, 3))
+    t.start()
+    t.join()
+    record(registry, 2)
+    counters, histograms = registry.collect()
+    assert counters == {("requests_total", (("path", "/query"),)): 5}
+    assert histograms == {("duration_seconds", (("path", "/query"),)): [2, 4, 0, 2, 5.625]}
+    # Collecting again does not count the retired shard twice
+    assert registry.collect()[0] == counters
+
+def test_path_label_hides_ids():
+    assert metrics.path_label("/query") == "/query"
+    assert metrics.path_label("/trace/12ab") == "/trace/<trace_id>"
+    assert metrics.path_label("/other/12ab") == "/other/<id>"
@@ -0,0 +1,101 @@
+import requests
+
+import server
+from node import M, RING_SIZE, Node, RefNode, finger_start, in_range
+
+def ref(port, key):
+    # RefNode with a chosen key instead of the hash of its address
+    r = RefNode("127.0.0.1", port)
+    r.key = key
+    return r
+
+def ring_node(key, next_key, fingers):
+    # Node with key, its next node and fingers (port -> key) taking the
+    # highest indexes, in the order they follow key around the ring
+    n = Node("127.0.0.1", 5000, ("127.0.0.1", 5000))
+    n.key = key
+    n.previous_node = ref(4999, key - 1)
+    n.next_node = ref(5001, next_key)
+    n.finger[0] = n.next_node
+    for i, (port, finger_key) in enumerate(sorted(fingers.items(), key=lambda f: (f[1] - key) % RING_SIZE)):
+        n.finger[M - len(fingers) + i] = ref(port, finger_key)
+    return n
+
+def test_in_range_is_open_at_start_closed_at_end():
+    assert in_range(20, 10, 20)
+    assert not in_range(10, 10, 20)
+    assert in_range(15, 10, 20)
+    assert not in_range(25, 10, 20)
+
+def test_in_range_wraps_around_zero():
+    assert in_range(RING_SIZE - 1, RING_SIZE - 10, 5)
+    assert in_range(0, RING_SIZE - 10, 5)
+    assert in_range(5, RING_SIZE - 10, 5)
+    assert not in_range(6, RING_SIZE - 10, 5)
+    assert not in_range(RING_SIZE - 10, RING_SIZE - 10, 5)
+
+def test_in_range_of_whole_ring():
+    # start == end is the whole ring, as for a node alone in chord
+    assert in_range(7, 7, 7)
+    assert in_range(0, 7, 7)
+    assert in_range(RING_SIZE - 1, 7, 7)
+
+def test_finger_start():
+    assert finger_start(100, 0) == 101
+    assert finger_start(100, 3) == 108
+    assert finger_start(100, M - 1) == 100 + RING_SIZE // 2
+    # Wraps around zero
+    assert finger_start(RING_SIZE - 1, 0) == 0
+    assert finger_start(RING_SIZE - 4, 4) == 12
+
+def test_closest_preceding_finger_is_the_farthest():
+    n = ring_node(100, 110, {5002: 150, 5003: 300, 5004: 900})
+    assert n.closest_preceding_finger(500).port == 5003
+    assert n.closest_preceding_finger(1000).port == 5004
+    # Nothing between us and key: the next node
+    assert n.closest_preceding_finger(105).port == 5001
+
+def test_closest_preceding_finger_skips_departed_fingers():
+    n = ring_node(100, 110, {5002: 150, 5003: 300, 5004: 900})
+    n.remove_finger(300)
+    assert n.closest_preceding_finger(500).port == 5002
+    n.remove_finger(150)
+    assert n.closest_preceding_finger(500).port == 5001
+
+def test_closest_preceding_finger_wraps_around_zero():
+    n = ring_node(RING_SIZE - 100, RING_SIZE - 90, {5002: RING_SIZE - 20, 5003: 5, 5004: 50})
+    assert n.closest_preceding_finger(40).port == 5003
+    assert n.closest_preceding_finger(RING_SIZE - 10).port == 5002
+
+def test_successor_of_uses_fingers():
+    n = ring_node(100, 110, {5002: 150, 5003: 300, 5004: 900})
+    assert n.successor_of(100) is n.ref
+    assert n.successor_of(105).port == 5001
+    assert n.successor_of(500).port == 5003
+
+class Peers():
+    # Stands in for the pool: node 5003 is gone, the others answer with their port
+    def __init__(self):
+        self.calls = []
+
+    def request(self, method, ip, port, path, params = None, **kwargs):
+        self.calls.append(port)
+        if port == 5003:
+            raise requests.exceptions.ConnectionError()
+        r = requests.Response()
+        r.status_code = 200
+        r._content = str(port).encode()
+        return r
+
+def test_forward_falls_back_past_a_departed_finger(monkeypatch):
+    n = ring_node(100, 110, {5002: 150, 5003: 300, 5004: 900})
+    peers = Peers()
+    monkeypatch.setattr(server, "node", n, raising=False)
+    monkeypatch.setattr(server, "peers", peers)
+
+    r = server.forward("GET", n.successor_of(500), "/query", params={"key":"k"})
+    assert r.text == "5001"
+    assert peers.calls == [5003, 5001]
+    # The departed finger is forgotten, the next lookup skips it
+    assert all(f == None or not f.key == 300 for f in n.finger)
+    assert n.successor_of(500).port == 5002
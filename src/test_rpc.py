@@ -0,0 +1,126 @@
+import io
+import json
+import random
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+import rpc
+
+class Server(rpc.RpcServer):
+    # Keeps the connections it serves, so a test can close them as a peer would
+    def __init__(self, handlers):
+        super().__init__("127.0.0.1", handlers)
+        self.conns = []
+
+    def serve(self, conn):
+        self.conns.append(conn)
+        super().serve(conn)
+
+def echo(params):
+    # Answers out of order: later calls often finish first
+    time.sleep(random.random() / 100)
+    return {"n": params["n"]}, 200
+
+@pytest.fixture
+def server():
+    s = Server({"/echo": echo}).start()
+    yield s
+    s.sock.close()
+
+def test_frames_back_to_back():
+    f = io.BytesIO(rpc.encode_frame(1, ["/a", {"x": 1}]) + rpc.encode_frame(2**40, ["κ", None]))
+    request_id, payload = rpc.read_frame(f)
+    assert (request_id, json.loads(payload)) == (1, ["/a", {"x": 1}])
+    request_id, payload = rpc.read_frame(f)
+    assert (request_id, json.loads(payload)) == (2**40, ["κ", None])
+    assert rpc.read_frame(f) == (None, None)
+
+def test_truncated_frame():
+    frame = rpc.encode_frame(3, ["/a", {}])
+    assert rpc.read_frame(io.BytesIO(frame[:rpc.FRAME.size - 1])) == (None, None)
+    assert rpc.read_frame(io.BytesIO(frame[:-1])) == (None, None)
+
+def test_server_on_ephemeral_port(server):
+    assert not server.port == 0
+    client = rpc.RpcClient("127.0.0.1", server.port)
+    try:
+        assert client.call("/echo", {"n": 1}) == ({"n": 1}, 200)
+        data, status = client.call("/missing", {})
+        assert status == 404
+    finally:
+        client.close()
+
+def test_frames_split_across_writes(server):
+    # The server reassembles a frame sent a few bytes at a time,
+    # and reads two frames that arrive in one write
+    frames = rpc.encode_frame(7, ["/echo", {"n": 7}]) + rpc.encode_frame(8, ["/echo", {"n": 8}])
+    with socket.create_connection(("127.0.0.1", server.port)) as sock:
+        first = len(frames) // 2 - 3
+        for i in range(0, first, 5):
+            sock.sendall(frames[i:min(i + 5, first)])
+            time.sleep(0.001)
+        sock.sendall(frames[first:])
+        f = sock.makefile("rb")
+        responses = dict(rpc.read_frame(f) for _ in range(2))
+    assert {request_id: json.loads(payload) for request_id, payload in responses.items()} == {
+        7: [{"n": 7}, 200], 8: [{"n": 8}, 200]}
+
+def test_concurrent_calls_get_their_own_responses(server):
+    client = rpc.RpcClient("127.0.0.1", server.port)
+    results = {}
+
+    def caller(n):
+        results[n] = client.call("/echo", {"n": n})
+
+    threads = [threading.Thread(target=caller, args=(n,)) for n in range(64)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # Every response found its call
+        assert client.calls == {}
+    finally:
+        client.close()
+    assert results == {n: ({"n": n}, 200) for n in range(64)}
+
+class Peers():
+    # /rpc of the node's HTTP API, pointing at the RPC server
+    def __init__(self, rpc_port):
+        self.rpc_port = rpc_port
+
+    def get(self, ip, port, path, **kwargs):
+        r = requests.Response()
+        r.status_code = 200
+        r._content = json.dumps({"port": self.rpc_port}).encode()
+        return r
+
+def test_reconnect_after_the_peer_closes(server, monkeypatch):
+    monkeypatch.setattr(rpc, "ENABLED", True)
+    monkeypatch.setattr(rpc, "clients", {})
+    monkeypatch.setattr(rpc, "peers", Peers(server.port))
+
+    first = rpc.client("127.0.0.1", 5000)
+    assert first.call("/echo", {"n": 1}) == ({"n": 1}, 200)
+    assert rpc.client("127.0.0.1", 5000) is first
+
+    # The peer drops the connection (e.g. it restarted)
+    server.conns[0].shutdown(socket.SHUT_RDWR)
+    deadline = time.time() + 5
+    while not first.closed and time.time() < deadline:
+        time.sleep(0.01)
+    assert first.closed
+    with pytest.raises(requests.exceptions.ConnectionError):
+        first.call("/echo", {"n": 2})
+
+    second = rpc.client("127.0.0.1", 5000)
+    try:
+        assert not second is first
+        assert second.call("/echo", {"n": 3}) == ({"n": 3}, 200)
+        assert len(server.conns) == 2
+    finally:
+        second.close()
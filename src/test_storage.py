@@ -0,0 +1,169 @@
+import os
+import zlib
+
+import pytest
+
+from storage import WriteAheadLog, Storage, RecoveryError, HEADER, encode, read_segment, read_snapshot, write_snapshot
+
+def test_record_framing():
+    frame = encode(["set", "data", 7, ["k", "v"]])
+    length, crc = HEADER.unpack_from(frame)
+    payload = frame[HEADER.size:]
+    assert length == len(payload)
+    assert crc == zlib.crc32(payload)
+
+def write_segment(path, records, tail = b""):
+    with open(path, "wb") as f:
+        for record in records:
+            f.write(encode(record))
+        f.write(tail)
+
+def test_read_segment(tmp_path):
+    path = str(tmp_path / "wal-00000001.log")
+    records = [["set", "data", 1, ["a", "1"]], ["del", "data", 1]]
+    write_segment(path, records)
+    assert read_segment(path) == (records, os.path.getsize(path))
+
+def test_read_segment_stops_at_torn_tail(tmp_path):
+    path = str(tmp_path / "wal-00000001.log")
+    records = [["set", "data", 1, ["a", "1"]]]
+    torn = encode(["set", "data", 2, ["b", "2"]])[:-3]
+    write_segment(path, records, torn)
+    assert read_segment(path) == (records, len(encode(records[0])))
+
+def test_read_segment_stops_at_bad_crc(tmp_path):
+    path = str(tmp_path / "wal-00000001.log")
+    good = encode(["set", "data", 1, ["a", "1"]])
+    bad = bytearray(encode(["set", "data", 2, ["b", "2"]]))
+    bad[-1] ^= 0xff
+    with open(path, "wb") as f:
+        f.write(good + bytes(bad) + encode(["set", "data", 3, ["c", "3"]]))
+    records, end = read_segment(path)
+    assert records == [["set", "data", 1, ["a", "1"]]]
+    assert end == len(good)
+
+def test_read_segment_from_offset(tmp_path):
+    path = str(tmp_path / "wal-00000001.log")
+    records = [["set", "data", 1, ["a", "1"]], ["set", "data", 2, ["b", "2"]]]
+    write_segment(path, records)
+    offset = len(encode(records[0]))
+    assert read_segment(path, offset) == (records[1:], os.path.getsize(path))
+
+def test_replay_truncates_torn_tail(tmp_path):
+    path = str(tmp_path / "wal-00000001.log")
+    write_segment(path, [["set", "data", 1, ["a", "1"]]], b"\x05\x00")
+    log = WriteAheadLog(str(tmp_path), sync="none")
+    assert list(log.replay()) == [["set", "data", 1, ["a", "1"]]]
+    assert os.path.getsize(path) == len(encode(["set", "data", 1, ["a", "1"]]))
+
+def test_appends_after_torn_tail_are_replayed(tmp_path):
+    write_segment(str(tmp_path / "wal-00000001.log"), [["set", "data", 1, ["a", "1"]]], b"\x05\x00\x00")
+    s = Storage(str(tmp_path), sync="none", snapshot_interval=0)
+    s.data[2] = ("b", "2")
+    s.close()
+    s = Storage(str(tmp_path), sync="none", snapshot_interval=0)
+    assert dict(s.data.items()) == {1: ("a", "1"), 2: ("b", "2")}
+    s.close()
+
+@pytest.mark.parametrize("sync", ["group", "interval", "none"])
+def test_recovery_from_log(tmp_path, sync):
+    s = Storage(str(tmp_path), sync=sync, snapshot_interval=0)
+    s.data.update((k, ("key{}".format(k), "v")) for k in range(10))
+    s.replicas[100] = ("r", "v", 2)
+    del s.data[3]
+    s.data.pop_range(7, 9)
+    s.close()
+
+    s = Storage(str(tmp_path), sync=sync, snapshot_interval=0)
+    assert sorted(s.data) == [0, 1, 2, 4, 5, 6, 7]
+    assert s.replicas[100] == ("r", "v", 2)
+    assert s.recovered()
+    s.close()
+
+def test_reset_forgets_everything(tmp_path):
+    s = Storage(str(tmp_path), sync="none", snapshot_interval=0)
+    s.data[1] = ("a", "1")
+    s.reset()
+    s = Storage(str(tmp_path), sync="none", snapshot_interval=0)
+    assert not s.recovered()
+    s.close()
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot-00000001.snap")
+    tables = ({1: ("a", "1"), 2**159: ("b", "2")}, {3: ("c", "3", 2)})
+    write_snapshot(path, tables, 42)
+    stores = {"data":{}, "replicas":{}}
+    assert read_snapshot(path, stores) == 42
+    assert stores["data"] == tables[0]
+    assert stores["replicas"] == tables[1]
+
+def test_corrupted_snapshot_is_not_read(tmp_path):
+    path = str(tmp_path / "snapshot-00000001.snap")
+    write_snapshot(path, ({1: ("a", "1")}, {}))
+    with open(path, "r+b") as f:
+        f.seek(12)
+        f.write(b"X")
+    stores = {"data":{}, "replicas":{}}
+    assert read_snapshot(path, stores) == None
+    assert stores == {"data": {}, "replicas": {}}
+
+def snapshot_then_log(directory):
+    s = Storage(directory, sync="none", snapshot_interval=0)
+    s.data.update((k, ("key{}".format(k), "v")) for k in range(100))
+    s.replicas[500] = ("r", "v", 1)
+    s.snapshot()
+    # After the snapshot, only in the log
+    s.data[200] = ("new", "v")
+    del s.data[0]
+    s.replicas[500] = ("r", "w", 2)
+    s.close()
+
+def test_recovery_from_snapshot_and_log(tmp_path):
+    snapshot_then_log(str(tmp_path))
+    s = Storage(str(tmp_path), sync="none", snapshot_interval=0)
+    assert len(s.data) == 100
+    assert s.data[200] == ("new", "v")
+    assert not 0 in s.data
+    assert s.replicas[500] == ("r", "w", 2)
+    # Only the log after the snapshot is replayed
+    assert s.replayed == 3
+    s.close()
+
+def test_snapshot_compacts_log(tmp_path):
+    s = Storage(str(tmp_path), sync="none", snapshot_interval=0)
+    s.data[1] = ("a", "1")
+    s.snapshot()
+    s.data[2] = ("b", "2")
+    path = s.snapshot()
+    s.close()
+    snapshots = [n for n in os.listdir(str(tmp_path)) if n.endswith(".snap")]
+    assert snapshots == [os.path.basename(path)]
+    assert min(s.log.segment_number(p) for p in s.log.segments()) == s.snapshot_number(path)
+
+def test_recovery_refused_without_valid_snapshot(tmp_path):
+    snapshot_then_log(str(tmp_path))
+    s = Storage(str(tmp_path), sync="none", snapshot_interval=0)
+    s.snapshot()
+    s.close()
+    for name in os.listdir(str(tmp_path)):
+        if name.endswith(".snap"):
+            with open(str(tmp_path / name), "r+b") as f:
+                f.seek(12)
+                f.write(b"X")
+    with pytest.raises(RecoveryError):
+        Storage(str(tmp_path), sync="none", snapshot_interval=0)
+
+def test_writes_during_snapshot_are_recovered(tmp_path):
+    s = Storage(str(tmp_path), sync="none", snapshot_interval=0)
+    s.data[1] = ("a", "1")
+    # A write between the copy of the stores and the log rotation
+    rotate = s.log.checkpoint
+    def checkpoint():
+        s.data[2] = ("b", "2")
+        return rotate()
+    s.log.checkpoint = checkpoint
+    s.snapshot()
+    s.close()
+    s = Storage(str(tmp_path), sync="none", snapshot_interval=0)
+    assert dict(s.data.items()) == {1: ("a", "1"), 2: ("b", "2")}
+    s.close()
@@ -0,0 +1,71 @@
+from store import KeyStore
+
+def store(hashes):
+    return KeyStore((k, ("key{}".format(k), "value{}".format(k))) for k in hashes)
+
+def test_range_items_in_order():
+    s = store([50, 10, 40, 20, 30])
+    assert [k for (k, _) in s.range_items(15, 40)] == [20, 30, 40]
+
+def test_range_is_open_at_start_closed_at_end():
+    s = store([10, 20, 30])
+    assert s.range_keys(10, 30) == [20, 30]
+
+def test_range_wraps_around_zero():
+    s = store([5, 10, 20, 30, 90])
+    assert s.range_keys(25, 7) == [30, 90, 5]
+
+def test_range_of_whole_ring():
+    # start == end is the whole ring, as for a node alone in chord
+    s = store([5, 10, 20])
+    assert sorted(s.range_keys(10, 10)) == [5, 10, 20]
+
+def test_pop_range_wraps_around_zero():
+    s = store([5, 10, 20, 30, 90])
+    popped = s.pop_range(25, 7)
+    assert sorted(k for (k, _) in popped) == [5, 30, 90]
+    assert sorted(s) == [10, 20]
+    assert s.hashes == [10, 20]
+    assert s.range_keys(0, 100) == [10, 20]
+
+def test_pop_range_returns_values():
+    s = store([1, 2, 3])
+    assert dict(s.pop_range(1, 3)) == {2: ("key2", "value2"), 3: ("key3", "value3")}
+    assert len(s) == 1
+
+def test_pop_empty_range():
+    s = store([10, 20])
+    assert s.pop_range(11, 19) == []
+    assert s.hashes == [10, 20]
+
+def test_setitem_and_delitem_keep_hashes_sorted():
+    s = store([10, 30])
+    s[20] = ("a", "b")
+    s[20] = ("a", "c")
+    assert s.hashes == [10, 20, 30]
+    del s[10]
+    assert s.hashes == [20, 30]
+    assert s[20] == ("a", "c")
+
+def test_update_merges_hashes():
+    s = store([10, 30])
+    s.update([(20, ("a", "b")), (30, ("c", "d")), (5, ("e", "f"))])
+    assert s.hashes == [5, 10, 20, 30]
+    assert s[30] == ("c", "d")
+
+def test_update_with_many_sorted_chunks():
+    # As a join consumes a /transferKeys stream: sorted chunks, mostly after
+    # the keys already there, some of them falling in between
+    s = store(range(0, 3000, 3))
+    chunks = [[(k, ("key{}".format(k), "value{}".format(k))) for k in range(start, start + 100)]
+              for start in range(3000, 13000, 100)]
+    chunks.append([(k, ("key{}".format(k), "value{}".format(k))) for k in range(1, 3000, 3)])
+    for chunk in chunks:
+        s.update(chunk)
+    expected = sorted(set(range(0, 3000, 3)) | set(range(1, 3000, 3)) | set(range(3000, 13000)))
+    assert s.hashes == expected
+    assert len(s) == len(expected)
+    assert len(s.range_keys(2999, 12999)) == 10000
+    assert len(s.range_items(12000, 2)) == 999 + 2
+    assert len(s.page(-1, 500)) == 500
+    assert [k for (k, _) in s.page(12900, 500)] == list(range(12901, 13000))
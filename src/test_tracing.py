@@ -0,0 +1,84 @@
+import time
+
+import tracing
+from tracing import Tracer, assemble, called, carry
+
+def test_spans_across_nodes():
+    # A serves /query and forwards it to B, which reads the replica from C
+    a, b, c = Tracer(), Tracer(), Tracer()
+    token_a = a.begin("A", "/query", {"key": "k"})
+    trace = tracing.trace_id()
+
+    start_b = time.perf_counter()
+    params_b = carry("/query", {"key": "k"})
+    assert params_b == {"key": "k", "trace": trace, "trace_hop": 1}
+    token_b = b.begin("B", "/query", params_b)
+    start_c = time.perf_counter()
+    token_c = c.begin("C", "/queryReplicas", carry("/queryReplicas", {"key": "k"}))
+    c.end(token_c, 200)
+    called("C", "/queryReplicas", start_c, 200)
+    b.end(token_b, 200)
+    called("B", "/query", start_b, 200)
+    # Untraced paths keep their params and open no span
+    assert carry("/membership", {"x": 1}) == {"x": 1}
+    called("B", "/membership", time.perf_counter(), None)
+    a.end(token_a, 200)
+    assert tracing.trace_id() == None
+
+    spans = a.find(trace) + b.find(trace) + c.find(trace)
+    assert [(s["node"], s["hop"], s["path"]) for s in spans] == [("A", 0, "/query"), ("B", 1, "/query"), ("C", 2, "/queryReplicas")]
+    assert [(call["peer"], call["hop"], call["status"]) for call in spans[0]["calls"]] == [("B", 1, 200), ("B", None, None)]
+    assert [(call["peer"], call["hop"]) for call in spans[1]["calls"]] == [("C", 2)]
+
+    result = assemble(trace, spans)
+    assert result["hops"] == 2
+    assert result["nodes"] == ["A", "B", "C"]
+    assert result["total_ms"] == spans[0]["ms"]
+    assert spans[0]["calls"][0]["transit_ms"] == spans[0]["calls"][0]["ms"] - spans[1]["ms"]
+    assert spans[1]["calls"][0]["transit_ms"] == spans[1]["calls"][0]["ms"] - spans[2]["ms"]
+    assert not "transit_ms" in spans[0]["calls"][1]
+
+def span(node, hop, path, ms, calls = ()):
+    return {"trace": "t", "hop": hop, "node": node, "path": path, "key": "k", "start": hop, "ms": ms, "status": 200,
+            "calls": [{"peer": peer, "path": call_path, "hop": call_hop, "ms": call_ms, "status": 200}
+                      for (peer, call_path, call_hop, call_ms) in calls]}
+
+def test_assemble_matches_calls_to_their_spans():
+    # A fans a batch out to B and C, B passes a replica on to C
+    spans = [
+        span("C", 2, "/insertReplicas", 1.0),
+        span("B", 1, "/insertBatch", 6.0, [("C", "/insertReplicas", 2, 2.0)]),
+        span("C", 1, "/insertBatch", 3.0),
+        span("A", 0, "/insertBatch", 16.0, [("B", "/insertBatch", 1, 8.0), ("C", "/insertBatch", 1, 4.0)]),
+    ]
+    result = assemble("t", spans)
+    assert result["hops"] == 2
+    assert result["nodes"] == ["A", "B", "C", "C"]
+    assert result["total_ms"] == 16.0
+    a, b, c1, c2 = result["spans"]
+    assert [call["transit_ms"] for call in a["calls"]] == [2.0, 1.0]
+    assert [call["transit_ms"] for call in b["calls"]] == [1.0]
+    assert (a["self_ms"], b["self_ms"], c1["self_ms"], c2["self_ms"]) == (4.0, 4.0, 3.0, 1.0)
+    assert result["self_ms_by_path"] == {"/insertBatch": 11.0, "/insertReplicas": 1.0}
+    assert result["transit_ms"] == 4.0
+
+def test_assemble_without_spans():
+    assert assemble("t", []) == {"trace": "t", "hops": 0, "nodes": [], "total_ms": None,
+                                 "self_ms_by_path": {}, "transit_ms": 0, "spans": []}
+
+def test_tracer_keeps_the_last_spans():
+    tracer = Tracer(3)
+    traces = []
+    for i in range(5):
+        tracer.end(tracer.begin("A", "/query", {"trace": "t{}".format(i)}), 200)
+        traces.append("t{}".format(i))
+    assert [len(tracer.find(trace)) for trace in traces] == [0, 0, 1, 1, 1]
+    assert [s.trace for s in tracer.spans] == ["t2", "t3", "t4"]
+
+def test_disabled_tracer():
+    tracer = Tracer(0)
+    assert tracer.begin("A", "/query", {}) == None
+    tracer.end(None, 200)
+    assert len(tracer.spans) == 0
+    # Only the TRACED paths open spans
+    assert Tracer().begin("A", "/membership", {}) == None
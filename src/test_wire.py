@@ -0,0 +1,40 @@
+import wire
+
+def test_entries_round_trip():
+    entries = [(2**160 - 1, "key", "value", None), (0, "κλειδί", "τιμή", 0), (12345, "", "", 2)]
+    assert wire.decode_entries(wire.encode_entries(entries)) == (entries, len(wire.encode_entries(entries)))
+
+def test_entries_without_hash():
+    buf = wire.encode_entries([(7, "a", "b", 1)], with_hash=False)
+    assert wire.decode_entries(buf)[0] == [(None, "a", "b", 1)]
+
+def test_entries_from_offset():
+    first = wire.encode_entries([(1, "a", "b", None)])
+    second = wire.encode_entries([(2, "c", "d", 1)])
+    entries, offset = wire.decode_entries(first + second)
+    assert offset == len(first)
+    assert wire.decode_entries(first + second, offset)[0] == [(2, "c", "d", 1)]
+
+def test_no_entries():
+    assert wire.decode_entries(wire.encode_entries([])) == ([], wire.ENTRIES.size)
+
+def test_hashes_round_trip():
+    hashes = [0, 1, 2**160 - 1, 2**80]
+    assert wire.decode_hashes(wire.encode_hashes(hashes)) == hashes
+    assert wire.decode_hashes(wire.encode_hashes(iter([]))) == []
+
+def test_result_round_trip():
+    data = {"hash": 42, "key": "k", "value": "v", "replica_number": 2, "node_ip": "10.0.0.1", "node_port": 5000}
+    assert wire.decode_result(wire.encode_result(data)) == data
+
+def test_frames_across_chunks():
+    payloads = [b"one", b"", b"three" * 100]
+    stream = b"".join(wire.frame(p) for p in payloads)
+    # Chunks that split headers & payloads anywhere
+    chunks = [stream[i:i + 3] for i in range(0, len(stream), 3)]
+    assert list(wire.read_frames(chunks)) == payloads
+    assert list(wire.read_frames([stream])) == payloads
+
+def test_incomplete_frame_is_not_yielded():
+    stream = wire.frame(b"whole") + wire.frame(b"partial")[:-2]
+    assert list(wire.read_frames([stream])) == [b"whole"]
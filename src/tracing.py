@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+
+# Request tracing across the hops of the ring. A request to one of the
+# TRACED paths opens a span on the node serving it; the span records the
+# calls the node makes to other nodes, and the trace id & hop number
+# travel with those calls (params "trace" & "trace_hop"), so the next
+# node opens the next span of the same trace. Spans are kept in a bounded
+# buffer per server, /trace/<id> collects them from the ring.
+
+# Spans kept per server, 0 disables tracing
+TRACE_SPANS = int(os.environ.get("CHORDIFY_TRACE_SPANS", 10000))
+# Paths that open a span and carry the trace on
+TRACED = {"/insert", "/query", "/delete", "/insertReplicas", "/insertReplicasBatch",
+          "/queryReplicas", "/deleteReplicas", "/fixReplicas", "/initfixReplicas"}
+
+# Span of the request being served, per thread or asyncio task
+current = contextvars.ContextVar("span", default=None)
+
+def new_id():
+    return "{:016x}".format(random.getrandbits(64))
+
+class Span():
+    def __init__(self, trace, hop, node, path, key):
+        self.trace = trace
+        self.hop = hop
+        self.node = node
+        self.path = path
+        self.key = key
+        self.start = time.time()
+        self.clock = time.perf_counter()
+        self.ms = None
+        self.status = None
+        # [peer, path, hop of the span it opens (None if untraced), ms, status]
+        self.calls = []
+
+    def to_dict(self):
+        return {
+            "trace": self.trace,
+            "hop": self.hop,
+            "node": self.node,
+            "path": self.path,
+            "key": self.key,
+            "start": self.start,
+            "ms": self.ms,
+            "status": self.status,
+            "calls": [{"peer":peer, "path":path, "hop":hop, "ms":ms, "status":status} for (peer, path, hop, ms, status) in self.calls],
+        }
+
+class Tracer():
+    """
+        Spans of the requests served by a node, the last TRACE_SPANS of
+        them. Older spans are dropped as new ones come.
+    """
+
+    def __init__(self, size = TRACE_SPANS):
+        self.spans = deque(maxlen=max(size, 1))
+        self.enabled = size > 0
+        self.lock = threading.Lock()
+
+    def begin(self, node, path, params):
+        # Open a span for a request to path with params, returns a token for
+        # end() or None if the request is not traced
+        if not self.enabled or not path in TRACED:
+            return None
+        span = Span(params.get("trace") or new_id(), int(params.get("trace_hop", 0)), node, path, params.get("key"))
+        return span, current.set(span)
+
+    def end(self, token, status):
+        if token == None:
+            return
+        span, reset = token
+        span.ms = (time.perf_counter() - span.clock) * 1000
+        span.status = status
+        current.reset(reset)
+        with self.lock:
+            self.spans.append(span)
+
+    def find(self, trace):
+        with self.lock:
+            spans = [span for span in self.spans if span.trace == trace]
+        return [span.to_dict() for span in spans]
+
+def trace_id():
+    # Id of the trace of the request being served, None if untraced
+    span = current.get()
+    return span.trace if span != None else None
+
+def carry(path, params):
+    # params of a call to path, with the trace of the request being served
+    span = current.get()
+    if span == None or not path in TRACED:
+        return params
+    return dict(params or {}, trace=span.trace, trace_hop=span.hop + 1)
+
+def called(peer, path, start, status):
+    # Record a call that started at start (time.perf_counter()) on the
+    # span being served. status is None if the call failed.
+    span = current.get()
+    if span == None:
+        return
+    hop = span.hop + 1 if path in TRACED else None
+    span.calls.append((peer, path, hop, (time.perf_counter() - start) * 1000, status))
+
+def assemble(trace, spans):
+    # The path of a trace out of the spans of every node. Each span gets
+    # self_ms, its time minus the calls it made, and each call the span
+    # it opened gets transit_ms, the time spent between the two nodes
+    # (network, waiting for a thread, encoding).
+    spans = sorted(spans, key=lambda s: (s["hop"], s["start"]))
+    unmatched = list(spans)
+    for span in spans:
+        span["self_ms"] = span["ms"] - sum(c["ms"] for c in span["calls"])
+        for c in span["calls"]:
+            child = next((s for s in unmatched if s["hop"] == c["hop"] and s["node"] == c["peer"] and s["path"] == c["path"]), None)
+            if child != None:
+                unmatched.remove(child)
+                c["transit_ms"] = c["ms"] - child["ms"]
+
+    by_path = {}
+    for span in spans:
+        by_path[span["path"]] = by_path.get(span["path"], 0.0) + span["self_ms"]
+    entry = [s for s in spans if s["hop"] == 0]
+    return {
+        "trace": trace,
+        "hops": max(s["hop"] for s in spans) if spans else 0,
+        "nodes": [s["node"] for s in spans],
+        "total_ms": entry[0]["ms"] if entry else None,
+        "self_ms_by_path": by_path,
+        "transit_ms": sum(c.get("transit_ms", 0.0) for s in spans for c in s["calls"]),
+        "spans": spans,
+    }
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+import os
+import json
+import struct
+import threading
+import requests
+
+from pool import peers
+
+# Compact binary encoding of the internal (node to node) endpoints.
+# A node asks every peer once for its wire version (GET /wire) and
+# talks JSON to peers that do not support it (older nodes).
+VERSION = 1
+MIME = "application/x-chordify-v{}".format(VERSION)
+# CHORDIFY_WIRE=json turns the binary encoding off
+ENABLED = os.environ.get("CHORDIFY_WIRE", "binary") == "binary"
+HEADERS = {"Content-Type": MIME, "Accept": MIME}
+ACCEPT = {"Accept": MIME}
+
+# Entries message: count, flags, then for every entry:
+# [20 byte key hash] replica number (-1 for primary keys), key length, value length, key, value
+ENTRIES = struct.Struct("<IB")
+ENTRY = struct.Struct("<iII")
+HAS_HASH = 1
+# Hashes message: count, then 20 bytes per hash
+COUNT = struct.Struct("<I")
+# A query result is an entries message followed by node ip length, node port, node ip
+NODE = struct.Struct("<IH")
+# Streams are sequences of frames: payload length, payload
+FRAME = struct.Struct("<I")
+
+versions = {}
+lock = threading.Lock()
+
+def binary(ip, port):
+    # True if the peer understands our binary encoding
+    if not ENABLED:
+        return False
+    with lock:
+        version = versions.get((ip, port))
+    if version == None:
+        try:
+            r = peers.get(ip, port, "/wire")
+            version = r.json()["version"] if r.status_code == 200 else 0
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            # Unreachable peer, ask again next time
+            return False
+        with lock:
+            versions[(ip, port)] = version
+    return version >= VERSION
+
+def request(method, ip, port, path, encode, fallback, params = None, **kwargs):
+    # encode() builds the binary body & fallback() the JSON one,
+    # only the encoding the peer understands is built
+    if binary(ip, port):
+        return peers.request(method, ip, port, path, params=params, data=encode(), headers=HEADERS, **kwargs)
+    return peers.request(method, ip, port, path, params=params, json=json.dumps(fallback()), **kwargs)
+
+def is_binary(message):
+    # Works for both Flask requests and responses of requests
+    return message.headers.get("Content-Type", "").startswith(MIME)
+
+def accepts(message):
+    return MIME in message.headers.get("Accept", "")
+
+def encode_hash(key_hash):
+    return key_hash.to_bytes(20, "big")
+
+def decode_hash(raw):
+    return int.from_bytes(raw, "big")
+
+def encode_entries(entries, with_hash = True):
+    # entries: (key_hash, key, value, replica_number or None)
+    parts = [b""]
+    append = parts.append
+    pack = ENTRY.pack
+    count = 0
+    for key_hash, key, value, replica_number in entries:
+        key, value = key.encode(), value.encode()
+        if with_hash:
+            append(key_hash.to_bytes(20, "big"))
+        append(pack(-1 if replica_number == None else replica_number, len(key), len(value)))
+        append(key)
+        append(value)
+        count += 1
+    parts[0] = ENTRIES.pack(count, HAS_HASH if with_hash else 0)
+    return b"".join(parts)
+
+def decode_entries(buf, offset = 0):
+    # Returns the entries and the offset after them
+    count, flags = ENTRIES.unpack_from(buf, offset)
+    offset += ENTRIES.size
+    with_hash = flags & HAS_HASH
+    unpack = ENTRY.unpack_from
+    entries = []
+    append = entries.append
+    key_hash = None
+    for _ in range(count):
+        if with_hash:
+            key_hash = int.from_bytes(buf[offset:offset + 20], "big")
+            offset += 20
+        replica_number, key_length, value_length = unpack(buf, offset)
+        offset += ENTRY.size
+        key = str(buf[offset:offset + key_length], "utf-8")
+        offset += key_length
+        value = str(buf[offset:offset + value_length], "utf-8")
+        offset += value_length
+        append((key_hash, key, value, None if replica_number < 0 else replica_number))
+    return entries, offset
+
+def encode_hashes(hashes):
+    hashes = list(hashes)
+    return COUNT.pack(len(hashes)) + b"".join(encode_hash(h) for h in hashes)
+
+def decode_hashes(buf):
+    count, = COUNT.unpack_from(buf, 0)
+    return [int.from_bytes(buf[o:o + 20], "big") for o in range(COUNT.size, COUNT.size + 20 * count, 20)]
+
+def encode_result(data):
+    # Single key result of /queryReplicas
+    ip = data["node_ip"].encode()
+    entry = (data["hash"], data["key"], data["value"], data["replica_number"])
+    return encode_entries([entry]) + NODE.pack(len(ip), data["node_port"]) + ip
+
+def decode_result(buf):
+    entries, offset = decode_entries(buf)
+    key_hash, key, value, replica_number = entries[0]
+    ip_length, port = NODE.unpack_from(buf, offset)
+    offset += NODE.size
+    return {
+        "hash": key_hash,
+        "key": key,
+        "value": value,
+        "replica_number": replica_number,
+        "node_ip": str(buf[offset:offset + ip_length], "utf-8"),
+        "node_port": port,
+    }
+
+def frame(payload):
+    return FRAME.pack(len(payload)) + payload
+
+def read_frames(chunks):
+    # Yields the payloads of a stream of frames, given as chunks of bytes
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        offset = 0
+        while len(buf) - offset >= FRAME.size:
+            length, = FRAME.unpack_from(buf, offset)
+            if len(buf) - offset - FRAME.size < length:
+                break
+            yield bytes(buf[offset + FRAME.size:offset + FRAME.size + length])
+            offset += FRAME.size + length
+        del buf[:offset]